@@ -0,0 +1,62 @@
+'''Time the planning done by `ruskit addslave --peek` on a large cluster.
+
+    python benchmarks/bench_addslaves.py [instances] [hosts]
+
+By default 5000 instances on 200 hosts: 1000 masters, half of them
+without a slave, and 3500 new instances waiting for masters.
+'''
+from __future__ import print_function
+
+import sys
+import time
+
+from ruskit.distribute import MaxFlowSolver
+
+
+class FakeNode(object):
+    def __init__(self, host, port, name, master=None):
+        self.host = host
+        self.port = port
+        self.node_info = {
+            'name': name,
+            'flags': ['slave'] if master else ['master'],
+            'replicate': master.node_info['name'] if master else '-',
+        }
+
+    def is_master(self):
+        return 'master' in self.node_info['flags']
+
+
+def gen_cluster(instances, host_count):
+    hosts = ['10.0.{}.{}'.format(i // 256, i % 256) for i in range(host_count)]
+    master_count = instances // 5
+    nodes, new_nodes = [], []
+    for i in range(master_count):
+        nodes.append(FakeNode(hosts[i % host_count], 7000 + i, 'm{}'.format(i)))
+    for i, m in enumerate(nodes[:master_count // 2]):
+        host = hosts[(i + 1) % host_count]
+        nodes.append(FakeNode(host, 8000 + i, 's{}'.format(i), m))
+    for i in range(instances - len(nodes)):
+        new_nodes.append(FakeNode(hosts[(i + 7) % host_count], 9000 + i,
+                                  'f{}'.format(i)))
+    return nodes, new_nodes
+
+
+def main():
+    instances = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    host_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    nodes, new_nodes = gen_cluster(instances, host_count)
+
+    start = time.time()
+    solver = MaxFlowSolver.from_nodes(nodes, new_nodes)
+    result, frees = solver.distribute_slaves()
+    elapsed = time.time() - start
+
+    for f, m in result:
+        assert f.host_index != m.host_index
+    print('{} instances on {} hosts: {} slaves planned, {} left, {:.3f}s'
+          .format(instances, host_count, len(result), len(frees), elapsed))
+
+
+if __name__ == '__main__':
+    main()
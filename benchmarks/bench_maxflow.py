@@ -0,0 +1,66 @@
+'''Compare ruskit.maxflow with python-igraph on the host graphs built by
+MaxFlowSolver._fill_remaining. igraph is optional here.
+
+    python benchmarks/bench_maxflow.py
+'''
+from __future__ import print_function
+
+import random
+import time
+
+from ruskit.maxflow import Graph
+
+try:
+    import igraph
+except ImportError:
+    igraph = None
+
+HOST_COUNTS = (3, 10, 50, 100, 200, 500)
+SLAVES_PER_HOST = 10
+MASTERS_PER_HOST = 5
+
+
+def gen_capacities(ct):
+    random.seed(ct)
+    s, t = 2 * ct, 2 * ct + 1
+    frees = [random.randint(0, SLAVES_PER_HOST) for _ in range(ct)]
+    edges = []
+    for i in range(ct):
+        edges.append((s, i, frees[i]))
+        edges.append((ct + i, t, sum(frees)))
+    for i in range(ct):
+        for j in range(ct):
+            if i != j:
+                edges.append((i, ct + j, min(frees[i], MASTERS_PER_HOST)))
+    return s, t, [e for e in edges if e[2]]
+
+
+def run(graph_cls, ct, edges, s, t):
+    start = time.time()
+    g = graph_cls().as_directed()
+    g.add_vertices(2 * ct + 2)
+    g.es['weight'] = 1
+    for i, j, c in edges:
+        g[i, j] = c
+    mf = g.maxflow(s, t, g.es['weight'])
+    return time.time() - start, int(mf.value)
+
+
+def main():
+    print('{:>6} {:>8} {:>12} {:>12}'.format(
+        'hosts', 'edges', 'ruskit(s)', 'igraph(s)'))
+    for ct in HOST_COUNTS:
+        s, t, edges = gen_capacities(ct)
+        elapsed, value = run(Graph, ct, edges, s, t)
+        if igraph is None:
+            other = '-'
+        else:
+            other_elapsed, other_value = run(igraph.Graph, ct, edges, s, t)
+            assert value == other_value
+            other = '{:.4f}'.format(other_elapsed)
+        print('{:>6} {:>8} {:>12.4f} {:>12}'.format(
+            ct, len(edges), elapsed, other))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+'''Keys per second of ruskit.slots: key_slot one key at a time, and
+key_slots with the 16 bit word table and with NumPy, which is optional
+here.
+
+    PYTHONPATH=. python benchmarks/bench_slots.py
+'''
+from __future__ import print_function
+
+import time
+
+from ruskit.slots import key_slot, key_slots
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+KEY_COUNT = 1000000
+KEY_FORMATS = ('user:{}', 'user:{}:profile:settings', '{{user{}}}:followers')
+
+
+def run(func, keys):
+    start = time.time()
+    slots = func(keys)
+    return len(keys) / (time.time() - start), list(slots)
+
+
+def main():
+    print('{:>28} {:>12} {:>12} {:>12}'.format(
+        'keys', 'key_slot/s', 'words/s', 'numpy/s'))
+    for fmt in KEY_FORMATS:
+        keys = [fmt.format(i) for i in xrange(KEY_COUNT)]
+        single, expected = run(lambda ks: [key_slot(k) for k in ks], keys)
+        words, slots = run(lambda ks: key_slots(ks, vectorize=False), keys)
+        assert slots == expected
+        if numpy is None:
+            vectorized = '-'
+        else:
+            rate, slots = run(lambda ks: key_slots(ks, vectorize=True), keys)
+            assert slots == expected
+            vectorized = '{:.0f}'.format(rate)
+        print('{:>28} {:>12.0f} {:>12.0f} {:>12}'.format(
+            fmt.format('N'), single, words, vectorized))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+'''Continuous balancing of the load of the masters.
+
+`AutoBalancer` measures the load of every master at each step, memory,
+keys or ops/sec, and its skew, the load of the busiest master over the
+mean. Once the skew has stayed above `high` for `window` seconds, every
+step moves a few slots from the busiest master to the idlest one, until
+the skew falls under `low`. The gap between the two thresholds keeps it
+from moving slots back and forth around a single threshold.
+
+The load and the bytes of a slot are the ones of its master in
+proportion to its keys, from `CLUSTER COUNTKEYSINSLOT`. The heaviest
+slots fitting in the load over the mean are moved first, so that a step
+moves as few slots as possible.
+
+No slot is moved during the quiet hours, and the bytes moved within the
+last hour never exceed `max_bytes_per_hour`.
+'''
+import collections
+import logging
+import time
+
+from ruskit import cli
+from .replication import parse_size, format_size
+from .utils import echo, concurrent_map, DEFAULT_WORKERS
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+METRICS = ('memory', 'keys', 'ops')
+HIGH_SKEW = 0.2
+LOW_SKEW = 0.1
+# seconds the skew must stay above HIGH_SKEW before any move
+SKEW_WINDOW = 600
+CHECK_INTERVAL = 60
+# slots moved by a single step
+STEP_SLOTS = 16
+MAX_BYTES_PER_HOUR = 1 << 30
+
+
+def parse_quiet_hours(spec):
+    '''`22:00-06:30` -> (1320, 390), in minutes of the day'''
+    try:
+        start, end = spec.split('-')
+        return tuple(int(h) * 60 + int(m) for h, m in
+                     (t.split(':') for t in (start, end)))
+    except ValueError:
+        raise ValueError('expected HH:MM-HH:MM, got {!r}'.format(spec))
+
+
+def in_quiet_hours(quiet_hours, now):
+    t = time.localtime(now)
+    minute = t.tm_hour * 60 + t.tm_min
+    for start, end in quiet_hours:
+        if start <= end and start <= minute < end:
+            return True
+        # over midnight
+        if start > end and (minute >= start or minute < end):
+            return True
+    return False
+
+
+def node_load(node):
+    '''{'memory': used_memory, 'keys': keys of db0, 'ops': ops/sec}'''
+    info = node.info()
+    return {
+        'memory': info.get('used_memory', 0),
+        'keys': info.get('db0', {}).get('keys', 0),
+        'ops': info.get('instantaneous_ops_per_sec', 0),
+    }
+
+
+def slot_keys(node):
+    '''{slot: keys} of all the slots of `node`'''
+    slots = sorted(node.slots)
+    pipe = node.pipeline(transaction=False)
+    for slot in slots:
+        pipe.execute_command('CLUSTER COUNTKEYSINSLOT', slot)
+    return dict(zip(slots, pipe.execute()))
+
+
+def skew(loads):
+    '''Load of the busiest node over the mean, minus one'''
+    if not loads:
+        return 0
+    mean = float(sum(loads.values())) / len(loads)
+    if mean <= 0:
+        return 0
+    return max(loads.values()) / mean - 1
+
+
+class AutoBalancer(object):
+    def __init__(self, cluster, metric='memory', high=HIGH_SKEW,
+                 low=LOW_SKEW, window=SKEW_WINDOW, quiet_hours=(),
+                 max_bytes_per_hour=MAX_BYTES_PER_HOUR,
+                 step_slots=STEP_SLOTS, workers=DEFAULT_WORKERS):
+        assert metric in METRICS and low <= high
+        self.cluster = cluster
+        self.metric = metric
+        self.high = high
+        self.low = low
+        self.window = window
+        self.quiet_hours = quiet_hours
+        self.max_bytes_per_hour = max_bytes_per_hour
+        self.step_slots = step_slots
+        self.workers = workers
+        # when the skew went above `high`, None while it is under
+        self.skewed_since = None
+        self.balancing = False
+        # (time, bytes) of the moves of the last hour
+        self.moved = collections.deque()
+
+    def measure(self):
+        '''{master: load dict} of all the masters'''
+        loads = {}
+        for node, load, err in concurrent_map(
+                node_load, self.cluster.masters, self.workers):
+            if err is not None:
+                logger.warning('failed to get info of %s: %s', node, err)
+                continue
+            loads[node] = load
+        return loads
+
+    def budget(self, now):
+        while self.moved and now - self.moved[0][0] >= 3600:
+            self.moved.popleft()
+        return self.max_bytes_per_hour - sum(b for _, b in self.moved)
+
+    def update(self, current, now):
+        '''Hysteresis: start balancing once the skew stayed above `high`
+        for `window` seconds, stop when it falls under `low`.
+        '''
+        if current > self.high:
+            if self.skewed_since is None:
+                self.skewed_since = now
+            if now - self.skewed_since >= self.window:
+                self.balancing = True
+        else:
+            self.skewed_since = None
+        if current < self.low:
+            self.balancing = False
+        return self.balancing
+
+    def plan(self, loads, now):
+        '''(src, dst, slots, bytes) moving part of the load over the mean
+        of the busiest master to the idlest one, within the budget.
+        '''
+        metric = dict((n, l[self.metric]) for n, l in loads.iteritems())
+        src = max(metric, key=metric.get)
+        dst = min(metric, key=metric.get)
+        if src is dst or len(src.slots) <= 1:
+            return None
+        keys = slot_keys(src)
+        total = sum(keys.values())
+        if total <= 0:
+            return None
+        mean = float(sum(metric.values())) / len(metric)
+        need = metric[src] - mean
+        per_key = float(metric[src]) / total
+        bytes_per_key = float(loads[src]['memory']) / total
+        budget = self.budget(now)
+
+        slots, moved = [], 0
+        # the last slot always stays
+        heaviest = sorted(keys, key=lambda s: (-keys[s], s))[:-1]
+        for slot in heaviest:
+            if len(slots) >= self.step_slots or keys[slot] <= 0:
+                break
+            load = keys[slot] * per_key
+            size = int(keys[slot] * bytes_per_key)
+            if load > need or moved + size > budget:
+                continue
+            slots.append(slot)
+            need -= load
+            moved += size
+        if not slots:
+            return None
+        return src, dst, sorted(slots), moved
+
+    def step(self, now=None):
+        '''Measure and move some slots if needed, return the move done'''
+        if now is None:
+            now = time.time()
+        self.cluster.flush_all_cache()
+        if not self.cluster.consistent():
+            logger.warning('cluster not consistent, skipping')
+            return None
+        loads = self.measure()
+        current = skew(dict((n, l[self.metric])
+                            for n, l in loads.iteritems()))
+        logger.info('%s skew %.2f', self.metric, current)
+        if not self.update(current, now):
+            return None
+        if in_quiet_hours(self.quiet_hours, now):
+            logger.info('quiet hours, not moving any slot')
+            return None
+        move = self.plan(loads, now)
+        if move is None:
+            return None
+        src, dst, slots, moved = move
+        echo('Moving {} slots ({}) from {} to {}, {} skew {:.2f}'.format(
+            len(slots), format_size(moved), src.gen_addr(), dst.gen_addr(),
+            self.metric, current))
+        # charged first, a step failing halfway still moved some bytes
+        self.moved.append((now, moved))
+        masters = self.cluster.masters
+        try:
+            for slot in slots:
+                self.cluster.migrate_slot(src, dst, slot, verbose=False,
+                                          masters=masters)
+        finally:
+            self.cluster.flush_all_cache()
+        return src, dst, slots
+
+    def run(self, interval=CHECK_INTERVAL):
+        while not self.cluster.check_action_stopped():
+            try:
+                self.step()
+            except Exception as e:
+                logger.exception('balancing step failed: %s', e)
+            time.sleep(interval)
+
+
+def balancer_arguments(func):
+    func = cli.argument("--max-bytes-per-hour", dest="max_bytes_per_hour",
+                        default='1g', type=parse_size)(func)
+    func = cli.argument("--quiet-hours", dest="quiet_hours",
+                        action="append", default=[], type=parse_quiet_hours,
+                        help="HH:MM-HH:MM without any move, repeatable")(func)
+    func = cli.argument("--window", type=int, default=SKEW_WINDOW,
+                        help="seconds the skew must last")(func)
+    func = cli.argument("--low", type=float, default=LOW_SKEW)(func)
+    func = cli.argument("--high", type=float, default=HIGH_SKEW)(func)
+    func = cli.argument("--interval", type=int, default=CHECK_INTERVAL)(func)
+    return cli.argument("--metric", choices=METRICS, default='memory')(func)
@@ -0,0 +1,127 @@
+'''Capacity weights of the masters for the slot planners.
+
+On a fleet mixing small and big machines, every master should own a
+share of the slots proportional to what it can hold, not the same number.
+The weights are either declared in a file of `<host[:port]> <weight>`
+lines, the weight of a host being split evenly over its masters and the
+host names resolved like in a topology file, or
+derived from the `maxmemory` of every master. Redis does not expose the
+number of CPUs of its host, so a CPU based weight has to be declared per
+host in the file.
+'''
+from collections import defaultdict
+import logging
+import socket
+
+from ruskit import cli
+from .utils import concurrent_map, DEFAULT_WORKERS, RuskitException
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+WEIGHT_SOURCES = ('maxmemory',)
+
+
+class InvalidWeights(RuskitException):
+    pass
+
+
+def load_weights(path):
+    '''`{'10.0.0.1': 128.0, '10.0.0.2:7000': 32.0}` from a file of
+    `<host[:port]> <weight>` lines, `#` starts a comment
+    '''
+    weights = {}
+    with open(path) as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            try:
+                addr, weight = line.split()
+                weight = float(weight)
+            except ValueError:
+                raise InvalidWeights(
+                    '{}:{}: expected `<host[:port]> <weight>`'.format(
+                        path, lineno))
+            if weight <= 0:
+                raise InvalidWeights('{}:{}: weight must be positive'.format(
+                    path, lineno))
+            host, sep, port = addr.partition(':')
+            try:
+                host = socket.gethostbyname(host)
+            except socket.error as e:
+                raise InvalidWeights('{}:{}: can not resolve {}: {}'.format(
+                    path, lineno, host, e))
+            weights[host + sep + port] = weight
+    return weights
+
+
+def _masters_per_host(masters):
+    count = defaultdict(int)
+    for m in masters:
+        count[m.host] += 1
+    return count
+
+
+def declared_weights(masters, declared):
+    '''Weights by node name, `host:port` entries win over `host` ones'''
+    per_host = _masters_per_host(masters)
+    weights = {}
+    missing = []
+    for m in masters:
+        if m.gen_addr() in declared:
+            weights[m.name] = declared[m.gen_addr()]
+        elif m.host in declared:
+            weights[m.name] = declared[m.host] / per_host[m.host]
+        else:
+            missing.append(m.gen_addr())
+    if missing:
+        raise InvalidWeights('no weight for {}'.format(', '.join(missing)))
+    used = set(m.gen_addr() for m in masters) | set(per_host)
+    unused = sorted(set(declared) - used)
+    if unused:
+        logger.warning('no master at %s, their weights are ignored',
+                       ', '.join(unused))
+    return weights
+
+
+def maxmemory_weights(masters, workers=DEFAULT_WORKERS):
+    '''Weights by node name from `maxmemory`, a master without limit gets
+    its share of the memory of its host.
+    '''
+    per_host = _masters_per_host(masters)
+
+    def _capacity(m):
+        maxmemory = int(m.config_get('maxmemory')['maxmemory'])
+        if maxmemory:
+            return maxmemory
+        total = m.info('memory').get('total_system_memory')
+        if not total:
+            raise InvalidWeights(
+                'no maxmemory nor total_system_memory for {}'.format(
+                    m.gen_addr()))
+        return total / per_host[m.host]
+
+    weights = {}
+    for m, capacity, err in concurrent_map(_capacity, masters, workers):
+        if err is not None:
+            raise InvalidWeights('failed to get the memory of {}: {}'.format(
+                m.gen_addr(), err))
+        weights[m.name] = capacity
+    return weights
+
+
+def gen_weights(masters, path=None, source=None):
+    if path:
+        return declared_weights(masters, load_weights(path))
+    if source == 'maxmemory':
+        return maxmemory_weights(masters)
+    return None
+
+
+def weight_arguments(func):
+    func = cli.argument("--weight-by", dest="weight_by",
+                        choices=WEIGHT_SOURCES,
+                        help="weight every master by its capacity")(func)
+    return cli.argument("--weights",
+                        help="file of `<host[:port]> <weight>` lines")(func)
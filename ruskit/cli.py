@@ -16,7 +16,8 @@ class Command(object):
     def __init__(self, args, func):
         self.arguments = args
         self.parser = None
-        self.name = func.__name__
+        # rdb_analyze -> rdb-analyze
+        self.name = func.__name__.replace('_', '-')
         self.doc = func.__doc__
         self.func = func
 
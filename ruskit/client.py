@@ -0,0 +1,226 @@
+'''A client of the keys of a cluster, routing every command by slot.
+
+`ClusterClient` keeps a `SlotOwners` snapshot of the cluster, read from
+`CLUSTER NODES` of the first node answering, so that the masters added
+since the `Cluster` was built are known too. The
+commands of a `ClusterPipeline` are grouped by the master owning the
+slot of their key, and the pipelines of all the masters are sent
+concurrently. The replies are returned in the order of the commands.
+
+A `MOVED` reply refreshes the slot map, and the command is sent again to
+the node it was moved to. An `ASK` reply, for a slot being migrated, sends
+the command again to the importing node after `ASKING`, without changing
+the slot map. `TRYAGAIN`, for the keys of a command split by a migration,
+is retried the same way. After `max_redirects` rounds, the last error is
+the reply of the command.
+'''
+import logging
+import threading
+import time
+
+import redis
+
+from .cluster import ClusterNode
+from .slots import SlotOwners, key_slot
+from .utils import concurrent_map, DEFAULT_WORKERS, NO_RETRY
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+MAX_REDIRECTS = 5
+TRYAGAIN_SLEEP = 0.05
+
+
+class ClusterClient(object):
+    def __init__(self, cluster, max_redirects=MAX_REDIRECTS,
+                 workers=DEFAULT_WORKERS):
+        self.cluster = cluster
+        self.max_redirects = max_redirects
+        self.workers = workers
+        # the pipelines of several threads may refresh the map at once
+        self.lock = threading.RLock()
+        # host:port -> node, the nodes of the cluster and of the redirects
+        self.nodes = {}
+        # host:port of the nodes to read the slot map from
+        self.seeds = [n.gen_addr() for n in cluster.nodes]
+        self.owners = None
+        if not self.refresh():
+            raise redis.ConnectionError('no node of the cluster answered')
+
+    def refresh(self, suspects=()):
+        '''Read the slot map again from the first node answering, the
+        `suspects` that just failed last. The map is kept when no node
+        answers.
+        '''
+        with self.lock:
+            seeds = [a for a in self.seeds if a not in suspects] + \
+                [a for a in self.seeds if a in suspects]
+            for addr in seeds:
+                try:
+                    infos = self.node(addr).nodes()
+                except redis.RedisError as e:
+                    logger.warning('failed to read the slots of %s: %s',
+                                   addr, e)
+                    continue
+                self._update(infos)
+                return True
+            logger.error('no node of the cluster answered, the slot map '
+                         'is kept')
+            return False
+
+    def _update(self, infos):
+        masters, seeds, others = [], [], []
+        for info in infos:
+            if info['link_status'] == 'disconnected':
+                continue
+            # host:port@cport since redis 4
+            addr = info['addr'].split('@')[0]
+            node = self.node(addr)
+            node._cached_node_info = info
+            if 'master' in info['flags']:
+                masters.append(node)
+                seeds.append(addr)
+            else:
+                others.append(addr)
+        self.owners = SlotOwners(masters)
+        # the masters first
+        self.seeds = seeds + others
+
+    def connect(self, addr):
+        host, port = addr.rsplit(':', 1)
+        # a dead node fails at once, the next one is tried
+        return ClusterNode(host, int(port), retry=NO_RETRY)
+
+    def node(self, addr):
+        with self.lock:
+            if addr not in self.nodes:
+                self.nodes[addr] = self.connect(addr)
+            return self.nodes[addr]
+
+    def pipeline(self):
+        return ClusterPipeline(self)
+
+    def execute_command(self, *args, **options):
+        '''Send a single command, raise its error if it failed'''
+        pipe = self.pipeline()
+        pipe.execute_command(*args, **options)
+        return pipe.execute()[0]
+
+
+def _redirect(reply):
+    '''(kind, address) of a MOVED, ASK or TRYAGAIN error, else None'''
+    if not isinstance(reply, redis.ResponseError):
+        return None
+    fields = str(reply).split()
+    if fields and fields[0] in ('MOVED', 'ASK') and len(fields) == 3:
+        return fields[0], fields[2]
+    if fields and fields[0] == 'TRYAGAIN':
+        return 'TRYAGAIN', None
+    return None
+
+
+class ClusterPipeline(object):
+    def __init__(self, client):
+        self.client = client
+        # (args, options, slot)
+        self.commands = []
+
+    def execute_command(self, *args, **options):
+        '''Queue a command, its key being its first argument unless a
+        `key` option is given.
+        '''
+        key = options.pop('key', None)
+        if key is None:
+            if len(args) < 2:
+                raise ValueError('{} has no key to route it'.format(args[0]))
+            key = args[1]
+        self.commands.append((args, options, key_slot(key)))
+        return self
+
+    def __len__(self):
+        return len(self.commands)
+
+    def _send(self, node, items):
+        '''Replies of the (index, asking) `items` sent to `node`'''
+        pipe = node.pipeline(transaction=False)
+        for i, asking in items:
+            if asking:
+                pipe.execute_command('ASKING')
+            args, options, _ = self.commands[i]
+            pipe.execute_command(*args, **options)
+        replies = iter(pipe.execute(raise_on_error=False))
+        result = []
+        for i, asking in items:
+            if asking:
+                next(replies)
+            result.append(next(replies))
+        return result
+
+    def execute(self, raise_on_error=True):
+        client = self.client
+        replies = [None] * len(self.commands)
+        # index -> (address, asking) of the node a redirect points to
+        targets = {}
+        pending = range(len(self.commands))
+        for attempt in xrange(client.max_redirects + 1):
+            groups = {}
+            for i in pending:
+                if i in targets:
+                    addr, asking = targets[i]
+                    node = client.node(addr)
+                else:
+                    asking = False
+                    node = client.owners.owner(self.commands[i][2])
+                    if node is None:
+                        replies[i] = redis.ResponseError(
+                            'slot {} is not served'.format(
+                                self.commands[i][2]))
+                        continue
+                groups.setdefault(node, []).append((i, asking))
+
+            retry, moved, tryagain = [], False, False
+            failed = []
+            for node, result, err in concurrent_map(
+                    lambda n: self._send(n, groups[n]), groups.keys(),
+                    client.workers):
+                items = groups[node]
+                if err is not None:
+                    logger.warning('failed to send to %s: %s', node, err)
+                    # read the slot map again, the node may be gone
+                    moved = True
+                    failed.append(node.gen_addr())
+                    for i, _ in items:
+                        replies[i] = err
+                        targets.pop(i, None)
+                        retry.append(i)
+                    continue
+                for (i, _), reply in zip(items, result):
+                    replies[i] = reply
+                    redirect = _redirect(reply)
+                    if redirect is None:
+                        targets.pop(i, None)
+                        continue
+                    kind, addr = redirect
+                    if kind == 'MOVED':
+                        moved = True
+                        targets[i] = (addr, False)
+                    elif kind == 'ASK':
+                        targets[i] = (addr, True)
+                    else:
+                        tryagain = True
+                    retry.append(i)
+
+            pending = sorted(retry)
+            if not pending or attempt == client.max_redirects:
+                break
+            if moved:
+                client.refresh(failed)
+            if tryagain:
+                time.sleep(TRYAGAIN_SLEEP)
+
+        self.commands = []
+        if raise_on_error:
+            for reply in replies:
+                if isinstance(reply, Exception):
+                    raise reply
+        return replies
@@ -1,4 +1,5 @@
 import hashlib
+import heapq
 import itertools
 import redis
 import socket
@@ -12,11 +13,19 @@ try:
 except ImportError:
     import urllib.parse as urlparse
 
-from .utils import echo, divide, check_new_nodes, RuskitException
+from .migration import MigrationScheduler, plan_evacuation, \
+    plan_expansion, MIGRATIONS_PER_NODE
+from .replication import SyncJob, SyncLimits, SyncScheduler, SyncFailed
+from .slots import CLUSTER_HASH_SLOTS
+from .utils import echo, divide, check_new_nodes, RuskitException, \
+    concurrent_map, DEFAULT_WORKERS
 
-CLUSTER_HASH_SLOTS = 16384
+SLOWLOG_FETCH_COUNT = 128
 BUSY_MAX_RETRY_TIMES = 10
 BUSY_SLEEP_SECONDS = 3
+SYNC_REPORT_INTERVAL = 10
+# seconds a drained master has to notice that it became a slave
+DRAIN_TIMEOUT = 10
 
 
 logger = logging.getLogger(__name__)
@@ -32,6 +41,20 @@ def _scan_keys(node, slot, count=10):
             yield key
 
 
+def _fetch_slow_logs(node, last_id=None):
+    count = SLOWLOG_FETCH_COUNT
+    while True:
+        logs = node.slowlog_get(count)
+        if last_id is None:
+            return logs
+        # slowlog ids restart from 0 after a restart or SLOWLOG RESET
+        if logs and logs[0]['id'] < last_id:
+            return logs
+        if not logs or logs[-1]['id'] <= last_id or len(logs) < count:
+            return [log for log in logs if log['id'] > last_id]
+        count *= 2
+
+
 def retry_when_busy_loading(func):
     @functools.wraps(func)
     def _wrapper(*args, **kwargs):
@@ -125,9 +148,11 @@ class ClusterNode(object):
 
     @property
     def node_info(self):
-        if self._cached_node_info is None:
-            self._cached_node_info = self.nodes()[0]
-        return self._cached_node_info
+        # read once, a flush_cache of another thread may reset it between
+        info = self._cached_node_info
+        if info is None:
+            info = self._cached_node_info = self.nodes()[0]
+        return info
 
     @property
     def slots(self):
@@ -179,6 +204,17 @@ class ClusterNode(object):
 
         self.execute_command("CLUSTER ADDSLOTS", *slot)
 
+    def addslotsrange(self, *ranges):
+        """Assign slot ranges, `ranges` are inclusive (start, end) pairs.
+
+        CLUSTER ADDSLOTSRANGE requires redis 7.0 or newer.
+        """
+        if not ranges:
+            return
+
+        self.execute_command("CLUSTER ADDSLOTSRANGE",
+                             *itertools.chain(*ranges))
+
     def delslots(self, *slot):
         if not slot:
             return
@@ -197,8 +233,19 @@ class ClusterNode(object):
     def replicate(self, node_id):
         return self.execute_command("CLUSTER REPLICATE", node_id)
 
+    def role(self):
+        return self.execute_command("ROLE")[0]
+
     def failover(self, force=False, takeover=False):
-        args = ["FORCE"] if force else ["TAKEOVER"]
+        '''A plain CLUSTER FAILOVER waits for the master to agree and for
+        the offsets to match, FORCE skips the master and TAKEOVER also skips
+        the election of the other masters.
+        '''
+        args = []
+        if force:
+            args = ["FORCE"]
+        elif takeover:
+            args = ["TAKEOVER"]
         return self.execute_command("CLUSTER FAILOVER", *args)
 
     @retry_when_busy_loading
@@ -282,10 +329,27 @@ class Cluster(object):
         for n in self.nodes:
             n.flush_cache()
 
-    def get_slow_logs(self):
+    def get_slow_logs(self, cursor=None, masters_only=False,
+                      workers=DEFAULT_WORKERS):
+        '''Fetch slowlogs of all nodes concurrently.
+
+        If `cursor` is given, only entries newer than the last id recorded
+        in it are returned and the cursor is advanced.
+        '''
+        nodes = self.masters if masters_only else self.nodes
+
+        def _fetch(node):
+            last_id = cursor.get(node.gen_addr()) if cursor else None
+            return _fetch_slow_logs(node, last_id)
+
         result = {}
-        for master in self.masters:
-            result[master] = master.slowlog_get(128)
+        for node, logs, err in concurrent_map(_fetch, nodes, workers):
+            if err is not None:
+                logger.warning('failed to get slowlog of %s: %s', node, err)
+                continue
+            result[node] = logs
+            if cursor:
+                cursor.update(node.gen_addr(), logs)
         return result
 
     @property
@@ -351,7 +415,10 @@ class Cluster(object):
 
         node.flush_cache()
 
-    def reshard(self):
+    def reshard(self, weights=None):
+        '''Balance the slots, with `weights` every master gets a share
+        proportional to its weight.
+        '''
         if not self.consistent():
             return
 
@@ -361,7 +428,7 @@ class Cluster(object):
             "need": []
         } for n in self.masters]
 
-        nodes = slot_balance(nodes, CLUSTER_HASH_SLOTS)
+        nodes = slot_balance(nodes, CLUSTER_HASH_SLOTS, weights)
 
         for n in nodes:
             if not n["need"]:
@@ -369,11 +436,91 @@ class Cluster(object):
             for src, count in n["need"]:
                 self.migrate(src, n["node"], count)
 
-    def delete_node(self, node):
+    def synced_replica(self, master):
+        '''A slave of `master` whose link is up, to read from, or None'''
+        for n in self.nodes:
+            if not n.is_slave(master.name):
+                continue
+            try:
+                info = n.info('replication')
+            except redis.RedisError:
+                continue
+            if info.get('master_link_status') == 'up':
+                return n
+        return None
+
+    def best_replica(self, master, exclude=()):
+        '''The slave of `master` to promote when it is drained: in sync,
+        with the highest offset, on a host which does not already have its
+        share of the masters. None if there is no such slave. The nodes
+        whose name is in `exclude` are never picked.
+        '''
+        others = [m for m in self.masters if m.name != master.name]
+        hosts = set(n.host for n in self.nodes if n.name != master.name)
+        if not hosts:
+            return None
+        # the number of masters is the same after the failover
+        share = -(-(len(others) + 1) // len(hosts))
+        masters_per_host = defaultdict(int)
+        for m in others:
+            masters_per_host[m.host] += 1
+
+        best, best_offset = None, -1
+        for n in self.nodes:
+            if not n.is_slave(master.name) or n.name in exclude or \
+                    masters_per_host[n.host] >= share:
+                continue
+            try:
+                info = n.info('replication')
+            except redis.RedisError as e:
+                logger.warning('failed to get info of {}: {}'.format(n, e))
+                continue
+            if info.get('master_link_status') != 'up' or \
+                    info.get('master_sync_in_progress'):
+                continue
+            offset = info.get('slave_repl_offset', 0)
+            if offset > best_offset:
+                best, best_offset = n, offset
+        return best
+
+    def drain_node(self, node, exclude=()):
+        '''Hand the slots of a master to its best replica with a failover,
+        which turns the master into a slave without moving any key.
+        Return False if there is no suitable replica or the failover failed.
+        '''
+        # failover depends on this module
+        from .failover import ShardFailover
+
+        replica = self.best_replica(node, exclude)
+        if replica is None:
+            logger.info('no replica of {} to promote'.format(node))
+            return False
+        failover = ShardFailover(node, replica)
+        promoted = failover.run()
+        echo(failover.report(), color='green' if promoted else 'red')
+        if not promoted:
+            return False
+
+        deadline = time.time() + DRAIN_TIMEOUT
+        while True:
+            node.flush_cache()
+            if not node.is_master():
+                self.flush_all_cache()
+                return True
+            if time.time() >= deadline:
+                logger.warning('{} is still a master'.format(node))
+                return False
+            time.sleep(1)
+
+    def delete_node(self, node, drain=False):
+        '''Remove `node` from the cluster. The slots of a master are
+        migrated to the other masters, or with `drain`, handed to one of
+        its replicas by a failover if possible.
+        '''
         node.flush_cache()
         self.flush_all_cache()
 
-        if node.is_master():
+        if node.is_master() and not (drain and self.drain_node(node)):
             self.migrate_node(node)
 
         self.nodes = [n for n in self.nodes if n.name != node.name]
@@ -390,6 +537,78 @@ class Cluster(object):
         assert not node.slots
         node.reset()
 
+    def delete_nodes(self, nodes, drain=False, per_node=MIGRATIONS_PER_NODE,
+                     workers=DEFAULT_WORKERS):
+        '''Remove many nodes at once. The slots of all the departing masters
+        are moved by a single plan straight to the masters which stay, and
+        the slaves left without a master are given to the remaining masters
+        with the fewest slaves.
+        '''
+        self.flush_all_cache()
+        departing = []
+        for n in nodes:
+            node = self.get_node(n.name)
+            if node is None:
+                raise NodeNotFound(n.name)
+            departing.append(node)
+        names = set(n.name for n in departing)
+
+        if drain:
+            for node in departing:
+                if node.is_master():
+                    self.drain_node(node, exclude=names)
+            self.flush_all_cache()
+
+        orphans = [n for n in self.nodes if n.name not in names and
+                   not n.is_master() and
+                   n.node_info['replicate'] in names]
+        moves = plan_evacuation(self.masters, names)
+        MigrationScheduler(self, per_node, workers).run(moves)
+        self.reassign_replicas(orphans, exclude=names)
+
+        self.nodes = [n for n in self.nodes if n.name not in names]
+        for _, _, err in concurrent_map(
+                lambda n: [n.forget(name) for name in names], self.nodes,
+                workers):
+            if err is not None:
+                logger.warning('failed to forget the deleted nodes: '
+                               '{}'.format(err))
+        self.flush_all_cache()
+
+        for node in departing:
+            assert not node.slots
+            node.reset()
+
+    def expand(self, new_nodes, per_node=MIGRATIONS_PER_NODE,
+               workers=DEFAULT_WORKERS, slot_sizes=None, lightest=False):
+        '''Join all the `new_nodes` as masters in one MEET wave, then move
+        to them their share of the slots from the existing masters.
+        '''
+        masters = self.masters
+        self._add_nodes_as_master([{'cluster_node': n, 'role': 'master'}
+                                   for n in new_nodes])
+        moves = plan_expansion(masters, new_nodes, slot_sizes, lightest)
+        MigrationScheduler(self, per_node, workers).run(moves)
+
+    def reassign_replicas(self, slaves, exclude=()):
+        '''Replicate every slave from the master with the fewest slaves,
+        preferably on another host.
+        '''
+        masters = [m for m in self.masters if m.name not in exclude]
+        if not masters:
+            return
+        counts = defaultdict(int)
+        for n in self.nodes:
+            if not n.is_master():
+                counts[n.node_info['replicate']] += 1
+        for slave in slaves:
+            counts[slave.node_info['replicate']] -= 1
+            master = min(masters, key=lambda m: (m.host == slave.host,
+                                                 counts[m.name]))
+            slave.replicate(master.name)
+            slave.flush_cache()
+            counts[master.name] += 1
+
     def add_nodes(self, nodes):
         '''The format of node is similar to add_node.
         If node contains a key 'cluster_node'
@@ -409,60 +628,69 @@ class Cluster(object):
             n.flush_cache()
             target.flush_cache()
 
-    def add_slaves(self, new_slaves, fast_mode=False):
+    def add_slaves(self, new_slaves, fast_mode=False, limits=None,
+                   workers=DEFAULT_WORKERS, tuning=None):
         '''This is almost the same with `add_nodes`. The difference is that
-        it will add slaves in two slower way.
+        the full syncs of the new slaves are admitted under `limits`
+        (a `SyncLimits`), biggest master first.
         This is mainly used to avoid huge overhead caused by full sync
         when large amount of slaves are added to cluster.
-        If fast_mode is False, there is only one master node doing
-        replication at the same time.
+        The progress of the syncs is reported every SYNC_REPORT_INTERVAL
+        seconds, stalled syncs are restarted and SyncFailed is raised at
+        the end if some of them never finished.
+        Without `limits`, if fast_mode is False, there is only one master
+        node doing replication at the same time.
         If fast_mode is True, only after the current slave has finshed
         its sync, will the next slave on the same host start replication.
+        With a `ReplicationTuning`, the masters are tuned for the duration
+        of the syncs and restored afterwards.
         '''
         new_nodes, master_map = self._prepare_for_adding(new_slaves)
+        if limits is None:
+            limits = SyncLimits.from_mode(fast_mode)
 
-        slaves = defaultdict(list)
+        jobs = []
         for s in new_nodes:
-            slaves[s.host].append(s)
-
-        waiting = set()
-        while len(slaves) > 0:
-            for host in slaves.keys():
-                if self.check_action_stopped():
-                    logger.warning('Slaves adding was stopped, ' \
-                        'waiting for the last slave to be finished')
-                slave_list = slaves[host]
-                s = slave_list[0]
-
-                if not fast_mode and len(waiting) > 0 and s not in waiting:
-                    continue
-
-                if s not in waiting:
-                    if self.check_action_stopped():
-                        raise ActionStopped(
-                            'Slaves adding was successfully stopped')
-                    master_name = master_map[s.name]
-                    target = self.get_node(master_name)
-                    if not target:
-                        raise NodeNotFound(master_name)
-                    self._add_as_master(s, self.nodes[0])
-                    s.replicate(target.name)
-                    waiting.add(s)
-                    continue
-
-                role = s.execute_command('ROLE')
-                # role[3] being changed to 'connected' means sync is finished
-                if role[0] == 'master' or role[3] != 'connected':
-                    continue
-
-                waiting.remove(s)
-                slave_list.pop(0)
-                if len(slave_list) == 0:
-                    slaves.pop(host)
-
-            if len(waiting) > 0:
-                waiting_list = ['{}:{}'.format(n.host, n.port) for n in waiting]
-                logger.info('sync waiting list: {}'.format(waiting_list))
+            master_name = master_map[s.name]
+            target = self.get_node(master_name)
+            if not target:
+                raise NodeNotFound(master_name)
+            jobs.append(SyncJob(s, target))
+
+        scheduler = SyncScheduler(jobs, limits, workers)
+        scheduler.estimate()
+        if tuning is not None:
+            tuning.apply(jobs)
+        try:
+            self._run_syncs(scheduler)
+        finally:
+            if tuning is not None:
+                tuning.restore()
+
+        if scheduler.failed:
+            raise SyncFailed(scheduler.failed)
+
+    def _run_syncs(self, scheduler):
+        last_report = time.time()
+        while not scheduler.done:
+            if scheduler.pending and self.check_action_stopped():
+                if not scheduler.running:
+                    raise ActionStopped(
+                        'Slaves adding was successfully stopped')
+                logger.warning('Slaves adding was stopped, ' \
+                    'waiting for the running syncs to be finished')
+            else:
+                for job in scheduler.admit():
+                    self._add_as_master(job.slave, self.nodes[0])
+                    job.slave.replicate(job.master.name)
+
+            scheduler.poll()
+            if scheduler.done:
+                break
+            if scheduler.running and \
+                    time.time() - last_report >= SYNC_REPORT_INTERVAL:
+                last_report = time.time()
+                echo('\n'.join(scheduler.report()))
             time.sleep(1)
 
     def _prepare_for_adding(self, nodes):
@@ -536,13 +764,23 @@ class Cluster(object):
         new.flush_cache()
         target.flush_cache()
 
-    def fill_slots(self):
+    def fill_slots(self, weights=None):
+        '''Assign the missing slots, with `weights` to the masters the
+        furthest below their weighted share first.
+        '''
         masters = self.masters
         slots = itertools.chain(*[n.slots for n in masters])
         missing = list(set(range(CLUSTER_HASH_SLOTS)).difference(slots))
 
-        div = divide(len(missing), len(masters))
         masters.sort(key=lambda x: len(x.slots))
+        if weights is None:
+            div = divide(len(missing), len(masters))
+        else:
+            div = fill_shares(
+                [len(m.slots) for m in masters],
+                divide(CLUSTER_HASH_SLOTS, len(masters),
+                       [weights[m.name] for m in masters]),
+                len(missing))
 
         i = 0
         for count, node in zip(div, masters):
@@ -567,7 +805,12 @@ class Cluster(object):
             src, dst = (node, src_node) if income else (src_node, node)
             self.migrate(src, dst, count)
 
-    def migrate_slot(self, src, dst, slot, timeout=15000, verbose=True):
+    def migrate_slot(self, src, dst, slot, timeout=15000, verbose=True,
+                     masters=None):
+        '''Move `slot` from `src` to `dst` and tell all the masters. Given
+        the `masters` to tell, the caches of the nodes are not flushed, the
+        caller flushes them once all its migrations are over.
+        '''
         if self.check_action_stopped():
             raise ActionStopped('Slot migration was successfully stopped')
 
@@ -578,9 +821,13 @@ class Cluster(object):
                 echo("Migrating:", key)
             src.migrate(dst.host, dst.port, key, 0, timeout)
 
-        for node in self.masters:
+        flush = masters is None
+        if flush:
+            masters = self.masters
+        for node in masters:
             node.setslot("NODE", slot, dst.name)
-            node.flush_cache()
+            if flush:
+                node.flush_cache()
 
     def migrate(self, src, dst, count, verbose=True):
         if count <= 0:
@@ -600,10 +847,35 @@ class Cluster(object):
         dst.flush_cache()
 
 
-def slot_balance(seq, amt):
+def fill_shares(counts, targets, amt):
+    '''Split `amt` new slots so that the nodes with `counts` slots get
+    as close as possible to their `targets`.
+    '''
+    shares = [0] * len(counts)
+    excess = [(c - t, i) for i, (c, t) in enumerate(zip(counts, targets))]
+    heapq.heapify(excess)
+    for _ in xrange(amt):
+        over, i = heapq.heappop(excess)
+        shares[i] += 1
+        heapq.heappush(excess, (over + 1, i))
+    return shares
+
+
+def slot_balance(seq, amt, weights=None):
+    '''Plan the moves giving every node of `seq` its share of `amt`
+    slots, the same for all or proportional to `weights`, a dict of node
+    name to weight. Only the slots over the share of a node are moved.
+    '''
     seq.sort(key=lambda x: x["count"], reverse=True)
-    chunks = divide(amt, len(seq))
+    if weights is None:
+        chunks = divide(amt, len(seq))
+    else:
+        chunks = divide(amt, len(seq),
+                        [weights[x["node"].name] for x in seq])
     pairs = list(zip(seq, chunks))
+    if weights is not None:
+        # the nodes giving slots first and the ones taking slots last
+        pairs.sort(key=lambda p: p[0]["count"] - p[1], reverse=True)
 
     i, j = 0, len(pairs) - 1
     while i < j:
@@ -2,23 +2,28 @@ import logging
 
 from ..cli import CommandParser
 from .add import add as add_cmd  # name conflict with module
+from .add import expand
 from .create import create as create_cmd  # name conflict with module
-from .scale import addslave, movemaster, moveslave
+from .scale import addslave, movemaster, moveslave, untune
+from .analyze import hotspots, slotmap, estimate, rdb_analyze
+from .data import import_rdb, copy
 from .manage import (
     info, fix, migrate, delete, reshard, replicate, destroy, flushall, slowlog,
-    reconfigure, peek, check, cmd
+    reconfigure, peek, check, cmd, balance
     )
 
 
 def gen_parser():
     parser = CommandParser(fromfile_prefix_chars='@')
     parser.add_command(add_cmd)
+    parser.add_command(expand)
     parser.add_command(delete)
     parser.add_command(create_cmd)
     parser.add_command(migrate)
     parser.add_command(info)
     parser.add_command(fix)
     parser.add_command(reshard)
+    parser.add_command(balance)
     parser.add_command(replicate)
     parser.add_command(destroy)
     parser.add_command(slowlog)
@@ -29,7 +34,14 @@ def gen_parser():
     parser.add_command(check)
     parser.add_command(movemaster)
     parser.add_command(moveslave)
+    parser.add_command(untune)
     parser.add_command(cmd)
+    parser.add_command(hotspots)
+    parser.add_command(slotmap)
+    parser.add_command(estimate)
+    parser.add_command(rdb_analyze)
+    parser.add_command(import_rdb)
+    parser.add_command(copy)
     return parser
 
 
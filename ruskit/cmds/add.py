@@ -2,6 +2,8 @@ import time
 
 from ruskit import cli
 from ..cluster import ClusterNode, Cluster
+from ..migration import plan_expansion, MigrationFailed, MIGRATIONS_PER_NODE
+from ..slotmap import load_slot_sizes
 from ..utils import echo, InvalidNewNode, timeout_argument
 
 
@@ -56,3 +58,46 @@ def add(ctx, args):
         add_nodes(cluster, nodes)
     except InvalidNewNode as e:
         echo("failed to add node: {}".format(e.message), color="red")
+
+
+@cli.command
+@cli.argument("-p", "--peek", dest="peek", default=False, action="store_true")
+@cli.argument("--migrations-per-node", dest="migrations_per_node", type=int,
+              default=MIGRATIONS_PER_NODE)
+@cli.argument("--slot-map", dest="slot_map",
+              help="give the new masters their share of the bytes of a "
+                   "`ruskit slotmap` table")
+@cli.argument("--lightest", action="store_true",
+              help="with --slot-map, move the lightest slots instead")
+@cli.argument("cluster")
+@cli.argument("nodes", nargs='+')
+@timeout_argument
+@cli.pass_ctx
+def expand(ctx, args):
+    """Add new masters and move to them their share of the slots, slots
+    only move from the existing masters to the new ones
+    """
+    new_nodes = [ClusterNode.from_uri(n) for n in args.nodes]
+    cluster = Cluster.from_node(ClusterNode.from_uri(args.cluster))
+
+    if not cluster.healthy():
+        ctx.abort("Cluster not healthy.")
+        return
+
+    slot_sizes = load_slot_sizes(args.slot_map) if args.slot_map else None
+    if args.peek:
+        for move in plan_expansion(cluster.masters, new_nodes, slot_sizes,
+                                   args.lightest):
+            echo(move)
+        return
+
+    try:
+        cluster.expand(new_nodes, per_node=args.migrations_per_node,
+                       slot_sizes=slot_sizes, lightest=args.lightest)
+    except InvalidNewNode as e:
+        ctx.abort("failed to add node: {}".format(e.message))
+        return
+    except MigrationFailed as e:
+        ctx.abort(str(e))
+        return
+    cluster.wait()
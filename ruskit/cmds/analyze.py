@@ -0,0 +1,195 @@
+from ruskit import cli
+from ..cluster import Cluster, ClusterNode
+from ..hotspots import HeatMap, HotspotError, sample_cluster, \
+    plan_hot_moves, master_heat, SAMPLE_MODES, MAX_KEYS, MONITOR_SECONDS
+from ..migration import MigrationScheduler, MigrationFailed, \
+    MIGRATIONS_PER_NODE
+from ..estimate import estimate_cluster, slot_table, total, SAMPLES, \
+    TTL_BUCKETS
+from ..rdb import analyze_rdb, RdbError, PREFIX_SEPARATOR, BIG_KEYS
+from ..replication import format_size
+from ..slotmap import SlotScanner, DEFAULT_OUTPUT, SCAN_COUNT, TYPES
+from ..utils import echo, timeout_argument
+
+
+def print_heat_map(heat_map, masters, top):
+    echo(heat_map.render(), color='purple')
+    echo("{:>6} {:>12} {}".format("slot", "heat", "master"), color="purple")
+    owners = dict((s, m) for m in masters for s in m.slots)
+    for slot, heat in heat_map.top_slots(top):
+        owner = owners.get(slot)
+        echo("{:>6} {:>12.0f} {}".format(
+            slot, heat, owner.gen_addr() if owner else '-'))
+    echo("{:>12} {}".format("heat", "key"), color="purple")
+    for key, heat in heat_map.top_keys(top):
+        echo("{:>12.0f} {!r}".format(heat, key))
+    echo("{:>12} {}".format("heat", "master"), color="purple")
+    heat = master_heat(masters, heat_map)
+    for m in sorted(heat, key=heat.get, reverse=True):
+        echo("{:>12.0f} {}".format(heat[m], m.gen_addr()))
+
+
+@cli.command
+@cli.argument("cluster")
+@cli.argument("-m", "--mode", choices=SAMPLE_MODES, default="lfu",
+              help="OBJECT FREQ of scanned keys, or a MONITOR window")
+@cli.argument("--max-keys", dest="max_keys", type=int, default=MAX_KEYS,
+              help="keys scanned on every master in lfu mode")
+@cli.argument("--seconds", type=float, default=MONITOR_SECONDS,
+              help="length of the MONITOR window")
+@cli.argument("-n", "--top", type=int, default=20)
+@cli.argument("-o", "--output", help="save the heat map to this file")
+@cli.argument("--reshard", metavar="HEAT_MAP",
+              help="spread the hot slots of a saved heat map")
+@cli.argument("--max-moves", dest="max_moves", type=int)
+@cli.argument("-p", "--peek", action="store_true")
+@timeout_argument
+@cli.pass_ctx
+def hotspots(ctx, args):
+    """Sample the access frequency of the keys of all the masters and
+    show the hottest slots and keys, or move hot slots with --reshard
+    """
+    cluster = Cluster.from_node(ClusterNode.from_uri(args.cluster))
+    masters = cluster.masters
+
+    if args.reshard:
+        heat_map = HeatMap.load(args.reshard)
+        moves = plan_hot_moves(masters, heat_map, args.max_moves)
+        for move in moves:
+            echo(move)
+        if args.peek or not moves:
+            return
+        try:
+            MigrationScheduler(cluster, MIGRATIONS_PER_NODE).run(moves)
+        except MigrationFailed as e:
+            ctx.abort(str(e))
+            return
+        cluster.wait()
+        return
+
+    try:
+        heat_map = sample_cluster(masters, args.mode, args.max_keys,
+                                  args.seconds)
+    except HotspotError as e:
+        ctx.abort(str(e))
+        return
+    print_heat_map(heat_map, masters, args.top)
+    if args.output:
+        heat_map.save(args.output)
+
+
+@cli.command
+@cli.argument("cluster")
+@cli.argument("-o", "--output", default=DEFAULT_OUTPUT)
+@cli.argument("--from-masters", dest="from_masters", action="store_true",
+              help="scan the masters even if they have a synced replica")
+@cli.argument("--scan-count", dest="scan_count", type=int,
+              default=SCAN_COUNT)
+@cli.argument("-n", "--top", type=int, default=20)
+@timeout_argument
+@cli.pass_ctx
+def slotmap(ctx, args):
+    """Scan the keys of all the masters into a table of the bytes, keys
+    and types of every slot, an interrupted scan is resumed
+    """
+    cluster = Cluster.from_node(ClusterNode.from_uri(args.cluster))
+    scanner = SlotScanner(cluster, args.output,
+                          from_replicas=not args.from_masters,
+                          count=args.scan_count)
+    table = scanner.run()
+    if table is None:
+        ctx.abort("Scan incomplete, run it again to resume from {}.".format(
+            scanner.partial))
+        return
+
+    echo("{:>6} {:>10} {:>10}".format("slot", "keys", "bytes"),
+         color="purple")
+    sizes = table.sizes()
+    for slot in sorted(sizes, key=sizes.get, reverse=True)[:args.top]:
+        echo("{:>6} {:>10} {:>10}".format(slot, table.keys[slot],
+                                          format_size(sizes[slot])))
+    echo("{} keys, {} in {} slots".format(
+        sum(table.keys), format_size(sum(table.bytes)), len(sizes)))
+
+
+def format_mix(mix, names, intervals=None):
+    '''`string:75% hash:25%`, with `intervals` `string:75% [71%-79%] ...`'''
+    items = []
+    for n in names:
+        if n not in mix:
+            continue
+        item = '{}:{:.0%}'.format(n, mix[n])
+        if intervals is not None:
+            item += ' [{:.0%}-{:.0%}]'.format(*intervals[n])
+        items.append(item)
+    return ' '.join(items)
+
+
+@cli.command
+@cli.argument("cluster")
+@cli.argument("-s", "--samples", type=int, default=SAMPLES,
+              help="random keys sampled on every master")
+@cli.argument("-o", "--output",
+              help="save the estimated bytes of every slot as a slot map")
+@timeout_argument
+def estimate(args):
+    """Estimate the memory, the types and the TTLs of the keys of every
+    master from random samples, within 95 percent confidence intervals
+    """
+    cluster = Cluster.from_node(ClusterNode.from_uri(args.cluster))
+    estimates = estimate_cluster(cluster.masters, args.samples)
+    ttl_names = ['none'] + [name for _, name in TTL_BUCKETS]
+
+    echo("{:<22} {:>10} {:>20}".format("master", "keys", "memory"),
+         color="purple")
+    for e in sorted(estimates, key=lambda e: e.node.gen_addr()):
+        echo("{:<22} {:>10} {:>20}".format(
+            e.node.gen_addr(), e.dbsize, "{} +/- {}".format(
+                format_size(int(e.memory)), format_size(int(e.interval())))))
+        echo("    types", format_mix(e.mix(e.types), TYPES,
+                                       e.mix_intervals(e.types)))
+        echo("    ttls ", format_mix(e.mix(e.ttls), ttl_names,
+                                       e.mix_intervals(e.ttls)))
+    memory, interval = total(estimates)
+    echo("{} keys, {} +/- {}".format(
+        sum(e.dbsize for e in estimates), format_size(int(memory)),
+        format_size(int(interval))))
+
+    if args.output:
+        slot_table(estimates).save(args.output)
+        echo("Saved the slot estimates to", args.output)
+
+
+@cli.command
+@cli.argument("files", nargs='+', help="rdb files, of every master")
+@cli.argument("-o", "--output", help="save the bytes of every slot as a "
+              "slot map")
+@cli.argument("--separator", default=PREFIX_SEPARATOR,
+              help="the prefix of a key ends at its first separator")
+@cli.argument("-n", "--top", type=int, default=BIG_KEYS)
+@cli.pass_ctx
+def rdb_analyze(ctx, args):
+    """Approximate the memory of every slot, key prefix and big key from
+    rdb files, without touching the cluster
+    """
+    try:
+        report = analyze_rdb(args.files, args.separator, args.top)
+    except (RdbError, IOError) as e:
+        ctx.abort(str(e))
+        return
+
+    echo("{:<32} {:>10} {:>10}".format("prefix", "keys", "bytes"),
+         color="purple")
+    for prefix, (keys, size) in report.top_prefixes(args.top):
+        echo("{:<32} {:>10} {:>10}".format(
+            repr(prefix) if prefix else '-', keys, format_size(size)))
+    echo("{:>10} {:<8} {}".format("bytes", "type", "key"), color="purple")
+    for size, key, type_name in report.top_keys():
+        echo("{:>10} {:<8} {!r}".format(format_size(size), type_name, key))
+    table = report.table
+    echo("{} keys, {} in {} slots".format(
+        sum(table.keys), format_size(sum(table.bytes)), len(table.sizes())))
+
+    if args.output:
+        table.save(args.output)
+        echo("Saved the slot map to", args.output)
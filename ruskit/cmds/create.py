@@ -1,12 +1,19 @@
 import collections
-import sys
 import time
-import uuid
+from itertools import izip_longest
 
 from ruskit import cli
-from ..cluster import ClusterNode, CLUSTER_HASH_SLOTS, Cluster
+from ..cluster import ClusterNode, CLUSTER_HASH_SLOTS, Cluster, \
+    ClusterNotHealthy
+from ..maxflow import Graph
+from ..topology import Topology, solve, POLICIES, DEFAULT_POLICY
 from ..utils import echo, spread, divide, InvalidNewNode, check_new_nodes, \
-    RuskitException, timeout_argument
+    RuskitException, timeout_argument, concurrent_map, version_tuple, \
+    DEFAULT_WORKERS
+
+ADDSLOTSRANGE_VERSION = (7, 0)
+MIN_POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 1
 
 
 def split_slot(n, m):
@@ -19,13 +26,26 @@ def split_slot(n, m):
     return res
 
 
+class PlacementError(RuskitException):
+    def __init__(self, missing, unplaced=()):
+        self.missing = missing
+        self.unplaced = unplaced
+
+    def __str__(self):
+        if self.missing:
+            return 'no valid slave placement, slaves missing on hosts: ' \
+                '{}'.format(self.missing)
+        return 'no master on another host for the slaves on hosts: ' \
+            '{}'.format(self.unplaced)
+
+
 class NodeWrapper(object):
     def __init__(self, node):
         self.node = node
 
-        self.origin = None
         self.unassigned_slots = []
         self.unassigned_master = None
+        self.master_name = None
 
     def __getattr__(self, attr):
         return getattr(self.node, attr)
@@ -33,10 +53,15 @@ class NodeWrapper(object):
     def assign_master(self):
         assert self.unassigned_master
         self.replicate(self.unassigned_master)
+        self.master_name = self.unassigned_master
         self.unassigned_master = None
 
-    def assign_slots(self):
+    def assign_slots(self, use_range=False):
         assert self.unassigned_slots
+        if use_range:
+            self.addslotsrange(*[(start, end - 1)
+                                 for start, end in self.unassigned_slots])
+            return
         for chunk in self.unassigned_slots:
             self.addslots(*range(*chunk))
 
@@ -48,10 +73,19 @@ class NodeWrapper(object):
 
 
 class Manager(object):
-    def __init__(self, slave_count, instances, master_count=0):
+    '''Bootstrap a cluster in phases: validation, slot assignment, config
+    epochs, meet and replication. Every phase runs concurrently across the
+    instances and is followed by a convergence check which only polls the
+    instances that have not converged yet.
+    '''
+    def __init__(self, slave_count, instances, master_count=0,
+                 workers=DEFAULT_WORKERS, topology=None):
         assert slave_count >= 0
 
         self.slave_count = slave_count
+        self.workers = workers
+        self.topology = topology
+        self.redis_version = None
         instances = [ClusterNode.from_uri(i) for i in instances]
 
         self.instances = [NodeWrapper(i) for i in instances]
@@ -66,9 +100,44 @@ class Manager(object):
         self.slaves = []
 
     def check(self):
-        check_new_nodes(self.instances)
+        self.redis_version = check_new_nodes(self.instances,
+                                             workers=self.workers)
         return True  # keep this for compability
 
+    def _run(self, func, nodes):
+        errors = []
+        for node, _, err in concurrent_map(func, nodes, self.workers):
+            if err is not None:
+                errors.append((node, err))
+        if errors:
+            node, err = errors[0]
+            raise RuskitException("{} of {} nodes failed, {}: {}".format(
+                len(errors), len(nodes), node, err))
+
+    def _wait_until(self, check, nodes, timeout=None, progress=True):
+        '''Poll `check(node)` until it is true for every node. Only the
+        nodes which have not converged are polled again.
+        '''
+        pending = list(nodes)
+        interval = MIN_POLL_INTERVAL
+        start = time.time()
+        while True:
+            pending = [n for n, ok, err in
+                       concurrent_map(check, pending, self.workers)
+                       if err is not None or not ok]
+            if not pending:
+                break
+            if timeout is not None and time.time() - start > timeout:
+                raise ClusterNotHealthy(
+                    "{} nodes not converged: {}".format(len(pending),
+                                                        pending[:10]))
+            if progress:
+                echo('.', end='')
+            time.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+        if progress:
+            echo()
+
     def init_slots(self):
         ips = collections.defaultdict(list)
         for instance in self.instances:
@@ -87,53 +156,81 @@ class Manager(object):
         if self.slave_count > 0:
             plan = self.distribute_slaves(masters, slaves)
             for m, s in plan:
-                if s.origin:
-                    s.host = s.origin
                 s.unassigned_master = m.name
 
         self.instances = [i for i in self.instances if i.active()]
         self.cluster = Cluster(self.instances)
 
     def distribute_slaves(self, masters, slaves):
-        tracks = []
-
-        def _tracked(master, slave, p):
-            if not p:
-                return False
-            target = p[:]
-            target.append((master, slave))
-            return target in tracks
-
-        while True:
-            plan = []
-            current_slaves = slaves[:]
-            for master in masters:
-                node = None
-                if not current_slaves:
-                    break
-
-                for s in current_slaves:
-                    if s.host == master.host or _tracked(master, s, plan):
-                        continue
-                    node = s
-                    plan.append((master, s))
-                    current_slaves.remove(s)
-                    break
-                if node is None:
-                    nodes = [s for s in current_slaves
-                             if s.host == master.host]
-                    nodes[0].origin = nodes[0].host
-                    nodes[0].host += str(uuid.uuid4())[:6]
-
-            if len(plan) == min(len(slaves), len(masters)):
-                break
-            if plan:
-                tracks.append(plan)
-
-        more = set(slaves).difference([s for _, s in plan])
-
-        if more:
-            plan.extend(self.distribute_slaves(masters, list(more)))
+        '''Place slaves so that no slave shares a host with its master.
+
+        Slaves and masters are grouped by host and the placement is solved
+        as a max flow from slave hosts to master hosts, which takes
+        polynomial time however lopsided the hosts are. Every master gets
+        the same number of slaves first, then the remaining slaves are
+        spread in rounds of at most one more slave for every master. With
+        a topology, every round picks the cheapest placement according to
+        its policy.
+        '''
+        hosts = sorted({n.host for n in masters + slaves})
+        host_count = len(hosts)
+        host_indices = {h: i for i, h in enumerate(hosts)}
+        masters_per_host = [[] for _ in hosts]
+        slaves_per_host = [[] for _ in hosts]
+        for m in masters:
+            masters_per_host[host_indices[m.host]].append(m)
+        for s in slaves:
+            slaves_per_host[host_indices[s.host]].append(s)
+
+        # placed[i][j]: slaves of host i replicating masters of host j
+        placed = [[0] * host_count for _ in hosts]
+        left = [len(ss) for ss in slaves_per_host]
+
+        def _place(quota):
+            # vertices: slave hosts, master hosts, source, sink
+            src, sink = 2 * host_count, 2 * host_count + 1
+            g = Graph(2 * host_count + 2)
+            for i, c in enumerate(left):
+                g[src, i] = c
+                for j in range(host_count):
+                    if i != j:
+                        g[i, host_count + j] = c
+            for j, ms in enumerate(masters_per_host):
+                g[host_count + j, sink] = quota * len(ms)
+            if self.topology is not None:
+                self.topology.apply(g, hosts, host_count)
+            mf = solve(g, src, sink, self.topology)
+            for i in range(host_count):
+                for j in range(host_count):
+                    eid = g.get_eid(i, host_count + j, error=False)
+                    if eid >= 0 and mf.flow[eid]:
+                        placed[i][j] += mf.flow[eid]
+                        left[i] -= mf.flow[eid]
+            return mf.value
+
+        base = min(self.slave_count, len(slaves) // len(masters))
+        if _place(base) < base * len(masters):
+            missing = [(hosts[j], base * len(ms) -
+                        sum(placed[i][j] for i in range(host_count)))
+                       for j, ms in enumerate(masters_per_host)]
+            raise PlacementError([m for m in missing if m[1] > 0])
+
+        while sum(left) and _place(1):
+            pass
+        if sum(left):
+            raise PlacementError([], [(hosts[i], c) for i, c in
+                                      enumerate(left) if c])
+
+        plan = []
+        for j, ms in enumerate(masters_per_host):
+            # interleave the slave hosts so that the slaves of one master
+            # come from different hosts where possible
+            sources = [[slaves_per_host[i].pop() for _ in range(c)]
+                       for i, c in enumerate(row[j] for row in placed)]
+            incoming = [s for group in izip_longest(*sources) for s in group
+                        if s is not None]
+            for k, s in enumerate(incoming):
+                plan.append((ms[k % len(ms)], s))
         return plan
 
     def show_cluster_info(self):
@@ -152,63 +249,105 @@ class Manager(object):
                                      for s in instance.unassigned_slots])
                 echo("   slots:", slot_msg)
 
+    @property
+    def support_slots_range(self):
+        return self.redis_version is not None and \
+            version_tuple(self.redis_version) >= ADDSLOTSRANGE_VERSION
+
     def set_slots(self):
-        for master in self.masters:
-            master.assign_slots()
+        use_range = self.support_slots_range
+        self._run(lambda m: m.assign_slots(use_range), self.masters)
 
     def set_slave(self):
-        for slave in self.slaves:
-            slave.assign_master()
+        self._run(lambda s: s.assign_master(), self.slaves)
 
     def join_cluster(self):
         if not self.instances:
             return
 
         first_instance = self.instances[0]
-        for instance in self.instances[1:]:
-            instance.meet(first_instance.host, first_instance.port)
+        self._run(lambda i: i.meet(first_instance.host, first_instance.port),
+                  self.instances[1:])
 
     def assign_config_epoch(self):
-        epoch = 1
-        for instance in self.instances:
+        epochs = {i: epoch for epoch, i in enumerate(self.instances, 1)}
+
+        def _set_epoch(instance):
             try:
-                instance.set_config_epoch(epoch)
+                instance.set_config_epoch(epochs[instance])
             except:
                 pass
-            epoch += 1
+
+        self._run(_set_epoch, self.instances)
+
+    def wait_joined(self, timeout=None):
+        total = len(self.instances)
+        self._wait_until(
+            lambda i: i.cluster_info()["cluster_known_nodes"] == total,
+            self.instances, timeout)
+
+    def wait_slots_propagated(self, timeout=None):
+        self._wait_until(
+            lambda i: i.cluster_info()["cluster_slots_assigned"] ==
+            CLUSTER_HASH_SLOTS, self.instances, timeout)
+
+    def wait_replicated(self, timeout=None):
+        def _check(slave):
+            slave.flush_cache()
+            return slave.is_slave(slave.master_name)
+
+        self._wait_until(_check, self.slaves, timeout)
+
+    def wait_cluster_ok(self, timeout=None):
+        self._wait_until(
+            lambda i: i.cluster_info()["cluster_state"] == "ok",
+            self.instances, timeout)
 
 
 @cli.command
 @cli.argument("-s", "--slaves", type=int, default=0)
 @cli.argument("-m", "--masters", type=int, default=0)
+@cli.argument("-j", "--concurrency", type=int, default=DEFAULT_WORKERS)
+@cli.argument("-w", "--wait-timeout", dest="wait_timeout", type=float)
+@cli.argument("--topology", help="file of `host rack zone` lines")
+@cli.argument("--topology-policy", dest="topology_policy",
+              default=DEFAULT_POLICY, choices=sorted(POLICIES))
 @cli.argument("instances", nargs='+')
 @timeout_argument
 def create(args):
-    manager = Manager(args.slaves, args.instances, args.masters)
+    topology = Topology.load(args.topology, args.topology_policy) \
+        if args.topology else None
+    manager = Manager(args.slaves, args.instances, args.masters,
+                      args.concurrency, topology)
     try:
         manager.check()
     except InvalidNewNode as e:
         echo("Cluster can not be created: {}".format(e.message),
             color="red")
         exit()
-    manager.init_slots()
+    try:
+        manager.init_slots()
+    except PlacementError as e:
+        echo("Cluster can not be created: {}".format(e), color="red")
+        exit()
     manager.show_cluster_info()
 
-    manager.set_slots()
-    manager.assign_config_epoch()
-    manager.join_cluster()
-
-    echo("Waiting for the cluster to join ", end='')
-    sys.stdout.flush()
-    time.sleep(1)
-    while not manager.cluster.consistent():
-        echo('.', end='')
-        sys.stdout.flush()
-        time.sleep(1)
-    echo()
-    manager.set_slave()
-
-    if manager.cluster.consistent() or manager.cluster.all_slots_covered():
-        echo("Done.", color="green")
-    else:
+    try:
+        manager.set_slots()
+        manager.assign_config_epoch()
+        manager.join_cluster()
+
+        echo("Waiting for the cluster to join ", end='')
+        manager.wait_joined(args.wait_timeout)
+        manager.set_slave()
+
+        echo("Waiting for the cluster to converge ", end='')
+        manager.wait_slots_propagated(args.wait_timeout)
+        manager.wait_replicated(args.wait_timeout)
+        manager.wait_cluster_ok(args.wait_timeout)
+    except RuskitException as e:
+        echo(e)
         echo("Failed.", color="red")
+        return
+
+    echo("Done.", color="green")
@@ -0,0 +1,92 @@
+from ruskit import cli
+from ..cluster import Cluster, ClusterNode
+from ..importer import RdbImporter, ImportFailed, BATCH_SIZE, QUEUED_BATCHES
+from ..rdb import RdbError
+from ..replication import parse_size
+from ..transfer import ClusterCopier, CopyFailed, DEFAULT_CHECKPOINT
+from ..utils import echo, timeout_argument
+
+
+@cli.command
+@cli.argument("file", help="rdb file, of a standalone redis")
+@cli.argument("cluster")
+@cli.argument("--batch-size", dest="batch_size", type=int,
+              default=BATCH_SIZE, help="RESTORE commands per pipeline")
+@cli.argument("--queued-batches", dest="queued_batches", type=int,
+              default=QUEUED_BATCHES,
+              help="batches queued for a master before reading waits")
+@cli.argument("--rate", type=parse_size,
+              help="bytes restored per second, e.g. 50m")
+@cli.argument("--checkpoint", help="offset to resume from, FILE.checkpoint "
+              "by default")
+@timeout_argument
+@cli.pass_ctx
+def import_rdb(ctx, args):
+    """Restore all the keys of an rdb file into the masters owning their
+    slots, an interrupted import is resumed
+    """
+    cluster = Cluster.from_node(ClusterNode.from_uri(args.cluster))
+    if not cluster.healthy():
+        ctx.abort("Cluster not healthy.")
+        return
+
+    importer = RdbImporter(cluster, args.file, args.checkpoint,
+                           batch_size=args.batch_size,
+                           queued=args.queued_batches, rate=args.rate)
+    try:
+        writers = importer.run()
+    except (ImportFailed, RdbError, IOError) as e:
+        ctx.abort("{}, run it again to resume from {}.".format(
+            e, importer.checkpoint_path))
+        return
+
+    for w in sorted(writers, key=lambda w: w.master.gen_addr()):
+        echo("{} restored {} keys, {} failed".format(
+            w.master.gen_addr(), w.restored, w.failed))
+        if w.last_error is not None:
+            echo("    last error:", w.last_error, color="red")
+    echo("{} keys restored, {} expired, {} of other dbs skipped".format(
+        sum(w.restored for w in writers), importer.expired, importer.skipped))
+    failed = sum(w.failed for w in writers)
+    if failed:
+        ctx.abort("{} keys failed to restore.".format(failed))
+
+
+@cli.command
+@cli.argument("src", help="a node of the cluster to copy")
+@cli.argument("dst", help="a node of the cluster to copy into")
+@cli.argument("-p", "--pattern", help="only copy the keys matching it")
+@cli.argument("--from-masters", dest="from_masters", action="store_true",
+              help="read the masters even if they have a synced replica")
+@cli.argument("--batch-size", dest="batch_size", type=int,
+              default=BATCH_SIZE, help="DUMP and RESTORE per pipeline")
+@cli.argument("--rate", type=parse_size,
+              help="bytes copied per second, e.g. 50m")
+@cli.argument("--checkpoint", default=DEFAULT_CHECKPOINT,
+              help="slots copied already, to resume from")
+@timeout_argument
+@cli.pass_ctx
+def copy(ctx, args):
+    """Copy the keys of a cluster into another one, whatever their number
+    of masters, an interrupted copy is resumed
+    """
+    src = Cluster.from_node(ClusterNode.from_uri(args.src))
+    dst = Cluster.from_node(ClusterNode.from_uri(args.dst))
+    if not src.healthy() or not dst.healthy():
+        ctx.abort("Cluster not healthy.")
+        return
+
+    copier = ClusterCopier(src, dst, args.pattern, args.checkpoint,
+                           from_replicas=not args.from_masters,
+                           batch_size=args.batch_size, rate=args.rate)
+    try:
+        copier.run()
+    except CopyFailed as e:
+        ctx.abort("{}, run it again to resume from {}.".format(
+            e, copier.checkpoint_path))
+        return
+
+    echo("{} keys copied, {} failed".format(copier.copied, copier.failed))
+    if copier.failed:
+        echo("    last error:", copier.last_error, color="red")
+        ctx.abort("{} keys failed to copy.".format(copier.failed))
@@ -5,11 +5,16 @@ import redis
 import pprint
 
 from ruskit import cli
+from ..balancer import AutoBalancer, METRICS, balancer_arguments, skew
+from ..capacity import InvalidWeights, gen_weights, weight_arguments
 from ..cluster import Cluster, ClusterNode
 from ..utils import echo
 from ..distribute import print_cluster, gen_distribution
 from ..utils import timeout_argument
 from ..health import HealthCheckManager
+from ..slowlog import SlowLogAggregator, SlowLogCursor
+from ..fanout import FanoutExecutor, ROLES, echo_results, fanout_argument
+from ..migration import EvacuationError, MigrationFailed, MIGRATIONS_PER_NODE
 
 
 @cli.command
@@ -31,45 +36,92 @@ def info(args):
 
 @cli.command
 @cli.argument("cluster")
+@cli.argument("--raw", action="store_true")
+@cli.argument("--masters-only", dest="masters_only", action="store_true")
+@cli.argument("-n", "--top", type=int, default=20)
+@cli.argument("--sort", default="total", choices=SlowLogAggregator.SORT_KEYS)
+@cli.argument("--cursor-file", dest="cursor_file", default=None)
 @timeout_argument
 def slowlog(args):
+    """Show slowlogs of the cluster grouped by command fingerprint.
+
+    With --cursor-file, only entries not seen by the previous run are
+    fetched.
+    """
     cluster = Cluster.from_node(ClusterNode.from_uri(args.cluster))
-    slow_logs = cluster.get_slow_logs()
-    for master, logs in slow_logs.iteritems():
-        echo("Node: ", "%s:%s" % (master.host, master.port))
-        for log in logs:
-            time = datetime.datetime.fromtimestamp(log['start_time'])
-            echo(
-                "\t",
-                time,
-                "%s%s" % (log['duration'], "μs"),
-                repr(log['command'])
-                )
+    cursor = SlowLogCursor(args.cursor_file) if args.cursor_file else None
+    slow_logs = cluster.get_slow_logs(cursor, args.masters_only)
+    if cursor:
+        cursor.save()
+
+    if args.raw:
+        for node, logs in slow_logs.iteritems():
+            echo("Node: ", "%s:%s" % (node.host, node.port))
+            for log in logs:
+                time = datetime.datetime.fromtimestamp(log['start_time'])
+                echo(
+                    "\t",
+                    time,
+                    "%s%s" % (log['duration'], "μs"),
+                    repr(log['command'])
+                    )
+        return
+
+    aggregator = SlowLogAggregator()
+    for node, logs in slow_logs.iteritems():
+        aggregator.add(node, logs)
+
+    echo("{} entries from {} nodes".format(
+        sum(aggregator.nodes.values()), len(slow_logs)))
+    fmt = "{:>8} {:>14} {:>12} {:>6}  {}"
+    echo(fmt.format("count", "total(μs)", "p99(μs)", "nodes", "command"),
+         color="purple")
+    for stat in aggregator.top(args.top, args.sort):
+        echo(fmt.format(stat.count, stat.total, stat.p99, len(stat.nodes),
+                        stat.fingerprint))
 
 
 @cli.command
 @cli.argument("cluster")
+@weight_arguments
 @timeout_argument
-def fix(args):
+@cli.pass_ctx
+def fix(ctx, args):
     cluster = Cluster.from_node(ClusterNode.from_uri(args.cluster))
+    try:
+        weights = gen_weights(cluster.masters, args.weights, args.weight_by)
+    except InvalidWeights as e:
+        ctx.abort(str(e))
+        return
     cluster.fix_open_slots()
-    cluster.fill_slots()
+    cluster.fill_slots(weights)
 
 
 @cli.command
 @cli.argument("cluster")
 @cli.argument("nodes", nargs='+')
+@cli.argument("--drain", action="store_true",
+              help="promote a replica of the masters instead of migrating "
+                   "their slots when possible")
+@cli.argument("--migrations-per-node", dest="migrations_per_node", type=int,
+              default=MIGRATIONS_PER_NODE)
 @timeout_argument
-def delete(args):
-    """Delete nodes from the cluster
+@cli.pass_ctx
+def delete(ctx, args):
+    """Delete nodes from the cluster, the slots of all the masters are
+    moved by a single plan to the masters which stay
     """
     nodes = [ClusterNode.from_uri(n) for n in args.nodes]
     cluster = Cluster.from_node(ClusterNode.from_uri(args.cluster))
 
     echo("Deleting...")
-    for node in nodes:
-        cluster.delete_node(node)
-        cluster.wait()
+    try:
+        cluster.delete_nodes(nodes, drain=args.drain,
+                             per_node=args.migrations_per_node)
+    except (EvacuationError, MigrationFailed) as e:
+        ctx.abort(str(e))
+        return
+    cluster.wait()
 
 
 @cli.command
@@ -103,14 +155,54 @@ def migrate(ctx, args):
 
 @cli.command
 @cli.argument("cluster")
+@weight_arguments
 @timeout_argument
-def reshard(args):
+@cli.pass_ctx
+def reshard(ctx, args):
     """Balance slots in the cluster.
 
-    This command will try its best to distribute slots equally.
+    This command will try its best to distribute slots equally, or
+    proportionally to the capacity of the masters with weights.
+    """
+    cluster = Cluster.from_node(ClusterNode.from_uri(args.cluster))
+    try:
+        weights = gen_weights(cluster.masters, args.weights, args.weight_by)
+    except InvalidWeights as e:
+        ctx.abort(str(e))
+        return
+    cluster.reshard(weights)
+
+
+@cli.command
+@cli.argument("-d", "--daemon", action="store_true",
+              help="keep balancing the load of the masters")
+@cli.argument("cluster")
+@balancer_arguments
+@timeout_argument
+def balance(args):
+    """Show the load of the masters and its skew.
+
+    With --daemon, some slots are moved from the busiest master to the
+    idlest one whenever the skew stayed too high for a while.
     """
     cluster = Cluster.from_node(ClusterNode.from_uri(args.cluster))
-    cluster.reshard()
+    balancer = AutoBalancer(
+        cluster, args.metric, args.high, args.low, args.window,
+        args.quiet_hours, args.max_bytes_per_hour)
+    if args.daemon:
+        balancer.run(args.interval)
+        return
+
+    loads = balancer.measure()
+    fmt = "{:<22} {:>12} {:>12} {:>10}"
+    echo(fmt.format("node", "memory", "keys", "ops/sec"), color="purple")
+    for node in sorted(loads, key=lambda n: n.gen_addr()):
+        load = loads[node]
+        echo(fmt.format(node.gen_addr(), load['memory'], load['keys'],
+                        load['ops']))
+    for metric in METRICS:
+        echo("{} skew: {:.2f}".format(metric, skew(
+            dict((n, l[metric]) for n, l in loads.iteritems()))))
 
 
 @cli.command
@@ -134,27 +226,52 @@ def replicate(ctx, args):
     Cluster.from_node(master).wait()
 
 
+def flushall_command(args):
+    return ["FLUSHALL", "ASYNC"] if args.async_flush else ["FLUSHALL"]
+
+
 @cli.command
 @cli.argument("cluster")
+@cli.argument("--async", dest="async_flush", action="store_true")
+@fanout_argument
 @timeout_argument
-def destroy(args):
+@cli.pass_ctx
+def destroy(ctx, args):
     cluster = Cluster.from_node(ClusterNode.from_uri(args.cluster))
-    for node in cluster.masters:
-        node.flushall()
+    executor = FanoutExecutor(cluster, "masters", args.concurrency,
+                              args.node_timeout)
+    results = echo_results(executor.execute(*flushall_command(args)),
+                           stream=False)
+    failed = [r for r in results if not r.ok]
+    if failed:
+        ctx.abort("{} masters failed to flush, cluster not reset.".format(
+            len(failed)))
+        return
 
-    for node in cluster.nodes:
-        node.reset(hard=True)
+    executor.role = "all"
+    results = echo_results(executor.execute("CLUSTER RESET", "HARD"),
+                           stream=False)
+    failed = [r for r in results if not r.ok]
+    if failed:
+        ctx.abort("{} nodes failed to reset.".format(len(failed)))
 
 
 @cli.command
 @cli.argument("cluster")
+@cli.argument("--async", dest="async_flush", action="store_true")
+@fanout_argument
 @timeout_argument
-def flushall(args):
+@cli.pass_ctx
+def flushall(ctx, args):
     """Execute flushall in all cluster nodes.
     """
     cluster = Cluster.from_node(ClusterNode.from_uri(args.cluster))
-    for node in cluster.masters:
-        node.flushall()
+    executor = FanoutExecutor(cluster, "masters", args.concurrency,
+                              args.node_timeout)
+    results = echo_results(executor.execute(*flushall_command(args)))
+    failed = [r for r in results if not r.ok]
+    if failed:
+        ctx.abort("{} masters failed to flush.".format(len(failed)))
 
 
 @cli.command
@@ -163,6 +280,8 @@ def flushall(args):
 @cli.argument("value")
 @cli.argument("--config-command", default="config")
 @cli.argument("--rewrite", action="store_true")
+@cli.argument("-r", "--role", default="all", choices=ROLES)
+@fanout_argument
 @timeout_argument
 @cli.pass_ctx
 def reconfigure(ctx, args):
@@ -170,24 +289,32 @@ def reconfigure(ctx, args):
     if not cluster:
         ctx.abort("Cluster not exists")
 
-    for node in cluster.nodes:
-        echo("Setting `%s` of `%s` to `%s`" % (args.name, node, args.value))
+    def _set(node):
         node.execute_command(args.config_command + " SET",
                              args.name, args.value)
         if args.rewrite:
             node.execute_command(args.config_command + " REWRITE")
+        return "OK"
+
+    echo("Setting `%s` of %s nodes to `%s`" % (args.name, args.role,
+                                             args.value))
+    executor = FanoutExecutor(cluster, args.role, args.concurrency,
+                              args.node_timeout)
+    echo_results(executor.run(_set))
 
 
 @cli.command
 @cli.argument("cluster")
 @cli.argument("command", nargs='+')
+@cli.argument("-r", "--role", default="all", choices=ROLES)
+@fanout_argument
 @timeout_argument
 @cli.pass_ctx
 def cmd(ctx, args):
     cluster = Cluster.from_node(ClusterNode.from_uri(args.cluster))
-    command = args.command
-    for n in cluster.nodes:
-        print n.execute_command(*command)
+    executor = FanoutExecutor(cluster, args.role, args.concurrency,
+                              args.node_timeout)
+    echo_results(executor.execute(*args.command))
 
 
 @cli.command
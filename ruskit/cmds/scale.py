@@ -1,13 +1,22 @@
+import logging
+import os
 from itertools import repeat
 
 from ruskit import cli
 from ..cluster import Cluster, ClusterNode
 from ..distribute import (MaxFlowSolver, print_cluster, gen_distribution,
     RearrangeSlaveManager)
-from ..failover import FastAddMachineManager
+from ..failover import FastAddMachineManager, FailoverFailed
+from ..replication import SyncLimits, sync_limit_arguments
+from ..topology import Topology, POLICIES, DEFAULT_POLICY
+from ..tuning import ReplicationTuning, tuning_arguments, DEFAULT_SNAPSHOT
 from ..utils import echo, timeout_argument
 
 
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
 class AddMastersManager(object):
     def __init__(self, cluster, new_nodes):
         self.cluster = cluster
@@ -28,11 +37,11 @@ class AddMastersManager(object):
 
 
 class AddSlavesManager(object):
-    def __init__(self, cluster, new_nodes, max_slaves_limit):
+    def __init__(self, cluster, new_nodes, max_slaves_limit, topology=None):
         self.cluster = cluster
         self.new_nodes = new_nodes
         self.solver = MaxFlowSolver.from_nodes(
-            cluster.nodes, new_nodes, max_slaves_limit)
+            cluster.nodes, new_nodes, max_slaves_limit, topology)
 
     def peek_result(self):
         match, frees = self.solver.distribute_slaves()
@@ -45,7 +54,7 @@ class AddSlavesManager(object):
             'frees': frees,
         }
 
-    def add_slaves(self, fast_mode=False):
+    def add_slaves(self, fast_mode=False, limits=None, tuning=None):
         result, frees = self.solver.distribute_slaves()
         nodes = []
         for free, master in result:
@@ -54,12 +63,26 @@ class AddSlavesManager(object):
                 'role': 'slave',
                 'master': master.name,
             })
-        self.cluster.add_slaves(nodes, fast_mode)
+        self.cluster.add_slaves(nodes, fast_mode, limits, tuning=tuning)
         self.cluster.wait()
 
     def get_distribution(self):
         return self.solver.get_distribution()
 
+
+def topology_argument(func):
+    func = cli.argument("--topology-policy", dest="topology_policy",
+                        default=DEFAULT_POLICY, choices=sorted(POLICIES))(func)
+    return cli.argument("--topology",
+                        help="file of `host rack zone` lines")(func)
+
+
+def load_topology(args):
+    if not args.topology:
+        return None
+    return Topology.load(args.topology, args.topology_policy)
+
+
 def gen_nodes_from_args(nodes):
     new_nodes = []
     for n in nodes:
@@ -69,11 +92,14 @@ def gen_nodes_from_args(nodes):
 
 
 class MoveSlaveManager(object):
-    def __init__(self, cluster, new_nodes, fast_mode=False):
+    def __init__(self, cluster, new_nodes, fast_mode=False, topology=None,
+                 limits=None, tuning=None):
         self.cluster = cluster
         self.new_nodes = new_nodes
         self.fast_mode = fast_mode
-        self.manager = RearrangeSlaveManager(cluster, new_nodes)
+        self.limits = limits
+        self.tuning = tuning
+        self.manager = RearrangeSlaveManager(cluster, new_nodes, topology)
 
     def peek_result(self):
         plan = self.manager.gen_plan()
@@ -117,7 +143,8 @@ class MoveSlaveManager(object):
                 'role': 'slave',
                 'master': master.name,
             })
-        self.cluster.add_slaves(nodes, self.fast_mode)
+        self.cluster.add_slaves(nodes, self.fast_mode, self.limits,
+                                tuning=self.tuning)
         self.cluster.wait()
 
 
@@ -129,6 +156,9 @@ class MoveSlaveManager(object):
     action="store_true")
 @cli.argument("cluster")
 @cli.argument("nodes", nargs='+')
+@topology_argument
+@sync_limit_arguments
+@tuning_arguments
 @timeout_argument
 @cli.pass_ctx
 def addslave(ctx, args):
@@ -138,7 +168,8 @@ def addslave(ctx, args):
     if not cluster.healthy():
         ctx.abort("Cluster not healthy.")
 
-    manager = AddSlavesManager(cluster, new_nodes, args.slaves_limit)
+    manager = AddSlavesManager(cluster, new_nodes, args.slaves_limit,
+                               load_topology(args))
     if args.peek:
         echo('before', color='purple')
         print_cluster(manager.get_distribution())
@@ -146,17 +177,27 @@ def addslave(ctx, args):
         echo('after', color='purple')
         print_cluster(manager.get_distribution())
     else:
-        manager.add_slaves(fast_mode=args.fast_mode)
+        manager.add_slaves(fast_mode=args.fast_mode,
+                           limits=SyncLimits.from_args(args),
+                           tuning=ReplicationTuning.from_args(args))
 
 
 @cli.command
 @cli.argument("-p", "--peek", dest="peek", default=False, action="store_true")
 @cli.argument("-f", "--fast-mode", dest="fast_mode", default=False,
     action="store_true")
+@cli.argument("-g", "--graceful", dest="graceful", default=False,
+    action="store_true",
+    help="wait for the slaves to catch up and use a coordinated failover")
+@cli.argument("--pause-writes", dest="pause_writes", type=int,
+    help="milliseconds the writes of a master are paused for the failover")
 @cli.argument("cluster")
 @cli.argument("nodes", nargs='+')
+@sync_limit_arguments
+@tuning_arguments
 @timeout_argument
-def movemaster(args):
+@cli.pass_ctx
+def movemaster(ctx, args):
     new_nodes = gen_nodes_from_args(args.nodes)
     cluster = Cluster.from_node(ClusterNode.from_uri(args.cluster))
 
@@ -169,7 +210,13 @@ def movemaster(args):
         result = manager.peek_result()
         print 'plan: ', result['plan']
     else:
-        manager.move_masters_to_new_hosts(fast_mode=args.fast_mode)
+        try:
+            manager.move_masters_to_new_hosts(
+                fast_mode=args.fast_mode, limits=SyncLimits.from_args(args),
+                tuning=ReplicationTuning.from_args(args),
+                graceful=args.graceful, pause=args.pause_writes)
+        except FailoverFailed as e:
+            ctx.abort(str(e))
 
 
 @cli.command
@@ -178,6 +225,9 @@ def movemaster(args):
     action="store_true")
 @cli.argument("cluster")
 @cli.argument("nodes", nargs='+')
+@topology_argument
+@sync_limit_arguments
+@tuning_arguments
 @timeout_argument
 def moveslave(args):
     new_nodes = gen_nodes_from_args(args.nodes)
@@ -186,8 +236,24 @@ def moveslave(args):
     if not cluster.healthy():
         logger.warn('Cluster not healthy.')
 
-    manager = MoveSlaveManager(cluster, new_nodes, args.fast_mode)
+    manager = MoveSlaveManager(cluster, new_nodes, args.fast_mode,
+                               load_topology(args),
+                               SyncLimits.from_args(args),
+                               ReplicationTuning.from_args(args))
     if args.peek:
         print_cluster(manager.peek_result())
     else:
         manager.move_slaves()
+
+
+@cli.command
+@cli.argument("snapshot", nargs='?', default=DEFAULT_SNAPSHOT)
+@cli.pass_ctx
+def untune(ctx, args):
+    """Restore the replication settings saved by `--tune-replication`"""
+    tuning = ReplicationTuning(args.snapshot)
+    if not os.path.exists(args.snapshot):
+        ctx.abort("No snapshot at {}.".format(args.snapshot))
+        return
+    for addr in tuning.restore():
+        echo('restored', addr, color='green')
@@ -1,12 +1,18 @@
+import heapq
 import operator
 from copy import copy
 from itertools import imap, repeat, izip_longest
 
 from .cluster import Cluster, ClusterNode
-from .utils import echo
+from .maxflow import Graph
+from .topology import solve
+from .utils import echo, flatten
 
 
 class NodeWrapper(object):
+    # planning for thousands of instances creates many wrappers
+    __slots__ = ('node', 'tag', 'host_index', 'master', 'slaves')
+
     def __init__(self, node, tag, host_index, master=None):
         self.node = node
         self.tag = tag
@@ -22,6 +28,9 @@ class NodeWrapper(object):
         return nodes_per_host
 
     def __getattr__(self, attr):
+        if attr in NodeWrapper.__slots__:
+            # not initialized yet, e.g. while being copied
+            raise AttributeError(attr)
         return getattr(self.node, attr)
 
     def __repr__(self):
@@ -57,18 +66,22 @@ class InvalidMasterDistribution(DistributionError):
 
 
 class MaxFlowBase(object):
-    def __init__(self, host_count):
+    def __init__(self, host_count, topology=None):
         self.vertex_count = 2 * host_count + 2
         self.s = self.vertex_count - 2
         self.t = self.vertex_count - 1
+        self.topology = topology
 
     def _gen_graph(self):
-        # make it lazy to support optional addslaves command
-        from igraph import Graph
-        g = Graph().as_directed()
-        g.add_vertices(self.vertex_count)
-        g.es['weight'] = 1  # enable weight
-        return g
+        return Graph(self.vertex_count)
+
+    def _maxflow(self, g, hosts):
+        '''With a topology, pick the max flow which best separates failure
+        domains.
+        '''
+        if self.topology is not None:
+            self.topology.apply(g, hosts, len(hosts))
+        return solve(g, self.s, self.t, self.topology)
 
     @staticmethod
     def _sort_masters(masters):
@@ -80,15 +93,18 @@ class MaxFlowSolver(MaxFlowBase):
     '''Slaves distribution problem can be converted to max flow problem'''
 
     @classmethod
-    def from_nodes(cls, nodes, new_nodes, max_slaves_limit=None):
+    def from_nodes(cls, nodes, new_nodes, max_slaves_limit=None,
+                   topology=None):
         '''When this is used only for peeking reuslt
            `new_nodes` can be any type with `host` and `port` attributes
         '''
         param = gen_distribution(nodes, new_nodes)
         param['max_slaves_limit'] = max_slaves_limit
+        param['topology'] = topology
         return cls(**param)
 
-    def __init__(self, hosts, masters, slaves, frees, max_slaves_limit):
+    def __init__(self, hosts, masters, slaves, frees, max_slaves_limit,
+                 topology=None):
         host_count = len(hosts)
         self.hosts = hosts
         self.host_count = host_count
@@ -97,12 +113,11 @@ class MaxFlowSolver(MaxFlowBase):
         self.frees = frees
         self.orphans = [
             [m for m in machine if len(m.slaves) == 0] for machine in masters]
-        self.orphans_count = len(sum(self.orphans, []))
-        self.slice_tags = []
-        for ss in slaves:
-            self.slice_tags.append([s.master.tag for s in ss])
+        self.orphans_count = sum(map(len, self.orphans))
+        # tags of the masters which already have a slave on each host
+        self.slice_tags = [set(s.master.tag for s in ss) for ss in slaves]
 
-        super(MaxFlowSolver, self).__init__(host_count)
+        super(MaxFlowSolver, self).__init__(host_count, topology)
         self.result = []
         self.finished = False
         self.max_slaves_limit = max_slaves_limit
@@ -140,7 +155,7 @@ class MaxFlowSolver(MaxFlowBase):
                     continue
                 g[i, ct + j] = len(self.frees[i])
 
-        mf = g.maxflow(self.s, self.t, g.es['weight'])
+        mf = self._maxflow(g, self.hosts)
         if mf.value < self.orphans_count:
             missing = self._gen_hosts_missing_slaves(g, mf)
             raise MissingSlaves(missing)
@@ -149,16 +164,16 @@ class MaxFlowSolver(MaxFlowBase):
             if e.source == self.s or e.target == self.t:
                 continue
             for _ in xrange(int(mf.flow[edge_index])):
-                f = self.frees[e.source].pop(0)
+                f = self.frees[e.source].pop()
                 o = self.orphans[e.target - ct].pop()
                 f.master = o
                 o.slaves.append(f)
                 self.slaves[e.source].append(f)
-                self.slice_tags[e.source].append(o.tag)
+                self.slice_tags[e.source].add(o.tag)
                 self.result.append((f, o))
         # check all masters have slaves
-        assert len(sum(self.orphans, [])) == 0
-        assert all(len(m.slaves) > 0 for m in sum(self.masters, []))
+        assert not any(self.orphans)
+        assert all(len(m.slaves) > 0 for m in flatten(self.masters))
 
     def _gen_hosts_missing_slaves(self, g, maxflow):
         ct = self.host_count
@@ -176,41 +191,54 @@ class MaxFlowSolver(MaxFlowBase):
         ct = self.host_count
         flow_in = map(len, self.frees)
         if self.max_slaves_limit is None:
-            flow_out = list(repeat(len(sum(self.frees, [])), ct))
+            flow_out = list(repeat(sum(flow_in), ct))
         else:
             flow_out = self._gen_limits()
         for i, c in enumerate(flow_in):
             g[self.s, i] = c
         for i, c in enumerate(flow_out):
             g[i + ct, self.t] = c
+        # masters_in[i][j]: masters on host j having a slave on host i
+        masters_in = [[0] * ct for _ in xrange(ct)]
+        for i, ss in enumerate(self.slaves):
+            for _, host_index in set(
+                    (s.master.tag, s.master.host_index) for s in ss):
+                masters_in[i][host_index] += 1
         for i in xrange(ct):
             for j in xrange(ct):
                 if i == j:
                     continue
-                masters_in_j = set(
-                    s.master.tag for s in self.slaves[i] \
-                    if s.master.host_index == j)
-                limit = len(self.masters[j]) - len(masters_in_j)
+                limit = len(self.masters[j]) - masters_in[i][j]
                 g[i, ct + j] = min(len(self.frees[i]), limit)
-        mf = g.maxflow(self.s, self.t, g.es['weight'])
+        mf = self._maxflow(g, self.hosts)
 
-        self._sort_masters(self.masters)
+        # masters of each host in a heap ordered by their slaves count
+        heaps = [[(len(m.slaves), k, m) for k, m in enumerate(ms)]
+                 for ms in self.masters]
+        for h in heaps:
+            heapq.heapify(h)
         for edge_index, e in enumerate(g.es):
             if e.source == self.s or e.target == self.t:
                 continue
+            heap = heaps[e.target - ct]
+            tags = self.slice_tags[e.source]
             for _ in xrange(int(mf.flow[edge_index])):
-                f = self.frees[e.source].pop(0)
-                m = next((m for m in self.masters[e.target - ct] \
-                    if m.tag not in self.slice_tags[e.source]), None)
-                assert m is not None
+                f = self.frees[e.source].pop()
+                skipped = []
+                while heap[0][2].tag in tags:
+                    skipped.append(heapq.heappop(heap))
+                _, k, m = heapq.heappop(heap)
                 f.master = m
                 m.slaves.append(f)
                 self.slaves[e.source].append(f)
                 self.result.append((f, m))
-                self.slice_tags[e.source].append(m.tag)
-                self.masters[e.target - ct].sort(key=lambda m: len(m.slaves))
+                tags.add(m.tag)
+                heapq.heappush(heap, (len(m.slaves), k, m))
+                for item in skipped:
+                    heapq.heappush(heap, item)
 
-        self.remaining_frees = sum(self.frees, [])
+        self._sort_masters(self.masters)
+        self.remaining_frees = flatten(self.frees)
 
     def _gen_limits(self):
         limits = []
@@ -284,12 +312,13 @@ def print_cluster(distribution):
 
 class RearrangeSlaveManager(MaxFlowBase):
     '''Change all masters to have exactly one slave'''
-    def __init__(self, cluster, new_nodes):
+    def __init__(self, cluster, new_nodes, topology=None):
         self.cluster = cluster
         self.new_nodes = new_nodes
         self.result = None
         self.dis = gen_distribution(self.cluster.nodes, self.new_nodes)
-        super(RearrangeSlaveManager, self).__init__(len(self.dis['hosts']))
+        super(RearrangeSlaveManager, self).__init__(len(self.dis['hosts']),
+                                                    topology)
 
     def check_masters_distribution():
         masters_per_host = [len(m) for m in self.dis['masters']]
@@ -313,15 +342,14 @@ class RearrangeSlaveManager(MaxFlowBase):
         slaves = map(copy, self.dis['slaves'])
         frees = map(copy, self.dis['frees'])
         ct = len(hosts)
-        masters_per_host = (len(sum(masters, [])) + ct - 1) / ct
+        masters_num = sum(map(len, masters))
+        masters_per_host = (masters_num + ct - 1) / ct
         limit = 1 + masters_per_host / ct
 
         # first assume that there is no slave for every master
         g = self._gen_graph()
         flow_in = map(len, frees)
         flow_out = map(len, masters)
-        for i, c in enumerate(flow_in):
-            g[self.s, i] = c
         for i, c in enumerate(flow_out):
             g[i + ct, self.t] = c
         for i in xrange(ct):
@@ -329,9 +357,24 @@ class RearrangeSlaveManager(MaxFlowBase):
                 if i == j:
                     continue
                 g[i, ct + j] = min(len(frees[i]), limit, len(masters[j]))
-        mf = g.maxflow(self.s, self.t, g.es['weight'])
-
+        # Many max flows exist, prefer one that leaves every host with
+        # about the same number of nodes. Fall back to any max flow.
+        # Host i ends up with its masters, the slaves flowing out of it
+        # and its slaves of masters it has no edge to, which the plan
+        # below never touches (including masters on the same host).
         curr_map = self._gen_curr_map()
+        nodes_per_host = (2 * masters_num + ct - 1) / ct
+        for i, c in enumerate(flow_in):
+            untouched = sum(curr_map[i][j] for j in xrange(ct)
+                            if g.get_eid(i, ct + j, error=False) < 0)
+            room = nodes_per_host - len(masters[i]) - untouched
+            g[self.s, i] = max(0, min(c, room))
+        mf = self._maxflow(g, hosts)
+        if mf.value < masters_num:
+            for i, c in enumerate(flow_in):
+                g[self.s, i] = c
+            mf = self._maxflow(g, hosts)
+
         edges = []
         for edge_index, e in enumerate(g.es):
             if e.source == self.s or e.target == self.t:
@@ -379,9 +422,7 @@ class RearrangeSlaveManager(MaxFlowBase):
 
     def assert_plan(self, delete_plan, add_plan):
         dis = gen_distribution(self.cluster.nodes, self.new_nodes)
-        slaves = sum(dis['slaves'], [])
-        masters = sum(dis['masters'], [])
-
-        slaves_num = len(slaves) - len(delete_plan) + len(add_plan)
-        if slaves_num != len(masters):
+        slaves_num = sum(map(len, dis['slaves'])) - len(delete_plan) + \
+            len(add_plan)
+        if slaves_num != sum(map(len, dis['masters'])):
             raise DistributionError()
@@ -0,0 +1,171 @@
+'''Estimates of the keyspace of a cluster from random samples.
+
+Every master is sampled concurrently with pipelined batches of RANDOMKEY,
+then of `MEMORY USAGE`, `TYPE` and `TTL` of the keys returned. The mean
+size of the sample times DBSIZE estimates the memory of the master, with
+a confidence interval from the standard error of the mean. The shares of
+the types and TTLs come with Wilson score intervals, which stay within
+0 and 1 and hold for the rare types of a small sample. The bytes of
+a slot are its `CLUSTER COUNTKEYSINSLOT` times the mean size of its
+master, so a few thousand commands per master are enough whatever the
+size of the cluster.
+
+The per-slot estimates are a `SlotTable`, which the planners load like
+the one of a full scan.
+'''
+import logging
+import math
+from collections import Counter
+
+from .slotmap import SlotTable, TYPES
+from .utils import concurrent_map, DEFAULT_WORKERS
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+SAMPLES = 1000
+BATCH_SIZE = 100
+# z of a 95% confidence interval
+Z_95 = 1.96
+# (upper bound in seconds, name), keys without any TTL are 'none'
+TTL_BUCKETS = ((60, '<1m'), (3600, '<1h'), (86400, '<1d'), (None, '>=1d'))
+
+
+def ttl_bucket(ttl):
+    # the TTL reply of a key without any expire is None with redis.Redis
+    if ttl is None or ttl < 0:
+        return 'none'
+    for bound, name in TTL_BUCKETS:
+        if bound is None or ttl < bound:
+            return name
+
+
+def wilson(count, n, z=Z_95):
+    '''(low, high) Wilson score interval of the proportion `count` / `n`'''
+    if n <= 0:
+        return 0.0, 1.0
+    p = float(count) / n
+    z2 = z * z
+    scale = 1 + z2 / n
+    center = (p + z2 / (2 * n)) / scale
+    half = z * math.sqrt(p * (1 - p) / n + z2 / (4 * n * n)) / scale
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+def sample_keys(node, samples=SAMPLES, batch=BATCH_SIZE):
+    '''[(size, type, ttl)] of `samples` random keys of `node`'''
+    result = []
+    while len(result) < samples:
+        pipe = node.pipeline(transaction=False)
+        for _ in xrange(min(batch, samples - len(result))):
+            pipe.execute_command('RANDOMKEY')
+        keys = [k for k in pipe.execute() if k is not None]
+        if not keys:
+            # empty node
+            break
+        pipe = node.pipeline(transaction=False)
+        for key in keys:
+            pipe.execute_command('MEMORY USAGE', key)
+            pipe.execute_command('TYPE', key)
+            pipe.execute_command('TTL', key)
+        replies = pipe.execute(raise_on_error=False)
+        for i in xrange(len(keys)):
+            size, type_, ttl = replies[3 * i:3 * i + 3]
+            # expired or deleted since the RANDOMKEY
+            if size is None or isinstance(size, Exception):
+                continue
+            result.append((size, type_, ttl))
+    return result
+
+
+def count_slot_keys(node, slots):
+    '''{slot: keys} of the `slots` of `node`, in a single pipeline'''
+    pipe = node.pipeline(transaction=False)
+    for slot in slots:
+        pipe.execute_command('CLUSTER COUNTKEYSINSLOT', slot)
+    return dict(zip(slots, pipe.execute()))
+
+
+class NodeEstimate(object):
+    def __init__(self, node, dbsize, samples, slot_keys):
+        self.node = node
+        self.dbsize = dbsize
+        self.samples = samples
+        self.slot_keys = slot_keys
+        self.types = Counter(t for _, t, _ in samples)
+        self.ttls = Counter(ttl_bucket(ttl) for _, _, ttl in samples)
+
+    @property
+    def mean(self):
+        if not self.samples:
+            return 0.0
+        return float(sum(s for s, _, _ in self.samples)) / len(self.samples)
+
+    @property
+    def stderr(self):
+        '''Standard error of the mean size'''
+        n = len(self.samples)
+        if n < 2:
+            return 0.0
+        mean = self.mean
+        var = sum((s - mean) ** 2 for s, _, _ in self.samples) / (n - 1)
+        return math.sqrt(var / n)
+
+    @property
+    def memory(self):
+        return self.mean * self.dbsize
+
+    def interval(self, z=Z_95):
+        '''Half width of the confidence interval of `memory`'''
+        return z * self.stderr * self.dbsize
+
+    def mix(self, counter):
+        '''{name: share} of the sampled keys'''
+        total = float(sum(counter.values())) or 1
+        return dict((k, v / total) for k, v in counter.iteritems())
+
+    def mix_intervals(self, counter, z=Z_95):
+        '''{name: (low, high)} confidence intervals of the shares'''
+        n = sum(counter.values())
+        return dict((k, wilson(v, n, z)) for k, v in counter.iteritems())
+
+
+def estimate_node(node, samples=SAMPLES):
+    slot_keys = count_slot_keys(node, node.slots) if node.slots else {}
+    return NodeEstimate(node, node.dbsize(), sample_keys(node, samples),
+                        slot_keys)
+
+
+def estimate_cluster(masters, samples=SAMPLES, workers=DEFAULT_WORKERS):
+    estimates = []
+    for node, result, err in concurrent_map(
+            lambda n: estimate_node(n, samples), masters, workers):
+        if err is not None:
+            logger.warning('failed to sample %s: %s', node, err)
+            continue
+        estimates.append(result)
+    return estimates
+
+
+def total(estimates, z=Z_95):
+    '''Memory of all the estimates and the half width of its interval,
+    the masters being sampled independently.
+    '''
+    memory = sum(e.memory for e in estimates)
+    interval = math.sqrt(sum(e.interval(z) ** 2 for e in estimates))
+    return memory, interval
+
+
+def slot_table(estimates):
+    '''A `SlotTable` of the keys of every slot with the mean size and the
+    type mix of its master.
+    '''
+    table = SlotTable()
+    for e in estimates:
+        types = e.mix(e.types)
+        for slot, keys in e.slot_keys.iteritems():
+            table.keys[slot] = keys
+            table.bytes[slot] = int(round(keys * e.mean))
+            for t in TYPES:
+                table.types[t][slot] = int(round(keys * types.get(t, 0)))
+    return table
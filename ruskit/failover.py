@@ -1,16 +1,166 @@
+from collections import defaultdict
 from copy import copy
 import logging
 from itertools import izip_longest
+import threading
+import time
 
 import redis
 
 from .cluster import Cluster, ClusterNode
 from .distribute import gen_distribution, NodeWrapper
+from .replication import format_size
+from .utils import echo, flatten, concurrent_map, DEFAULT_WORKERS, \
+    RuskitException
 
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
+# concurrent failovers of the new masters on the same host
+FAILOVERS_PER_HOST = 2
+PROMOTE_RETRIES = 5
+# seconds a node has to report itself as master after CLUSTER FAILOVER
+PROMOTE_TIMEOUT = 10
+PROMOTE_POLL_INTERVAL = 0.1
+# seconds a graceful failover waits for the slave to catch up
+CATCHUP_TIMEOUT = 30
+# bytes the slave may still lag when a graceful failover starts, the
+# master pauses its clients while the slave receives the rest
+CATCHUP_LAG = 64 << 10
+# the coordinated CLUSTER FAILOVER first, then FORCE and TAKEOVER
+FAILOVER_MODES = ('default', 'force', 'takeover')
+
+
+class FailoverFailed(RuskitException):
+    pass
+
+
+def interleave_by_host(nodes):
+    '''[a1, a2, b1] -> [a1, b1, a2], so that the nodes waiting for the
+    limit of their host do not hold back the nodes of other hosts.
+    '''
+    by_host = defaultdict(list)
+    for n in nodes:
+        by_host[n.host].append(n)
+    hosts = sorted(by_host)
+    return filter(None, flatten(izip_longest(*[by_host[h] for h in hosts])))
+
+
+def wait_for_master(node, timeout):
+    deadline = time.time() + timeout
+    while node.role() != 'master':
+        if time.time() >= deadline:
+            return False
+        time.sleep(PROMOTE_POLL_INTERVAL)
+    return True
+
+
+class ShardFailover(object):
+    '''Graceful failover of a shard from `master` to its `slave`.
+
+    The slave first catches up with the offset of the master, optionally
+    while the writes of the master are paused for `pause` milliseconds,
+    then a coordinated CLUSTER FAILOVER makes sure no acknowledged write
+    is lost. FORCE and then TAKEOVER are only sent when the previous mode
+    did not promote the slave within `timeout` seconds.
+
+    `window` is the time the shard did not accept writes, from the pause
+    or the first failover to the promotion of the slave, and `lag` the
+    bytes the slave was missing when it was promoted by FORCE or TAKEOVER.
+    '''
+    def __init__(self, master, slave, timeout=PROMOTE_TIMEOUT,
+                 catchup_timeout=CATCHUP_TIMEOUT, pause=None):
+        self.master = master
+        self.slave = slave
+        self.timeout = timeout
+        self.catchup_timeout = catchup_timeout
+        self.pause = pause
+        self.mode = None
+        self.window = None
+        self.lag = None
+
+    def lag_bytes(self):
+        master_offset = self.master.info('replication')['master_repl_offset']
+        slave_offset = self.slave.info('replication').get(
+            'slave_repl_offset', 0)
+        return max(0, master_offset - slave_offset)
+
+    def wait_catchup(self, max_lag, timeout):
+        '''Return the last lag of the slave, None if the master or the
+        slave could not be reached.
+        '''
+        deadline = time.time() + timeout
+        while True:
+            try:
+                lag = self.lag_bytes()
+            except redis.RedisError as e:
+                logger.warning('failed to read the offsets of {}: {}'.format(
+                    self.slave, e))
+                return None
+            if lag <= max_lag or time.time() >= deadline:
+                return lag
+            time.sleep(PROMOTE_POLL_INTERVAL)
+
+    def pause_writes(self):
+        '''Return False for the servers before redis 6.2, as they can only
+        pause all the clients, including the polling of the offsets.
+        '''
+        try:
+            self.master.execute_command('CLIENT PAUSE', self.pause, 'WRITE')
+        except redis.ResponseError as e:
+            logger.warning('not pausing the writes of {}, CLIENT PAUSE '
+                           'WRITE failed: {}'.format(self.master, e))
+            return False
+        return True
+
+    def unpause_writes(self):
+        try:
+            self.master.execute_command('CLIENT UNPAUSE')
+        except redis.RedisError:
+            # the pause will time out by itself
+            pass
+
+    def run(self):
+        lag = self.wait_catchup(CATCHUP_LAG, self.catchup_timeout)
+        start = time.time()
+        paused = False
+        if self.pause and lag is not None:
+            try:
+                paused = self.pause_writes()
+            except redis.RedisError as e:
+                logger.warning('failed to pause the writes of {}: {}'.format(
+                    self.master, e))
+            if paused:
+                self.wait_catchup(0, self.pause / 1000.0)
+
+        try:
+            for mode in FAILOVER_MODES:
+                if mode != 'default':
+                    self.lag = self.wait_catchup(0, 0)
+                    logger.warning('{} failover of {} timed out, trying '
+                                   '{}'.format(self.mode, self.slave, mode))
+                self.mode = mode
+                self.slave.failover(force=mode == 'force',
+                                    takeover=mode == 'takeover')
+                if wait_for_master(self.slave, self.timeout):
+                    self.window = time.time() - start
+                    if mode == 'default':
+                        self.lag = 0
+                    return True
+            return False
+        finally:
+            if paused:
+                self.unpause_writes()
+
+    def report(self):
+        if self.window is None:
+            return '{} -> {}: failed'.format(self.master, self.slave)
+        lag = 'unknown' if self.lag is None else format_size(self.lag)
+        return '{} -> {}: {} failover, writes unavailable for {:.2f}s, ' \
+            '{} behind'.format(self.master, self.slave, self.mode,
+                               self.window, lag)
+
 
 class FastAddMachineManager(object):
     def __init__(self, cluster, new_nodes):
@@ -56,14 +206,20 @@ class FastAddMachineManager(object):
             return self.result
         return self.gen_plan(self.new_nodes)
 
-    def move_masters_to_new_hosts(self, fast_mode=False):
+    def move_masters_to_new_hosts(self, fast_mode=False, limits=None,
+                                  tuning=None, graceful=False, pause=None):
         result = self.gen_plan(self.new_nodes)
         plan = result['plan']
         logger.info('move plan: {}'.format(plan))
-        self.add_tmp_slaves(plan, fast_mode)
-        self.promote_new_masters(plan)
+        self.add_tmp_slaves(plan, fast_mode, limits, tuning)
+        slaves = self.promote_new_masters(plan, graceful=graceful,
+                                          pause=pause)
+        self.cluster.wait()
+        if slaves:
+            raise FailoverFailed('{} nodes are still slaves: {}'.format(
+                len(slaves), ', '.join(n.gen_addr() for n in slaves)))
 
-    def add_tmp_slaves(self, plan, fast_mode):
+    def add_tmp_slaves(self, plan, fast_mode, limits=None, tuning=None):
         nodes = []
         for p in plan:
             nodes.append({
@@ -71,34 +227,69 @@ class FastAddMachineManager(object):
                 'role': 'slave',
                 'master': p['master'].name,
             })
-        self.cluster.add_slaves(nodes, fast_mode)
+        self.cluster.add_slaves(nodes, fast_mode, limits, tuning=tuning)
         self.cluster.wait()
 
-    def promote_new_masters(self, plan):
-        retry = 5
+    def promote_new_masters(self, plan, per_host=FAILOVERS_PER_HOST,
+                            retries=PROMOTE_RETRIES,
+                            timeout=PROMOTE_TIMEOUT,
+                            workers=DEFAULT_WORKERS, graceful=False,
+                            pause=None, catchup_timeout=CATCHUP_TIMEOUT):
+        '''Fail over to the new masters concurrently, at most `per_host`
+        of them at the same time on a host. A failover is over once `ROLE`
+        of the node says it is a master, only the failed ones are retried.
+        With `graceful`, every shard is failed over by a `ShardFailover`
+        instead of a TAKEOVER and its write unavailability is reported.
+        Return the nodes which are still slaves.
+        '''
         new_masters = [p['slave'].node for p in plan]
-        while len(new_masters) and retry > 0:
-            for m in new_masters:
-                try:
-                    m.failover(takeover=True)
-                except redis.RedisError as e:
-                    logger.error(str(e))
-            self.cluster.wait()
-            for n in new_masters:
-                n.flush_cache()
-            new_masters = [n for n in new_masters if not n.is_master()]
-            if len(new_masters) == 0:
+        old_masters = {p['slave'].node: p['master'].node for p in plan}
+        limits = {n.host: threading.Semaphore(per_host) for n in new_masters}
+        failovers = {}
+
+        def _promote(node):
+            with limits[node.host]:
+                if not graceful:
+                    return self.promote(node, timeout)
+                failovers[node] = ShardFailover(
+                    old_masters[node], node, timeout, catchup_timeout, pause)
+                return failovers[node].run()
+
+        start = time.time()
+        for _ in xrange(retries):
+            failed = []
+            for node, promoted, err in concurrent_map(
+                    _promote, interleave_by_host(new_masters), workers):
+                if err is not None:
+                    logger.error('failover of {} failed: {}'.format(
+                        node, err))
+                if not promoted:
+                    failed.append(node)
+            new_masters = failed
+            if not new_masters:
                 break
-            retry -= 1
             logger.warning(
                 'The nodes below are still slaves: {}'.format(new_masters))
+        logger.info('failovers took {:.1f} seconds'.format(
+            time.time() - start))
+        for node in sorted(failovers, key=lambda n: (n.host, n.port)):
+            echo(failovers[node].report(),
+                 color='green' if failovers[node].window is not None
+                 else 'red')
+        for p in plan:
+            p['slave'].node.flush_cache()
+        return new_masters
+
+    def promote(self, node, timeout=PROMOTE_TIMEOUT):
+        node.failover(takeover=True)
+        return wait_for_master(node, timeout)
 
     def gen_plan(self, new_nodes):
         plan = []
         masters = map(copy, self.dis['masters'])
         frees = filter(None, map(copy, self.dis['frees']))
         # merge [[a,b], [c], [d,e,f]] to [a,c,d,b,e,f] for example
-        frees = filter(None, sum(map(list, izip_longest(*frees)), []))
+        frees = filter(None, flatten(izip_longest(*frees)))
         new_masters = {f.host_index: [] for f in frees}
 
         while not self.check_even(masters, new_masters) and len(frees):
@@ -0,0 +1,124 @@
+import logging
+import time
+from collections import OrderedDict
+
+from ruskit import cli
+from .cluster import ClusterNode
+from .utils import echo, concurrent_map, DEFAULT_WORKERS, NO_RETRY
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+ROLES = ('all', 'masters', 'slaves')
+
+
+class FanoutResult(object):
+    def __init__(self, node, reply=None, error=None, elapsed=0):
+        self.node = node
+        self.reply = reply
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return '{} {!r}'.format(self.node.gen_addr(), self.reply)
+        return '{} (error) {}'.format(self.node.gen_addr(), self.error)
+
+
+class FanoutExecutor(object):
+    '''Run the same operation on many nodes of a cluster concurrently.
+
+    At most `workers` nodes are handled at the same time. If `timeout` is
+    given, every node is accessed through a dedicated connection with that
+    socket timeout and without retrying, so one stuck node can not hold
+    the whole run.
+    '''
+    def __init__(self, cluster, role='all', workers=DEFAULT_WORKERS,
+                 timeout=None):
+        assert role in ROLES
+        self.cluster = cluster
+        self.role = role
+        self.workers = workers
+        self.timeout = timeout
+
+    @property
+    def nodes(self):
+        if self.role == 'masters':
+            return [n for n in self.cluster.nodes if n.is_master()]
+        if self.role == 'slaves':
+            return [n for n in self.cluster.nodes if not n.is_master()]
+        return list(self.cluster.nodes)
+
+    def _bind(self, node):
+        if self.timeout is None:
+            return node
+        bound = ClusterNode(node.host, node.port, socket_timeout=self.timeout,
+                            retry=NO_RETRY)
+        bound._cached_node_info = node._cached_node_info
+        return bound
+
+    def run(self, func, nodes=None):
+        '''Call `func(node)` on every node, yielding FanoutResult objects in
+        completion order.
+        '''
+        if nodes is None:
+            nodes = self.nodes
+
+        def _call(node):
+            start = time.time()
+            result = func(self._bind(node))
+            return result, time.time() - start
+
+        for node, result, err in concurrent_map(_call, nodes, self.workers):
+            if err is not None:
+                logger.debug('%s failed: %s', node, err)
+                yield FanoutResult(node, error=err)
+            else:
+                reply, elapsed = result
+                yield FanoutResult(node, reply, elapsed=elapsed)
+
+    def execute(self, *command, **kwargs):
+        nodes = kwargs.pop('nodes', None)
+        return self.run(lambda n: n.execute_command(*command), nodes)
+
+
+def summarize(results):
+    '''Group results by identical reply (or error message)
+
+    Return a list of (reply, nodes) pairs, biggest group first.
+    '''
+    groups = OrderedDict()
+    for res in results:
+        if res.ok:
+            key = repr(res.reply)
+        else:
+            key = '(error) {}'.format(res.error)
+        groups.setdefault(key, []).append(res.node)
+    return sorted(groups.items(), key=lambda g: len(g[1]), reverse=True)
+
+
+def echo_results(results, stream=True):
+    """Print results as they arrive, then a summary grouped by reply.
+    """
+    collected = []
+    for res in results:
+        collected.append(res)
+        if stream:
+            echo(res, color=None if res.ok else "red")
+
+    echo("Summary:", color="purple")
+    for reply, nodes in summarize(collected):
+        echo("{:>6} nodes: {}".format(len(nodes), reply))
+    return collected
+
+
+def fanout_argument(func):
+    func = cli.argument('--node-timeout', dest='node_timeout',
+                        type=float)(func)
+    return cli.argument('-j', '--concurrency', type=int,
+                        default=DEFAULT_WORKERS)(func)
@@ -0,0 +1,216 @@
+'''Access frequency of the keys and slots of a cluster.
+
+Every master is sampled concurrently, either by SCAN with a pipelined
+`OBJECT FREQ` of the keys, which needs an LFU `maxmemory-policy`, or by
+counting the keys of the commands seen during a short MONITOR window. The
+frequencies are rolled up per slot and per key into a `HeatMap`, which
+can be saved and then given to `plan_hot_moves` to spread the hot slots
+over the masters.
+'''
+import heapq
+import json
+import logging
+import re
+import time
+from array import array
+from collections import defaultdict
+
+import redis
+
+from .migration import SlotMove
+from .slots import key_slot, CLUSTER_HASH_SLOTS
+from .utils import concurrent_map, DEFAULT_WORKERS, RuskitException
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+SAMPLE_MODES = ('lfu', 'monitor')
+SCAN_COUNT = 1000
+# keys sampled on every master in lfu mode
+MAX_KEYS = 100000
+MONITOR_SECONDS = 5
+# keys kept in a heat map, the hottest ones
+TOP_KEYS = 1000
+HEAT_TOLERANCE = 0.1
+# a MONITOR line: 1339518083.107412 [0 127.0.0.1:60866] "GET" "key"
+MONITOR_ARG = re.compile(r'"((?:[^"\\]|\\.)*)"')
+SHADES = ' .:-=+*#%@'
+
+
+class HotspotError(RuskitException):
+    pass
+
+
+class HeatMap(object):
+    def __init__(self):
+        self.slots = array('d', [0]) * CLUSTER_HASH_SLOTS
+        self.keys = defaultdict(float)
+
+    def add(self, key, heat):
+        self.slots[key_slot(key)] += heat
+        self.keys[key] += heat
+
+    def merge(self, other):
+        for slot, heat in enumerate(other.slots):
+            self.slots[slot] += heat
+        for key, heat in other.keys.iteritems():
+            self.keys[key] += heat
+        self.trim()
+
+    def trim(self, count=TOP_KEYS):
+        if len(self.keys) > count:
+            self.keys = defaultdict(float, self.top_keys(count))
+
+    def top_keys(self, count):
+        return heapq.nlargest(count, self.keys.iteritems(),
+                              key=lambda x: x[1])
+
+    def top_slots(self, count):
+        return heapq.nlargest(
+            count, ((s, h) for s, h in enumerate(self.slots) if h),
+            key=lambda x: x[1])
+
+    def render(self, width=128):
+        '''One character per `16384 / width` slots, darker is hotter'''
+        size = CLUSTER_HASH_SLOTS // width
+        buckets = [sum(self.slots[i:i + size])
+                   for i in xrange(0, CLUSTER_HASH_SLOTS, size)]
+        hottest = max(buckets) or 1
+        return ''.join(SHADES[int(b / hottest * (len(SHADES) - 1))]
+                       for b in buckets)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({
+                'slots': dict((s, h) for s, h in enumerate(self.slots) if h),
+                # keys are bytes, latin-1 maps every byte to a character
+                'keys': [(k.decode('latin-1'), h)
+                         for k, h in self.top_keys(len(self.keys))],
+            }, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        heat_map = cls()
+        for slot, heat in data['slots'].iteritems():
+            heat_map.slots[int(slot)] = heat
+        for key, heat in data['keys']:
+            heat_map.keys[key.encode('latin-1')] = heat
+        return heat_map
+
+
+def sample_lfu(node, max_keys=MAX_KEYS, count=SCAN_COUNT):
+    '''SCAN up to `max_keys` keys of `node` with their `OBJECT FREQ`'''
+    heat_map = HeatMap()
+    cursor, seen = '0', 0
+    while True:
+        cursor, keys = node.scan(cursor, count=count)
+        if keys:
+            pipe = node.pipeline(transaction=False)
+            for key in keys:
+                pipe.execute_command('OBJECT FREQ', key)
+            for key, freq in zip(keys, pipe.execute(raise_on_error=False)):
+                if isinstance(freq, redis.ResponseError):
+                    # expired since the SCAN, or not an LFU policy
+                    if 'LFU' in str(freq):
+                        raise HotspotError('{}: {}'.format(
+                            node.gen_addr(), freq))
+                    continue
+                heat_map.add(key, freq)
+            seen += len(keys)
+        if int(cursor) == 0 or seen >= max_keys:
+            break
+    heat_map.trim()
+    return heat_map
+
+
+def parse_monitor_line(line):
+    '''The key of a MONITOR line, None for a command without keys'''
+    args = MONITOR_ARG.findall(line)
+    if len(args) < 2:
+        return None
+    return args[1].decode('string_escape')
+
+
+def sample_monitor(node, seconds=MONITOR_SECONDS):
+    '''Count the keys of the commands seen by `node` for `seconds`'''
+    heat_map = HeatMap()
+    conn = node.connection_pool.get_connection('MONITOR')
+    try:
+        conn.send_command('MONITOR')
+        conn.read_response()
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            if not conn.can_read(timeout=deadline - time.time()):
+                break
+            key = parse_monitor_line(conn.read_response())
+            if key is not None:
+                heat_map.add(key, 1)
+    finally:
+        # a connection in MONITOR mode can not be used for anything else
+        conn.disconnect()
+        node.connection_pool.release(conn)
+    heat_map.trim()
+    return heat_map
+
+
+def sample_cluster(masters, mode='lfu', max_keys=MAX_KEYS,
+                   seconds=MONITOR_SECONDS, workers=DEFAULT_WORKERS):
+    assert mode in SAMPLE_MODES
+    if mode == 'lfu':
+        sample = lambda n: sample_lfu(n, max_keys)
+    else:
+        sample = lambda n: sample_monitor(n, seconds)
+
+    heat_map = HeatMap()
+    for node, result, err in concurrent_map(sample, masters, workers):
+        if err is not None:
+            if isinstance(err, HotspotError):
+                raise err
+            logger.warning('failed to sample %s: %s', node, err)
+            continue
+        heat_map.merge(result)
+    return heat_map
+
+
+def master_heat(masters, heat_map):
+    return dict((m, sum(heat_map.slots[s] for s in m.slots))
+                for m in masters)
+
+
+def plan_hot_moves(masters, heat_map, max_moves=None,
+                   tolerance=HEAT_TOLERANCE):
+    '''Moves of hot slots from the hottest master to the coolest one,
+    until no master is more than `tolerance` above the mean heat or no
+    slot can be moved without making the coolest master the hottest.
+    '''
+    heat = master_heat(masters, heat_map)
+    owned = dict((m, set(m.slots)) for m in masters)
+    mean = sum(heat.values()) / len(masters)
+    moves = defaultdict(list)
+    count = 0
+    while max_moves is None or count < max_moves:
+        # ties go to the first master given, not to the order of a dict
+        src = max(masters, key=heat.get)
+        dst = min(masters, key=heat.get)
+        if heat[src] <= mean * (1 + tolerance) or len(owned[src]) <= 1:
+            break
+        gap = heat[src] - heat[dst]
+        # any slot cooler than the gap lowers the hottest master, the one
+        # closest to half of it evens src and dst the most
+        candidates = [s for s in owned[src]
+                      if 0 < heat_map.slots[s] < gap]
+        if not candidates:
+            break
+        slot = min(candidates, key=lambda s: abs(heat_map.slots[s] - gap / 2))
+        owned[src].remove(slot)
+        owned[dst].add(slot)
+        heat[src] -= heat_map.slots[slot]
+        heat[dst] += heat_map.slots[slot]
+        moves[(src, dst)].append(slot)
+        count += 1
+    return [SlotMove(src, dst, sorted(slots))
+            for (src, dst), slots in sorted(
+                moves.iteritems(),
+                key=lambda x: (x[0][0].gen_addr(), x[0][1].gen_addr()))]
@@ -0,0 +1,210 @@
+'''Bulk load of an RDB file into a cluster.
+
+The file is walked by `RdbReader`, and the value of every key is sent as
+it is in the file, wrapped into a DUMP payload, with `RESTORE ... REPLACE`
+to the master owning its slot. Every master has its own writer thread
+sending pipelined batches, and a bounded queue of batches: once a master
+falls behind, the reader blocks on its queue instead of buffering the
+file in memory.
+
+Every `checkpoint_interval` seconds, the reader waits for all the queues
+to be written and saves the offset reached in the file. An interrupted
+import is resumed from there, the keys restored again since are simply
+replaced.
+'''
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from .rdb import RdbReader, dump_payload
+from .slots import key_slot, SlotOwners, CLUSTER_HASH_SLOTS
+from .utils import echo, RateLimiter, RuskitException, POLL_INTERVAL
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+BATCH_SIZE = 100
+# batches queued for a master before the reader waits for it
+QUEUED_BATCHES = 16
+CHECKPOINT_INTERVAL = 10
+CHECKPOINT_SUFFIX = '.checkpoint'
+
+
+class ImportFailed(RuskitException):
+    pass
+
+
+def _put(q, item):
+    # a blocking put without timeout can not be interrupted in py2
+    while True:
+        try:
+            q.put(item, timeout=POLL_INTERVAL)
+            return
+        except queue.Full:
+            continue
+
+
+class MasterWriter(object):
+    def __init__(self, master, queued=QUEUED_BATCHES):
+        self.master = master
+        self.queue = queue.Queue(queued)
+        self.restored = 0
+        self.failed = 0
+        self.last_error = None
+        # the connection failed, nothing more is sent
+        self.error = None
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            batch = self.queue.get()
+            try:
+                if batch is None:
+                    return
+                if self.error is None:
+                    self._write(batch)
+            except Exception as e:
+                logger.error('failed to restore into %s: %s',
+                             self.master.gen_addr(), e)
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _write(self, batch):
+        pipe = self.master.pipeline(transaction=False)
+        for key, ttl, payload in batch:
+            pipe.execute_command('RESTORE', key, ttl, payload, 'REPLACE')
+        for reply in pipe.execute(raise_on_error=False):
+            if isinstance(reply, Exception):
+                self.failed += 1
+                self.last_error = reply
+            else:
+                self.restored += 1
+
+    def busy(self):
+        return self.queue.unfinished_tasks > 0
+
+
+class RdbImporter(object):
+    def __init__(self, cluster, path, checkpoint=None, batch_size=BATCH_SIZE,
+                 queued=QUEUED_BATCHES, rate=None,
+                 checkpoint_interval=CHECKPOINT_INTERVAL):
+        self.cluster = cluster
+        self.path = path
+        self.checkpoint_path = checkpoint or path + CHECKPOINT_SUFFIX
+        self.batch_size = batch_size
+        self.queued = queued
+        self.limiter = RateLimiter(rate)
+        self.checkpoint_interval = checkpoint_interval
+        self.expired = 0
+        # keys of other dbs than 0, a cluster only has db 0
+        self.skipped = 0
+
+    def owners(self):
+        '''The writer of every slot'''
+        masters = SlotOwners.from_cluster(self.cluster)
+        missing = masters.missing()
+        if missing:
+            raise ImportFailed('{} slots are not served by any master'.format(
+                len(missing)))
+        writers = dict((m.name, MasterWriter(m, self.queued))
+                       for m in masters.masters)
+        owners = [writers[masters.owner(s).name]
+                  for s in xrange(CLUSTER_HASH_SLOTS)]
+        return writers.values(), owners
+
+    def load_checkpoint(self, size):
+        '''(offset, db) to resume from, None to start from the beginning'''
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint['size'] != size:
+            raise ImportFailed('{} is for a file of {} bytes, not {}'.format(
+                self.checkpoint_path, checkpoint['size'], size))
+        return checkpoint['offset'], checkpoint['db']
+
+    def save_checkpoint(self, size, offset, db):
+        tmp = self.checkpoint_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'size': size, 'offset': offset, 'db': db}, f)
+        os.rename(tmp, self.checkpoint_path)
+
+    def flush(self, writers, batches):
+        '''Queue the partial batches and wait for all of them to be
+        written, raise ImportFailed if a master can not be written to.
+        '''
+        for writer in writers:
+            if batches[writer]:
+                _put(writer.queue, batches[writer])
+                batches[writer] = []
+        while any(w.busy() for w in writers):
+            time.sleep(POLL_INTERVAL)
+        failed = [w for w in writers if w.error is not None]
+        if failed:
+            raise ImportFailed('failed to restore into {}'.format(', '.join(
+                '{}: {}'.format(w.master.gen_addr(), w.error)
+                for w in failed)))
+
+    def run(self):
+        '''Restore all the keys of the file, return the writers'''
+        writers, owners = self.owners()
+        batches = dict((w, []) for w in writers)
+        for writer in writers:
+            writer.start()
+        try:
+            with RdbReader(self.path) as reader:
+                self._run(reader, writers, owners, batches)
+        finally:
+            for writer in writers:
+                _put(writer.queue, None)
+        return writers
+
+    def _run(self, reader, writers, owners, batches):
+        resume = self.load_checkpoint(reader.size)
+        if resume is not None:
+            echo('Resuming the import of {} from offset {}'.format(
+                self.path, resume[0]))
+        entries = reader.entries(*resume) if resume else reader.entries()
+        last_checkpoint = time.time()
+        for entry in entries:
+            if entry.db != 0:
+                self.skipped += 1
+                continue
+            ttl = 0
+            if entry.expire is not None:
+                ttl = entry.expire - int(time.time() * 1000)
+                if ttl <= 0:
+                    self.expired += 1
+                    continue
+            payload = dump_payload(entry.type, reader.value(entry),
+                                   reader.version)
+            self.limiter.acquire(len(payload))
+            writer = owners[key_slot(entry.key)]
+            batches[writer].append((entry.key, ttl, payload))
+            if len(batches[writer]) >= self.batch_size:
+                _put(writer.queue, batches[writer])
+                batches[writer] = []
+
+            if time.time() - last_checkpoint >= self.checkpoint_interval:
+                self.flush(writers, batches)
+                self.save_checkpoint(reader.size, entry.end, entry.db)
+                last_checkpoint = time.time()
+                echo('Imported {} keys, {:.1%} of {}'.format(
+                    sum(w.restored for w in writers),
+                    float(entry.end) / reader.size, self.path))
+
+        self.flush(writers, batches)
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
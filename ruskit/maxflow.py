@@ -0,0 +1,291 @@
+'''A small max flow engine (Dinic) with the part of the python-igraph
+`Graph` interface that ruskit uses:
+
+    g = Graph(4)
+    g[0, 1] = 3
+    mf = g.maxflow(0, 3, g.es['weight'])
+    mf.value, mf.flow[edge_index]
+
+Edges are kept in flat adjacency arrays. Every edge has a reverse edge
+next to it (edge `e` and `e ^ 1`), so residual updates are O(1).
+
+Edges can also carry a cost (`g.set_cost(i, j, c)`), `min_cost_flow`
+then finds the max flow of minimum total cost.
+'''
+import collections
+import heapq
+
+INF = float('inf')
+
+
+class Edge(object):
+    __slots__ = ('index', 'source', 'target')
+
+    def __init__(self, index, source, target):
+        self.index = index
+        self.source = source
+        self.target = target
+
+    @property
+    def tuple(self):
+        return self.source, self.target
+
+    def __repr__(self):
+        return '<Edge {} {}->{}>'.format(self.index, self.source, self.target)
+
+
+class EdgeSeq(object):
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __len__(self):
+        return len(self.graph._to) // 2
+
+    def __iter__(self):
+        to = self.graph._to
+        for i in range(len(self)):
+            yield Edge(i, to[2 * i + 1], to[2 * i])
+
+    def __getitem__(self, key):
+        if key == 'weight':
+            return self.graph._cap[::2]
+        to = self.graph._to
+        return Edge(key, to[2 * key + 1], to[2 * key])
+
+    def __setitem__(self, key, value):
+        assert key == 'weight'
+        cap = self.graph._cap
+        if not isinstance(value, (list, tuple)):
+            value = [value] * len(self)
+        for i, c in enumerate(value):
+            cap[2 * i] = c
+
+
+class Flow(object):
+    def __init__(self, value, flow, cost=None):
+        self.value = value
+        self.flow = flow
+        self.cost = cost
+
+    def __repr__(self):
+        return '<Flow value={}>'.format(self.value)
+
+
+class Graph(object):
+    def __init__(self, n=0):
+        self._adj = []
+        self._to = []
+        self._cap = []
+        self._flow = []
+        self._cost = []
+        self._eids = {}
+        self.add_vertices(n)
+
+    def as_directed(self):
+        return self
+
+    def vcount(self):
+        return len(self._adj)
+
+    def ecount(self):
+        return len(self._to) // 2
+
+    def add_vertices(self, n):
+        self._adj.extend([] for _ in range(n))
+
+    def add_edge(self, source, target, capacity=0, cost=0):
+        e = len(self._to)
+        self._to.extend((target, source))
+        self._cap.extend((capacity, 0))
+        self._flow.extend((0, 0))
+        self._cost.extend((cost, -cost))
+        self._adj[source].append(e)
+        self._adj[target].append(e + 1)
+        self._eids[source, target] = e // 2
+        return e // 2
+
+    def get_eid(self, source, target, error=True):
+        if error:
+            return self._eids[source, target]
+        return self._eids.get((source, target), -1)
+
+    @property
+    def es(self):
+        return EdgeSeq(self)
+
+    def __getitem__(self, pair):
+        eid = self._eids.get(pair)
+        return 0 if eid is None else self._cap[2 * eid]
+
+    def __setitem__(self, pair, capacity):
+        '''Set the capacity of an edge, creating it if necessary. Like
+        igraph, no edge is created for a zero capacity.
+        '''
+        eid = self._eids.get(pair)
+        if eid is not None:
+            self._cap[2 * eid] = capacity
+        elif capacity:
+            self.add_edge(pair[0], pair[1], capacity)
+
+    def set_cost(self, source, target, cost):
+        eid = self._eids.get((source, target))
+        if eid is not None:
+            self._cost[2 * eid] = cost
+            self._cost[2 * eid + 1] = -cost
+
+    def maxflow(self, source, target, capacity=None):
+        '''Compute the max flow from scratch'''
+        if capacity is not None:
+            self.es['weight'] = capacity
+        self._flow = [0] * len(self._to)
+        return self.augment(source, target)
+
+    def augment(self, source, target):
+        '''Continue augmenting the current flow, useful after raising
+        some capacities. Return the total flow.
+        '''
+        while self._bfs(source, target):
+            it = [0] * len(self._adj)
+            while self._push(source, target, it):
+                pass
+        return Flow(self._value(source),
+                    [self._flow[e] for e in range(0, len(self._to), 2)])
+
+    def min_cost_flow(self, source, target):
+        '''Max flow of minimum cost by successive shortest paths, always
+        computed from scratch: raising capacities can create negative cost
+        cycles in the residual graph of a previous flow.
+        '''
+        self._flow = [0] * len(self._to)
+        cap, flow, to, cost = self._cap, self._flow, self._to, self._cost
+        potential = self._bellman_ford(source)
+        while True:
+            dist, prev = self._dijkstra(source, potential)
+            if dist[target] == INF:
+                break
+            for v, d in enumerate(dist):
+                if d < INF:
+                    potential[v] += d
+
+            path = []
+            v = target
+            while v != source:
+                e = prev[v]
+                path.append(e)
+                v = to[e ^ 1]
+            pushed = min(cap[e] - flow[e] for e in path)
+            for e in path:
+                flow[e] += pushed
+                flow[e ^ 1] -= pushed
+
+        forward = range(0, len(to), 2)
+        return Flow(self._value(source), [flow[e] for e in forward],
+                    sum(flow[e] * cost[e] for e in forward))
+
+    def _bellman_ford(self, source):
+        '''Shortest paths from `source` in the residual graph (SPFA). A
+        vertex queued more than once per vertex of the graph lies on a
+        negative cost cycle.
+        '''
+        cap, flow, to, cost, adj = (self._cap, self._flow, self._to,
+                                    self._cost, self._adj)
+        n = len(adj)
+        dist = [INF] * n
+        dist[source] = 0
+        queue = collections.deque([source])
+        queued = [False] * n
+        queued[source] = True
+        rounds = [0] * n
+        while queue:
+            u = queue.popleft()
+            queued[u] = False
+            for e in adj[u]:
+                v = to[e]
+                if cap[e] > flow[e] and dist[u] + cost[e] < dist[v]:
+                    dist[v] = dist[u] + cost[e]
+                    if not queued[v]:
+                        rounds[v] += 1
+                        if rounds[v] > n:
+                            raise ValueError('negative cost cycle')
+                        queued[v] = True
+                        queue.append(v)
+        return [d if d < INF else 0 for d in dist]
+
+    def _dijkstra(self, source, potential):
+        '''Shortest paths in the residual graph on reduced costs, which
+        are never negative thanks to the potentials.
+        '''
+        cap, flow, to, cost, adj = (self._cap, self._flow, self._to,
+                                    self._cost, self._adj)
+        dist = [INF] * len(adj)
+        prev = [-1] * len(adj)
+        dist[source] = 0
+        heap = [(0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for e in adj[u]:
+                if cap[e] <= flow[e]:
+                    continue
+                v = to[e]
+                nd = d + cost[e] + potential[u] - potential[v]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    prev[v] = e
+                    heapq.heappush(heap, (nd, v))
+        return dist, prev
+
+    def _value(self, source):
+        return sum(self._flow[e] for e in self._adj[source])
+
+    def _bfs(self, source, target):
+        cap, flow, to, adj = self._cap, self._flow, self._to, self._adj
+        level = [-1] * len(adj)
+        level[source] = 0
+        queue = collections.deque([source])
+        while queue:
+            u = queue.popleft()
+            for e in adj[u]:
+                v = to[e]
+                if level[v] < 0 and cap[e] > flow[e]:
+                    level[v] = level[u] + 1
+                    queue.append(v)
+        self._level = level
+        return level[target] >= 0
+
+    def _push(self, source, target, it):
+        '''Find one augmenting path in the level graph and push as much
+        flow as possible through it. Return the pushed amount.
+        '''
+        cap, flow, to, adj = self._cap, self._flow, self._to, self._adj
+        level = self._level
+        path = []
+        u = source
+        while u != target:
+            edges = adj[u]
+            i = it[u]
+            while i < len(edges):
+                e = edges[i]
+                v = to[e]
+                if cap[e] > flow[e] and level[v] == level[u] + 1:
+                    break
+                i += 1
+            it[u] = i
+            if i < len(edges):
+                path.append(e)
+                u = v
+                continue
+            # dead end, prune it from the level graph and retreat
+            if u == source:
+                return 0
+            level[u] = -1
+            e = path.pop()
+            u = to[e ^ 1]
+            it[u] += 1
+
+        pushed = min(cap[e] - flow[e] for e in path)
+        for e in path:
+            flow[e] += pushed
+            flow[e ^ 1] -= pushed
+        return pushed
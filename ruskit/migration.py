@@ -0,0 +1,221 @@
+'''Plans and concurrent execution of slot migrations between masters.
+
+`plan_evacuation` moves the slots of all the departing masters at once,
+straight to the masters which stay, so that no slot is moved twice and
+the receivers end up balanced. `plan_expansion` only moves slots from the
+existing masters to new ones, and given the sizes of the slots, also
+gives every new master its share of the bytes. `MigrationScheduler` runs
+the moves of a plan concurrently, with at most `per_node` migrations at
+the same time on every node.
+'''
+import bisect
+from collections import defaultdict
+import heapq
+import logging
+import threading
+
+from .utils import echo, divide, concurrent_map, DEFAULT_WORKERS, \
+    RuskitException
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# concurrent migrations a node takes part in, as source or destination
+MIGRATIONS_PER_NODE = 1
+
+
+class EvacuationError(RuskitException):
+    def __str__(self):
+        return 'no master left to receive the slots'
+
+
+class MigrationFailed(RuskitException):
+    def __init__(self, failed):
+        self.failed = failed
+
+    def __str__(self):
+        return 'failed to migrate {}'.format(
+            ', '.join('{} ({})'.format(m, e) for m, e in self.failed))
+
+
+class SlotMove(object):
+    def __init__(self, src, dst, slots):
+        self.src = src
+        self.dst = dst
+        self.slots = slots
+
+    def __repr__(self):
+        return '{} -> {}: {} slots'.format(self.src.gen_addr(),
+                                           self.dst.gen_addr(),
+                                           len(self.slots))
+
+
+def _assign(given, receivers, targets):
+    '''Moves of the (source, slots) in `given` to the `receivers`, every
+    slot goes to the receiver the furthest below its target.
+    '''
+    # slots over the target of every receiver, the lowest gets the next
+    excess = [(len(r.slots) - t, i)
+              for i, (r, t) in enumerate(zip(receivers, targets))]
+    heapq.heapify(excess)
+
+    moved = defaultdict(list)
+    for src, slots in given:
+        for slot in slots:
+            over, i = heapq.heappop(excess)
+            moved[(src, i)].append(slot)
+            heapq.heappush(excess, (over + 1, i))
+    return _moves(moved, receivers)
+
+
+def _assign_bytes(given, receivers, targets, sizes):
+    '''Moves of the (source, slots) in `given` to the `receivers`, the
+    biggest slot first to the receiver with the fewest bytes among the
+    ones below their target.
+    '''
+    received = [(sum(sizes.get(s, 0) for s in r.slots), i)
+                for i, r in enumerate(receivers)
+                if len(r.slots) < targets[i]]
+    heapq.heapify(received)
+    room = [t - len(r.slots) for r, t in zip(receivers, targets)]
+
+    moved = defaultdict(list)
+    slots = sorted(((sizes.get(slot, 0), slot, src) for src, slots in given
+                    for slot in slots), key=lambda x: (-x[0], x[1]))
+    for size, slot, src in slots:
+        total, i = heapq.heappop(received)
+        moved[(src, i)].append(slot)
+        room[i] -= 1
+        if room[i] > 0:
+            heapq.heappush(received, (total + size, i))
+    for slots in moved.values():
+        slots.sort()
+    return _moves(moved, receivers)
+
+
+def _moves(moved, receivers):
+    return [SlotMove(src, receivers[i], slots)
+            for (src, i), slots in sorted(
+                moved.items(), key=lambda x: (x[0][0].name, x[0][1]))]
+
+
+def _pick(slots, count, goal, sizes):
+    '''`count` of the `slots` whose sizes add up close to `goal`, each one
+    the closest to the mean size still needed.
+    '''
+    slots = sorted(slots, key=lambda s: (sizes.get(s, 0), s))
+    keys = [sizes.get(s, 0) for s in slots]
+    picked = []
+    for n in xrange(count, 0, -1):
+        mean = float(goal) / n
+        i = bisect.bisect_left(keys, mean)
+        if i == len(keys) or (i > 0 and mean - keys[i - 1] <= keys[i] - mean):
+            i -= 1
+        goal -= keys.pop(i)
+        picked.append(slots.pop(i))
+    return sorted(picked)
+
+
+def plan_evacuation(masters, departing):
+    '''Moves of the slots of the masters whose name is in `departing` to
+    the other masters. Every receiver is filled up to its share of all
+    the slots, the emptiest ones first.
+    '''
+    receivers = [m for m in masters if m.name not in departing]
+    if not receivers:
+        raise EvacuationError()
+    sources = [m for m in masters if m.name in departing and m.slots]
+
+    total = sum(len(m.slots) for m in masters)
+    receivers.sort(key=lambda m: len(m.slots), reverse=True)
+    targets = divide(total, len(receivers))
+    given = [(m, sorted(m.slots))
+             for m in sorted(sources, key=lambda m: m.name)]
+    return _assign(given, receivers, targets)
+
+
+def plan_expansion(masters, new_masters, slot_sizes=None, lightest=False):
+    '''Moves giving the `new_masters` their share of the slots. Slots only
+    flow from the existing masters over their share to the new ones, so
+    the number of moved slots is the minimum. With the `slot_sizes` of a
+    slot map, the slots are chosen so that every new master also gets its
+    share of the bytes, or with `lightest` the lightest slots of every
+    master are moved, to move as few bytes as possible.
+    '''
+    total = sum(len(m.slots) for m in masters)
+    masters = sorted(masters, key=lambda m: len(m.slots), reverse=True)
+    # the biggest shares stay on the biggest masters
+    targets = divide(total, len(masters) + len(new_masters))
+    counts = [(m, len(m.slots) - target)
+              for m, target in zip(masters, targets)
+              if len(m.slots) > target]
+    if slot_sizes is None:
+        # the last slots, the ranges of the masters stay contiguous
+        given = [(m, sorted(m.slots)[-count:]) for m, count in counts]
+        return _assign(given, new_masters, targets[len(masters):])
+    if lightest:
+        given = []
+        for m, count in counts:
+            slots = sorted(m.slots, key=lambda s: slot_sizes.get(s, 0))
+            given.append((m, sorted(slots[:count])))
+        return _assign(given, new_masters, targets[len(masters):])
+
+    def _bytes(m):
+        return sum(slot_sizes.get(s, 0) for s in m.slots)
+
+    share = float(sum(_bytes(m) for m in masters)) / \
+        (len(masters) + len(new_masters))
+    need = share * len(new_masters)
+    # the bytes over the share of every master, scaled to what the new
+    # masters need
+    over = [max(0, _bytes(m) - share) for m, _ in counts]
+    given = []
+    for (m, count), extra in zip(counts, over):
+        goal = need * extra / sum(over) if sum(over) else 0
+        given.append((m, _pick(m.slots, count, goal, slot_sizes)))
+    return _assign_bytes(given, new_masters, targets[len(masters):],
+                         slot_sizes)
+
+
+class MigrationScheduler(object):
+    def __init__(self, cluster, per_node=MIGRATIONS_PER_NODE,
+                 workers=DEFAULT_WORKERS, verbose=False):
+        self.cluster = cluster
+        self.per_node = per_node
+        self.workers = workers
+        self.verbose = verbose
+
+    def run(self, moves):
+        '''Run every `SlotMove`, raise MigrationFailed at the end if some
+        of them failed. The node caches are shared by the threads, so they
+        are only flushed once all the moves are over.
+        '''
+        # read once, every slot moved is announced to all of them
+        masters = self.cluster.masters
+        locks = {}
+        for move in moves:
+            for node in (move.src, move.dst):
+                locks.setdefault(node.name,
+                                 threading.Semaphore(self.per_node))
+
+        def _move(move):
+            # always locked in the same order, so that two moves can not
+            # wait for each other
+            first, second = sorted([move.src.name, move.dst.name])
+            with locks[first]:
+                with locks[second]:
+                    for slot in move.slots:
+                        self.cluster.migrate_slot(move.src, move.dst, slot,
+                                                  verbose=self.verbose,
+                                                  masters=masters)
+
+        failed = []
+        for move, _, err in concurrent_map(_move, moves, self.workers):
+            if err is not None:
+                logger.error('failed to migrate %s: %s', move, err)
+                failed.append((move, err))
+            else:
+                echo('Migrated', move)
+        self.cluster.flush_all_cache()
+        if failed:
+            raise MigrationFailed(failed)
@@ -0,0 +1,475 @@
+'''Streaming reader of RDB files.
+
+`RdbReader` maps the file with `mmap` and walks it entry by entry. Only
+the keys are copied out of the map. A value is skipped over by its
+encoding and given as the span of its bytes in the file, which is also
+the serialized value of `DUMP` and `RESTORE`. Entries can be read from
+the offset of any of them, to resume an interrupted walk.
+
+`analyze_rdb` rolls up the entries of RDB files into the `SlotTable` of
+the online slot map, along with the sizes of the key prefixes and the
+biggest keys. The memory of a key is approximated from the size of its
+serialized value and the number of its elements.
+
+The CRC64 of the DUMP payloads is computed by the C extension of crcmod
+when it is installed, else eight bytes at a time from eight tables.
+'''
+import heapq
+import logging
+import mmap
+import struct
+from collections import namedtuple, defaultdict
+
+try:
+    import crcmod
+    # without its C extension, crcmod is slower than slicing-by-8
+    from crcmod import _crcfunext
+except ImportError:
+    crcmod = None
+
+from .slots import key_slot
+from .slotmap import SlotTable
+from .utils import RuskitException
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+MAGIC = 'REDIS'
+
+OP_FUNCTION2 = 0xf5
+OP_FUNCTION = 0xf6
+OP_MODULE_AUX = 0xf7
+OP_IDLE = 0xf8
+OP_FREQ = 0xf9
+OP_AUX = 0xfa
+OP_RESIZEDB = 0xfb
+OP_EXPIRETIME_MS = 0xfc
+OP_EXPIRETIME = 0xfd
+OP_SELECTDB = 0xfe
+OP_EOF = 0xff
+
+ENC_INT8 = 0
+ENC_INT16 = 1
+ENC_INT32 = 2
+ENC_LZF = 3
+
+TYPE_STRING = 0
+TYPE_LIST = 1
+TYPE_SET = 2
+TYPE_ZSET = 3
+TYPE_HASH = 4
+TYPE_ZSET_2 = 5
+TYPE_MODULE = 6
+TYPE_MODULE_2 = 7
+TYPE_HASH_ZIPMAP = 9
+TYPE_LIST_ZIPLIST = 10
+TYPE_SET_INTSET = 11
+TYPE_ZSET_ZIPLIST = 12
+TYPE_HASH_ZIPLIST = 13
+TYPE_LIST_QUICKLIST = 14
+TYPE_STREAM_LISTPACKS = 15
+TYPE_HASH_LISTPACK = 16
+TYPE_ZSET_LISTPACK = 17
+TYPE_LIST_QUICKLIST_2 = 18
+TYPE_STREAM_LISTPACKS_2 = 19
+TYPE_SET_LISTPACK = 20
+TYPE_STREAM_LISTPACKS_3 = 21
+
+TYPE_NAMES = {
+    TYPE_STRING: 'string',
+    TYPE_LIST: 'list',
+    TYPE_SET: 'set',
+    TYPE_ZSET: 'zset',
+    TYPE_HASH: 'hash',
+    TYPE_ZSET_2: 'zset',
+    TYPE_HASH_ZIPMAP: 'hash',
+    TYPE_LIST_ZIPLIST: 'list',
+    TYPE_SET_INTSET: 'set',
+    TYPE_ZSET_ZIPLIST: 'zset',
+    TYPE_HASH_ZIPLIST: 'hash',
+    TYPE_LIST_QUICKLIST: 'list',
+    TYPE_STREAM_LISTPACKS: 'stream',
+    TYPE_HASH_LISTPACK: 'hash',
+    TYPE_ZSET_LISTPACK: 'zset',
+    TYPE_LIST_QUICKLIST_2: 'list',
+    TYPE_STREAM_LISTPACKS_2: 'stream',
+    TYPE_SET_LISTPACK: 'set',
+    TYPE_STREAM_LISTPACKS_3: 'stream',
+}
+
+# approximate bytes of a key in the keyspace dict, dictEntry, robj and
+# sds headers, of an expire, and of an element of a hashtable, skiplist
+# or linked list encoding
+KEY_OVERHEAD = 64
+EXPIRE_OVERHEAD = 32
+ELEMENT_OVERHEAD = 48
+
+PREFIX_SEPARATOR = ':'
+TOP_PREFIXES = 20
+BIG_KEYS = 20
+
+# a key of an RDB file, its value is the bytes `start:end` of the file,
+# `expire` a unix time in ms or None and `offset` where the entry starts,
+# its expire included
+RdbEntry = namedtuple('RdbEntry', [
+    'offset', 'db', 'key', 'type', 'start', 'end', 'expire', 'elements'])
+
+
+class RdbError(RuskitException):
+    pass
+
+
+def _gen_crc64_table():
+    # CRC-64/Jones of redis, reflected
+    table = []
+    for byte in xrange(256):
+        crc = byte
+        for _ in xrange(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ CRC64_POLY
+            else:
+                crc >>= 1
+        table.append(crc)
+    return table
+
+
+def _gen_crc64_slices(table):
+    '''The tables of slicing-by-8: the k-th one is the CRC of a byte
+    followed by k zero bytes.
+    '''
+    slices = [table]
+    for _ in xrange(7):
+        slices.append([(c >> 8) ^ table[c & 0xff] for c in slices[-1]])
+    return slices
+
+
+CRC64_POLY = 0x95ac9329ac4bc9b5
+CRC64_TABLE = _gen_crc64_table()
+CRC64_SLICES = _gen_crc64_slices(CRC64_TABLE)
+
+
+def _crc64(data, crc=0):
+    t0, t1, t2, t3, t4, t5, t6, t7 = CRC64_SLICES
+    size = len(data) & ~7
+    if size:
+        # the register is little endian, a word is xored with it at once
+        for word in struct.unpack('<{}Q'.format(size >> 3), data[:size]):
+            crc ^= word
+            crc = (t7[crc & 0xff] ^ t6[(crc >> 8) & 0xff] ^
+                   t5[(crc >> 16) & 0xff] ^ t4[(crc >> 24) & 0xff] ^
+                   t3[(crc >> 32) & 0xff] ^ t2[(crc >> 40) & 0xff] ^
+                   t1[(crc >> 48) & 0xff] ^ t0[crc >> 56])
+    for byte in bytearray(data[size:]):
+        crc = t0[(crc ^ byte) & 0xff] ^ (crc >> 8)
+    return crc
+
+
+crc64 = _crc64
+if crcmod is not None:
+    # the polynomial unreflected, with its x^64 term
+    crc64 = crcmod.mkCrcFun(0x1ad93d23594c935a9, initCrc=0, rev=True,
+                            xorOut=0)
+
+
+def dump_payload(type_, value, version):
+    '''The DUMP serialization of a value, for RESTORE: its type, its bytes
+    in the RDB file, the RDB version and the CRC64 of all of them.
+    '''
+    payload = chr(type_) + value + struct.pack('<H', version)
+    return payload + struct.pack('<Q', crc64(payload))
+
+
+def lzf_decompress(data, length):
+    out = bytearray()
+    data = bytearray(data)
+    i = 0
+    while i < len(data):
+        ctrl = data[i]
+        i += 1
+        if ctrl < 32:
+            out += data[i:i + ctrl + 1]
+            i += ctrl + 1
+            continue
+        size = ctrl >> 5
+        if size == 7:
+            size += data[i]
+            i += 1
+        ref = len(out) - ((ctrl & 0x1f) << 8) - data[i] - 1
+        i += 1
+        # the reference may overlap the bytes being written
+        for _ in xrange(size + 2):
+            out.append(out[ref])
+            ref += 1
+    if len(out) != length:
+        raise RdbError('bad lzf string, {} bytes instead of {}'.format(
+            len(out), length))
+    return str(out)
+
+
+class RdbReader(object):
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.mm = mmap.mmap(self.file.fileno(), 0,
+                                access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            self.file.close()
+            raise RdbError('{}: empty or not a regular file'.format(path))
+        if self.mm[:5] != MAGIC:
+            self.close()
+            raise RdbError('{}: not an rdb file'.format(path))
+        self.version = int(self.mm[5:9])
+        self.size = len(self.mm)
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def value(self, entry):
+        '''The serialized value of `entry`, as a copy'''
+        return self.mm[entry.start:entry.end]
+
+    def _byte(self, pos):
+        return ord(self.mm[pos]), pos + 1
+
+    def _length(self, pos):
+        '''(length, is an encoded string, position after it)'''
+        first, pos = self._byte(pos)
+        kind = first >> 6
+        if kind == 0:
+            return first & 0x3f, False, pos
+        if kind == 1:
+            second, pos = self._byte(pos)
+            return ((first & 0x3f) << 8) | second, False, pos
+        if kind == 3:
+            return first & 0x3f, True, pos
+        if first == 0x80:
+            return struct.unpack_from('>I', self.mm, pos)[0], False, pos + 4
+        if first == 0x81:
+            return struct.unpack_from('>Q', self.mm, pos)[0], False, pos + 8
+        raise RdbError('bad length encoding {:#x} at {}'.format(first,
+                                                                 pos - 1))
+
+    def _skip_length(self, pos):
+        return self._length(pos)[2]
+
+    def _skip_string(self, pos):
+        length, encoded, pos = self._length(pos)
+        if not encoded:
+            return pos + length
+        if length == ENC_INT8:
+            return pos + 1
+        if length == ENC_INT16:
+            return pos + 2
+        if length == ENC_INT32:
+            return pos + 4
+        if length == ENC_LZF:
+            clen, _, pos = self._length(pos)
+            ulen, _, pos = self._length(pos)
+            return pos + clen
+        raise RdbError('bad string encoding {} at {}'.format(length, pos))
+
+    def _string(self, pos):
+        length, encoded, pos = self._length(pos)
+        if not encoded:
+            return self.mm[pos:pos + length], pos + length
+        if length == ENC_INT8:
+            return str(struct.unpack_from('<b', self.mm, pos)[0]), pos + 1
+        if length == ENC_INT16:
+            return str(struct.unpack_from('<h', self.mm, pos)[0]), pos + 2
+        if length == ENC_INT32:
+            return str(struct.unpack_from('<i', self.mm, pos)[0]), pos + 4
+        if length == ENC_LZF:
+            clen, _, pos = self._length(pos)
+            ulen, _, pos = self._length(pos)
+            return lzf_decompress(self.mm[pos:pos + clen], ulen), pos + clen
+        raise RdbError('bad string encoding {} at {}'.format(length, pos))
+
+    def _skip_double(self, pos):
+        # the old text encoding of the scores, 253-255 are nan and infs
+        length, pos = self._byte(pos)
+        return pos if length >= 253 else pos + length
+
+    def _skip_strings(self, pos, per_element):
+        count, _, pos = self._length(pos)
+        for _ in xrange(count * per_element):
+            pos = self._skip_string(pos)
+        return count, pos
+
+    def _skip_stream(self, type_, pos):
+        count, _, pos = self._length(pos)
+        for _ in xrange(count):
+            # the master id of the node and its listpack
+            pos = self._skip_string(self._skip_string(pos))
+        # items, last id
+        for _ in xrange(3):
+            pos = self._skip_length(pos)
+        if type_ >= TYPE_STREAM_LISTPACKS_2:
+            # first id, max deleted id, entries added
+            for _ in xrange(5):
+                pos = self._skip_length(pos)
+        groups, _, pos = self._length(pos)
+        for _ in xrange(groups):
+            pos = self._skip_string(pos)
+            pos = self._skip_length(self._skip_length(pos))
+            if type_ >= TYPE_STREAM_LISTPACKS_2:
+                pos = self._skip_length(pos)
+            pending, _, pos = self._length(pos)
+            for _ in xrange(pending):
+                # id, delivery time and count
+                pos = self._skip_length(pos + 16 + 8)
+            consumers, _, pos = self._length(pos)
+            for _ in xrange(consumers):
+                # name, seen time
+                pos = self._skip_string(pos) + 8
+                if type_ >= TYPE_STREAM_LISTPACKS_3:
+                    # active time
+                    pos += 8
+                pending, _, pos = self._length(pos)
+                pos += pending * 16
+        return count, pos
+
+    def _skip_value(self, type_, pos):
+        '''(elements, position after the value) of a value of `type_`'''
+        if type_ in (TYPE_LIST, TYPE_SET):
+            return self._skip_strings(pos, 1)
+        if type_ == TYPE_HASH:
+            return self._skip_strings(pos, 2)
+        if type_ == TYPE_ZSET:
+            count, _, pos = self._length(pos)
+            for _ in xrange(count):
+                pos = self._skip_double(self._skip_string(pos))
+            return count, pos
+        if type_ == TYPE_ZSET_2:
+            count, _, pos = self._length(pos)
+            for _ in xrange(count):
+                pos = self._skip_string(pos) + 8
+            return count, pos
+        if type_ == TYPE_LIST_QUICKLIST:
+            return self._skip_strings(pos, 1)
+        if type_ == TYPE_LIST_QUICKLIST_2:
+            count, _, pos = self._length(pos)
+            for _ in xrange(count):
+                pos = self._skip_string(self._skip_length(pos))
+            return count, pos
+        if type_ in (TYPE_STREAM_LISTPACKS, TYPE_STREAM_LISTPACKS_2,
+                     TYPE_STREAM_LISTPACKS_3):
+            return self._skip_stream(type_, pos)
+        if type_ in TYPE_NAMES:
+            # a single string, compact encodings have no element overhead
+            return 0, self._skip_string(pos)
+        raise RdbError('unsupported value type {} at {}'.format(type_, pos))
+
+    def entries(self, offset=None, db=0):
+        '''Yield a `RdbEntry` for every key, from `offset` if given, the
+        offset of an entry returned before in `db`.
+        '''
+        try:
+            for entry in self._entries(offset, db):
+                yield entry
+        except (IndexError, struct.error):
+            raise RdbError('{}: truncated'.format(self.path))
+
+    def _entries(self, offset, db):
+        pos = 9 if offset is None else offset
+        expire = None
+        entry_offset = pos
+        while pos < self.size:
+            op, pos = self._byte(pos)
+            if op == OP_EOF:
+                return
+            if op == OP_SELECTDB:
+                db, _, pos = self._length(pos)
+            elif op == OP_RESIZEDB:
+                pos = self._skip_length(self._skip_length(pos))
+            elif op == OP_AUX:
+                pos = self._skip_string(self._skip_string(pos))
+            elif op in (OP_FUNCTION, OP_FUNCTION2):
+                pos = self._skip_string(pos)
+            elif op == OP_MODULE_AUX:
+                raise RdbError('module data at {} is not supported'.format(
+                    pos - 1))
+            elif op == OP_EXPIRETIME_MS:
+                expire = struct.unpack_from('<Q', self.mm, pos)[0]
+                pos += 8
+                continue
+            elif op == OP_EXPIRETIME:
+                expire = struct.unpack_from('<I', self.mm, pos)[0] * 1000
+                pos += 4
+                continue
+            elif op == OP_FREQ:
+                pos += 1
+                continue
+            elif op == OP_IDLE:
+                pos = self._skip_length(pos)
+                continue
+            else:
+                key, start = self._string(pos)
+                elements, pos = self._skip_value(op, start)
+                yield RdbEntry(entry_offset, db, key, op, start, pos,
+                               expire, elements)
+                expire = None
+            entry_offset = pos
+        raise RdbError('{}: truncated, no end of file'.format(self.path))
+
+
+def approx_memory(entry):
+    size = KEY_OVERHEAD + len(entry.key) + entry.end - entry.start + \
+        ELEMENT_OVERHEAD * entry.elements
+    if entry.expire is not None:
+        size += EXPIRE_OVERHEAD
+    return size
+
+
+def key_prefix(key, separator=PREFIX_SEPARATOR):
+    '''The part of `key` before its first separator, '' without any'''
+    index = key.find(separator)
+    return key[:index] if index >= 0 else ''
+
+
+class RdbReport(object):
+    def __init__(self, separator=PREFIX_SEPARATOR, big_keys=BIG_KEYS):
+        self.table = SlotTable()
+        self.separator = separator
+        # prefix -> [keys, bytes]
+        self.prefixes = defaultdict(lambda: [0, 0])
+        self.big_keys_count = big_keys
+        # heap of (bytes, key, type name)
+        self.big_keys = []
+
+    def add(self, entry):
+        size = approx_memory(entry)
+        type_name = TYPE_NAMES[entry.type]
+        self.table.add(key_slot(entry.key), size, type_name)
+        prefix = self.prefixes[key_prefix(entry.key, self.separator)]
+        prefix[0] += 1
+        prefix[1] += size
+        item = (size, entry.key, type_name)
+        if len(self.big_keys) < self.big_keys_count:
+            heapq.heappush(self.big_keys, item)
+        elif item > self.big_keys[0]:
+            heapq.heapreplace(self.big_keys, item)
+
+    def top_prefixes(self, count=TOP_PREFIXES):
+        return heapq.nlargest(count, self.prefixes.iteritems(),
+                              key=lambda x: x[1][1])
+
+    def top_keys(self):
+        return sorted(self.big_keys, reverse=True)
+
+
+def analyze_rdb(paths, separator=PREFIX_SEPARATOR, big_keys=BIG_KEYS):
+    '''`RdbReport` of all the keys of the RDB files at `paths`'''
+    report = RdbReport(separator, big_keys)
+    for path in paths:
+        with RdbReader(path) as reader:
+            for entry in reader.entries():
+                report.add(entry)
+    return report
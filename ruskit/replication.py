@@ -0,0 +1,393 @@
+'''Admission control of the full syncs started when slaves are added.
+
+Every new slave needs a full sync from its master, which costs a fork and
+an RDB of about `used_memory` bytes on the master host, plus the network
+and the load on the slave host. `SyncScheduler` only admits a new sync
+when the limits on concurrent syncs per master host, per slave host and
+on bytes in flight allow it, biggest dataset first so that the longest
+syncs do not end up last.
+
+The progress of the running syncs is read from `INFO replication` of the
+slaves, which gives the throughput and ETA of every sync. A sync without
+any I/O for `stall_timeout` seconds is restarted, and flagged as failed
+after `max_retries` restarts.
+'''
+import collections
+import logging
+import time
+
+from ruskit import cli
+from .utils import concurrent_map, DEFAULT_WORKERS, RuskitException
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# states of a slave in `INFO replication` of its master during a full sync
+SYNCING_STATES = ('wait_bgsave', 'send_bulk')
+SIZE_UNITS = {'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30, 't': 1 << 40}
+STALL_TIMEOUT = 120
+MAX_RETRIES = 3
+# number of samples the throughput of a sync is computed from
+RATE_WINDOW = 10
+# seconds between two reads of the syncs served to other slaves
+SERVING_REFRESH_INTERVAL = 10
+
+
+def parse_size(size):
+    '''`512m` -> 536870912'''
+    size = size.strip().lower().rstrip('b')
+    if size and size[-1] in SIZE_UNITS:
+        return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+    return int(size)
+
+
+def format_size(size):
+    for unit in 'tgmk':
+        if size >= SIZE_UNITS[unit]:
+            return '{:.1f}{}'.format(float(size) / SIZE_UNITS[unit],
+                                     unit.upper())
+    return '{}B'.format(size)
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return '-'
+    seconds = int(seconds)
+    return '{:02}:{:02}:{:02}'.format(seconds // 3600, seconds // 60 % 60,
+                                      seconds % 60)
+
+
+class SyncFailed(RuskitException):
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    def __str__(self):
+        return 'sync stalled too many times: {}'.format(self.jobs)
+
+
+def serving_syncs(info, exclude=()):
+    '''Count the full syncs a master is serving from its `INFO replication`,
+    except to the slaves whose (ip, port) is in `exclude`.
+    '''
+    count = 0
+    for key, value in info.iteritems():
+        if key.startswith('slave') and isinstance(value, dict) and \
+                value.get('state') in SYNCING_STATES and \
+                (value.get('ip'), value.get('port')) not in exclude:
+            count += 1
+    return count
+
+
+class SyncLimits(object):
+    '''Limits of concurrent full syncs, `None` means unlimited.
+
+    `max_bytes` bounds the sum of the bytes still to be transferred by the
+    running syncs. A sync bigger than `max_bytes` is still started once
+    nothing else is running.
+    '''
+    def __init__(self, per_source_host=None, per_target_host=None,
+                 max_bytes=None, max_syncs=None):
+        self.per_source_host = per_source_host
+        self.per_target_host = per_target_host
+        self.max_bytes = max_bytes
+        self.max_syncs = max_syncs
+
+    @classmethod
+    def from_mode(cls, fast_mode):
+        '''The historical modes of `Cluster.add_slaves`: one sync for the
+        whole cluster, or one per slave host in fast mode.
+        '''
+        if fast_mode:
+            return cls(per_target_host=1)
+        return cls(max_syncs=1)
+
+    @classmethod
+    def from_args(cls, args):
+        '''Build limits from `sync_limit_arguments`, None if not given'''
+        max_bytes = parse_size(args.max_sync_bytes) \
+            if args.max_sync_bytes else None
+        limits = cls(args.max_syncs_per_master_host,
+                     args.max_syncs_per_slave_host, max_bytes)
+        if limits.per_source_host is None and \
+                limits.per_target_host is None and max_bytes is None:
+            return None
+        return limits
+
+    def __repr__(self):
+        return '<SyncLimits source={} target={} bytes={} syncs={}>'.format(
+            self.per_source_host, self.per_target_host, self.max_bytes,
+            self.max_syncs)
+
+
+class SyncJob(object):
+    def __init__(self, slave, master):
+        self.slave = slave
+        self.master = master
+        # estimated size of the RDB, from `used_memory` of the master
+        self.size = 0
+        # bytes still to be transferred
+        self.left = 0
+        self.offset = 0
+        self.retries = 0
+        self.stalled_since = None
+        self.samples = collections.deque(maxlen=RATE_WINDOW)
+
+    def record(self, now, left):
+        if self.samples and left > self.samples[-1][1]:
+            # the sync was restarted
+            self.samples.clear()
+        self.left = left
+        self.samples.append((now, left))
+
+    @property
+    def rate(self):
+        '''Bytes transferred per second over the last samples'''
+        if len(self.samples) < 2:
+            return 0
+        (start, left_start), (end, left_end) = self.samples[0], \
+            self.samples[-1]
+        if end <= start:
+            return 0
+        return float(left_start - left_end) / (end - start)
+
+    @property
+    def eta(self):
+        rate = self.rate
+        return self.left / rate if rate > 0 else None
+
+    @property
+    def source_host(self):
+        return self.master.host
+
+    @property
+    def target_host(self):
+        return self.slave.host
+
+    def __repr__(self):
+        return '{}:{}'.format(self.slave.host, self.slave.port)
+
+
+class SyncScheduler(object):
+    def __init__(self, jobs, limits, workers=DEFAULT_WORKERS,
+                 stall_timeout=STALL_TIMEOUT, max_retries=MAX_RETRIES):
+        self.limits = limits
+        self.workers = workers
+        self.stall_timeout = stall_timeout
+        self.max_retries = max_retries
+        self.pending = sorted(jobs, key=lambda j: j.size, reverse=True)
+        self.running = []
+        self.finished = []
+        self.failed = []
+        self.source_syncs = {}
+        self.target_syncs = {}
+        # full syncs served to other slaves, per master host
+        self.serving = {}
+        self.serving_checked = None
+
+    @property
+    def done(self):
+        return not self.pending and not self.running
+
+    @property
+    def bytes_in_flight(self):
+        return sum(j.left for j in self.running)
+
+    def _pending_masters(self):
+        return {j.master.name: j.master for j in self.pending}.values()
+
+    def _info(self, section, nodes):
+        for node, info, err in concurrent_map(
+                lambda n: n.info(section), nodes, self.workers):
+            if err is not None:
+                logger.warning('failed to get info of %s: %s', node, err)
+                continue
+            yield node, info
+
+    def estimate(self):
+        '''Read the dataset size of every master and the syncs they
+        already serve concurrently.
+        '''
+        sizes = {}
+        for master, info in self._info('memory', self._pending_masters()):
+            sizes[master.name] = info.get('used_memory', 0)
+        for job in self.pending:
+            job.size = job.left = sizes.get(job.master.name, 0)
+        self.pending.sort(key=lambda j: j.size, reverse=True)
+        self.refresh_serving()
+
+    def refresh_serving(self, now=None):
+        '''Count the full syncs the masters of the pending jobs serve to
+        slaves not started by this scheduler.
+        '''
+        ours = set((j.slave.host, int(j.slave.port)) for j in self.running)
+        serving = {}
+        for master, info in self._info('replication',
+                                       self._pending_masters()):
+            count = serving_syncs(info, ours)
+            if count:
+                serving[master.host] = serving.get(master.host, 0) + count
+        self.serving = serving
+        self.serving_checked = time.time() if now is None else now
+
+    def _blocked_by_hosts(self, job):
+        limits = self.limits
+        if limits.per_source_host is not None and \
+                self.source_syncs.get(job.source_host, 0) + \
+                self.serving.get(job.source_host, 0) >= \
+                limits.per_source_host:
+            return True
+        if limits.per_target_host is not None and \
+                self.target_syncs.get(job.target_host, 0) >= \
+                limits.per_target_host:
+            return True
+        return False
+
+    def admit(self):
+        '''Return the jobs which can start now, biggest first.
+
+        Jobs blocked by a host limit are skipped so that syncs between
+        other hosts can start. A job over the bytes budget stops the scan,
+        otherwise smaller jobs could delay it forever.
+        '''
+        admitted = []
+        in_flight = self.bytes_in_flight
+        for job in list(self.pending):
+            if self.limits.max_syncs is not None and \
+                    len(self.running) >= self.limits.max_syncs:
+                break
+            if self._blocked_by_hosts(job):
+                continue
+            if self.limits.max_bytes is not None and self.running and \
+                    in_flight + job.size > self.limits.max_bytes:
+                break
+            self.start(job)
+            in_flight += job.left
+            admitted.append(job)
+        return admitted
+
+    def start(self, job):
+        self.pending.remove(job)
+        self.running.append(job)
+        self.source_syncs[job.source_host] = \
+            self.source_syncs.get(job.source_host, 0) + 1
+        self.target_syncs[job.target_host] = \
+            self.target_syncs.get(job.target_host, 0) + 1
+
+    def _release(self, job):
+        self.running.remove(job)
+        job.left = 0
+        self.source_syncs[job.source_host] -= 1
+        self.target_syncs[job.target_host] -= 1
+
+    def finish(self, job):
+        self._release(job)
+        self.finished.append(job)
+
+    def restart(self, job, reason='stalled'):
+        '''Restart a failed sync, CLUSTER REPLICATE starts a new
+        handshake with the master even if it is unchanged.
+        '''
+        job.retries += 1
+        job.stalled_since = None
+        job.samples.clear()
+        logger.warning('sync of %s %s, restarting it (%d/%d)',
+                       job, reason, job.retries, self.max_retries)
+        job.slave.replicate(job.master.name)
+
+    def fail(self, job, reason='stalled'):
+        logger.error('sync of %s %s %d times, giving up', job, reason,
+                     job.retries + 1)
+        self._release(job)
+        self.failed.append(job)
+
+    def retry(self, job, reason='stalled'):
+        if job.retries < self.max_retries:
+            self.restart(job, reason)
+        else:
+            self.fail(job, reason)
+
+    def _stalled(self, job, info, now):
+        if info.get('master_sync_in_progress'):
+            job.stalled_since = None
+            return info.get('master_sync_last_io_seconds_ago', 0) >= \
+                self.stall_timeout
+        # a slave loading the RDB is busy, not stalled
+        if info.get('loading'):
+            job.stalled_since = None
+            return False
+        # the link is down and no sync is in progress
+        if job.stalled_since is None:
+            job.stalled_since = now
+        return now - job.stalled_since >= self.stall_timeout
+
+    def poll(self, now=None):
+        '''Read `INFO replication` of the running slaves concurrently,
+        finish the jobs whose sync is over, record the progress of the
+        others and restart the stalled ones.
+        '''
+        if now is None:
+            now = time.time()
+        for job, info, err in concurrent_map(
+                lambda j: j.slave.info('replication'), self.running,
+                self.workers):
+            if err is not None:
+                logger.warning('failed to get info of %s: %s', job, err)
+                continue
+            # promoted or reset since, it is not syncing anything
+            if info.get('role') != 'slave':
+                self.retry(job, 'lost its master')
+                continue
+            job.offset = info.get('slave_repl_offset', job.offset)
+            if info.get('master_link_status') == 'up' and \
+                    not info.get('master_sync_in_progress'):
+                self.finish(job)
+                continue
+            left = info.get('master_sync_left_bytes', -1)
+            # -1 until the size is known, e.g. for diskless syncs
+            if info.get('master_sync_in_progress') and left >= 0:
+                job.record(now, left)
+            if self._stalled(job, info, now):
+                self.retry(job)
+
+        if self.pending and (self.serving_checked is None or
+                             now - self.serving_checked >=
+                             SERVING_REFRESH_INTERVAL):
+            self.refresh_serving(now)
+
+    @property
+    def rate(self):
+        return sum(j.rate for j in self.running)
+
+    @property
+    def eta(self):
+        '''Seconds until all syncs are over at the current throughput'''
+        rate = self.rate
+        if rate <= 0:
+            return None
+        left = self.bytes_in_flight + sum(j.size for j in self.pending)
+        return left / rate
+
+    def report(self):
+        '''Lines describing the overall progress and every running sync'''
+        total = len(self.pending) + len(self.running) + \
+            len(self.finished) + len(self.failed)
+        lines = ['{}/{} syncs done, {} running, {} failed, {} left at '
+                 '{}/s, ETA {}'.format(
+                     len(self.finished), total, len(self.running),
+                     len(self.failed), format_size(self.bytes_in_flight),
+                     format_size(int(self.rate)), format_eta(self.eta))]
+        for job in self.running:
+            lines.append('  {} <- {}:{} {} left at {}/s, ETA {}'.format(
+                job, job.master.host, job.master.port,
+                format_size(job.left), format_size(int(job.rate)),
+                format_eta(job.eta)))
+        return lines
+
+
+def sync_limit_arguments(func):
+    func = cli.argument("--max-sync-bytes", dest="max_sync_bytes",
+                        help="bytes in flight of all syncs, e.g. 8g")(func)
+    func = cli.argument("--max-syncs-per-slave-host",
+                        dest="max_syncs_per_slave_host", type=int)(func)
+    return cli.argument("--max-syncs-per-master-host",
+                        dest="max_syncs_per_master_host", type=int)(func)
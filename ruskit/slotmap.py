@@ -0,0 +1,184 @@
+'''Bytes, keys and types of every slot of a cluster.
+
+`SlotScanner` scans every master concurrently, through one of its synced
+replicas when there is one, with SCAN and a pipelined `MEMORY USAGE` and
+`TYPE` of every batch of keys. Only the batch being read and the 16384
+counters of `SlotTable` are held in memory, whatever the size of the
+cluster.
+
+The table is saved as tab separated lines of the slots holding keys.
+While the scan runs, it is regularly written with the SCAN cursor of
+every master to a `.partial` file, in a single rename, so an interrupted
+scan resumes from the last batch written. The planners load the finished
+table with `SlotTable.load`.
+'''
+from array import array
+import json
+import logging
+import os
+import threading
+import time
+
+from .slots import key_slot, CLUSTER_HASH_SLOTS
+from .utils import echo, concurrent_map, DEFAULT_WORKERS
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+TYPES = ('string', 'list', 'set', 'zset', 'hash', 'stream')
+SCAN_COUNT = 1000
+CHECKPOINT_INTERVAL = 10
+DEFAULT_OUTPUT = 'ruskit-slots.tsv'
+CURSORS_PREFIX = '# cursors '
+
+
+class SlotTable(object):
+    COLUMNS = ('slot', 'keys', 'bytes') + TYPES
+
+    def __init__(self):
+        self.keys = array('l', [0]) * CLUSTER_HASH_SLOTS
+        self.bytes = array('l', [0]) * CLUSTER_HASH_SLOTS
+        self.types = dict((t, array('l', [0]) * CLUSTER_HASH_SLOTS)
+                          for t in TYPES)
+
+    def add(self, slot, size, type_):
+        self.keys[slot] += 1
+        self.bytes[slot] += size
+        if type_ in self.types:
+            self.types[type_][slot] += 1
+
+    def sizes(self):
+        '''{slot: bytes} of the slots holding keys'''
+        return dict((s, b) for s, b in enumerate(self.bytes) if b)
+
+    def rows(self):
+        for slot in xrange(CLUSTER_HASH_SLOTS):
+            if self.keys[slot]:
+                yield [slot, self.keys[slot], self.bytes[slot]] + \
+                    [self.types[t][slot] for t in TYPES]
+
+    def save(self, path, cursors=None):
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write('# ruskit slot map\n')
+            if cursors is not None:
+                f.write(CURSORS_PREFIX + json.dumps(cursors) + '\n')
+            f.write('\t'.join(self.COLUMNS) + '\n')
+            for row in self.rows():
+                f.write('\t'.join(map(str, row)) + '\n')
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        '''Return the table and the cursors saved with it, if any'''
+        table = cls()
+        cursors = None
+        with open(path) as f:
+            for line in f:
+                if line.startswith(CURSORS_PREFIX):
+                    cursors = json.loads(line[len(CURSORS_PREFIX):])
+                    continue
+                if line.startswith('#') or line.startswith('slot'):
+                    continue
+                fields = map(int, line.split('\t'))
+                slot = fields[0]
+                table.keys[slot] = fields[1]
+                table.bytes[slot] = fields[2]
+                for t, count in zip(TYPES, fields[3:]):
+                    table.types[t][slot] = count
+        return table, cursors
+
+
+def load_slot_sizes(path):
+    '''{slot: bytes} from a slot map, for the migration planners'''
+    table, _ = SlotTable.load(path)
+    return table.sizes()
+
+
+class SlotScanner(object):
+    def __init__(self, cluster, output=DEFAULT_OUTPUT, from_replicas=True,
+                 count=SCAN_COUNT, workers=DEFAULT_WORKERS,
+                 checkpoint_interval=CHECKPOINT_INTERVAL):
+        self.cluster = cluster
+        self.output = output
+        self.partial = output + '.partial'
+        self.from_replicas = from_replicas
+        self.count = count
+        self.workers = workers
+        self.checkpoint_interval = checkpoint_interval
+        self.table = SlotTable()
+        # master name -> SCAN cursor, None once its scan is over
+        self.cursors = {}
+        self.lock = threading.Lock()
+        self.last_checkpoint = time.time()
+
+    def source(self, master):
+        '''A synced replica of `master`, or `master` itself'''
+        if not self.from_replicas:
+            return master
+        return self.cluster.synced_replica(master) or master
+
+    def resume(self):
+        if not os.path.exists(self.partial):
+            return False
+        self.table, self.cursors = SlotTable.load(self.partial)
+        self.cursors = self.cursors or {}
+        return True
+
+    def checkpoint(self, force=False):
+        with self.lock:
+            if not force and time.time() - self.last_checkpoint < \
+                    self.checkpoint_interval:
+                return
+            self.table.save(self.partial, self.cursors)
+            self.last_checkpoint = time.time()
+
+    def scan(self, master):
+        cursor = self.cursors.get(master.name, 0)
+        if cursor is None:
+            return 0
+        node = self.source(master)
+        scanned = 0
+        while True:
+            next_cursor, keys = node.scan(cursor, count=self.count)
+            pipe = node.pipeline(transaction=False)
+            # the keys of a replica are only readable after READONLY
+            pipe.execute_command('READONLY')
+            for key in keys:
+                pipe.execute_command('MEMORY USAGE', key)
+                pipe.execute_command('TYPE', key)
+            replies = pipe.execute(raise_on_error=False)[1:]
+            with self.lock:
+                for i, key in enumerate(keys):
+                    size, type_ = replies[2 * i], replies[2 * i + 1]
+                    # expired or deleted since the SCAN
+                    if size is None or isinstance(size, Exception):
+                        continue
+                    self.table.add(key_slot(key), size, type_)
+                cursor = int(next_cursor)
+                self.cursors[master.name] = cursor or None
+            scanned += len(keys)
+            self.checkpoint()
+            if not cursor:
+                return scanned
+
+    def run(self):
+        '''Scan all the masters and save the table, resuming from the
+        partial table if there is one.
+        '''
+        if self.resume():
+            echo('Resuming the scan from', self.partial)
+        for master, scanned, err in concurrent_map(
+                self.scan, self.cluster.masters, self.workers):
+            if err is not None:
+                logger.error('failed to scan %s: %s', master, err)
+            else:
+                echo('Scanned {} keys of {}'.format(scanned,
+                                                    master.gen_addr()))
+        self.checkpoint(force=True)
+        if any(c is not None for c in self.cursors.values()) or \
+                len(self.cursors) < len(self.cluster.masters):
+            return None
+        self.table.save(self.output)
+        os.remove(self.partial)
+        return self.table
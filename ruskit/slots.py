@@ -0,0 +1,187 @@
+'''Hash slots of the keys.
+
+The slot of a key is the CRC16 (XMODEM) of the key modulo 16384, or of
+its hash tag, the part between the first `{` and the next `}` when it is
+not empty. `key_slot` computes the CRC a byte at a time from a
+precomputed table. `key_slots` computes the slots of many keys at once,
+two bytes at a time from a table of all the 16 bit words, built on its
+first use, or with NumPy one byte of all the keys at a time when it is
+installed. NumPy only gets the keys up to NUMPY_MAX_KEY_SIZE bytes, sorted
+by size, so that a byte is only fed to the keys still that long and a few
+long keys do not pad all the others.
+
+`SlotOwners` is a snapshot of the master serving every slot, to route
+keys to their masters.
+'''
+import sys
+from array import array
+from collections import defaultdict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CLUSTER_HASH_SLOTS = 16384
+SLOT_MASK = CLUSTER_HASH_SLOTS - 1
+# below it, the arrays of NumPy cost more than they save
+NUMPY_MIN_KEYS = 10000
+# the longer keys are hashed by _key_slots_words
+NUMPY_MAX_KEY_SIZE = 64
+
+
+def _gen_crc16_table():
+    table = []
+    for byte in xrange(256):
+        crc = byte << 8
+        for _ in xrange(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xffff
+            else:
+                crc = (crc << 1) & 0xffff
+        table.append(crc)
+    return table
+
+
+CRC16_TABLE = _gen_crc16_table()
+# CRC16 of every 16 bit word, see _word_table
+_crc16_word_table = None
+
+
+def crc16(data):
+    crc = 0
+    table = CRC16_TABLE
+    for byte in bytearray(data):
+        crc = ((crc << 8) & 0xff00) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+def _word_table():
+    '''As the register is 16 bits, feeding it a big endian word is a
+    single lookup: crc = table[crc ^ word].
+    '''
+    global _crc16_word_table
+    if _crc16_word_table is None:
+        t = CRC16_TABLE
+        _crc16_word_table = [
+            (((t[w >> 8] << 8) & 0xff00) ^ t[(t[w >> 8] >> 8) ^ (w & 0xff)])
+            for w in xrange(1 << 16)]
+    return _crc16_word_table
+
+
+def hash_tag(key):
+    start = key.find('{')
+    if start >= 0:
+        end = key.find('}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+def _as_bytes(key):
+    if isinstance(key, str):
+        return key
+    if isinstance(key, unicode):
+        return key.encode('utf-8')
+    if isinstance(key, memoryview):
+        return key.tobytes()
+    return str(key)
+
+
+def key_slot(key):
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return crc16(hash_tag(key)) % CLUSTER_HASH_SLOTS
+
+
+def _key_slots_words(keys):
+    words_table = _word_table()
+    table = CRC16_TABLE
+    swap = sys.byteorder == 'little'
+    slots = array('H')
+    for key in keys:
+        size = len(key)
+        words = array('H', key[:size & ~1])
+        if swap:
+            words.byteswap()
+        crc = 0
+        for word in words:
+            crc = words_table[crc ^ word]
+        if size & 1:
+            crc = ((crc << 8) & 0xff00) ^ table[(crc >> 8) ^ ord(key[-1])]
+        slots.append(crc & SLOT_MASK)
+    return slots
+
+
+def _key_slots_numpy(keys):
+    lengths = numpy.fromiter((len(k) for k in keys), numpy.intp, len(keys))
+    slots = numpy.zeros(len(keys), numpy.uint16)
+    long_keys = numpy.flatnonzero(lengths > NUMPY_MAX_KEY_SIZE)
+    if len(long_keys):
+        slots[long_keys] = _key_slots_words([keys[i] for i in long_keys])
+
+    short_keys = numpy.flatnonzero(lengths <= NUMPY_MAX_KEY_SIZE)
+    # the longest first, the keys of more than i bytes are a prefix
+    order = short_keys[numpy.argsort(-lengths[short_keys], kind='mergesort')]
+    sizes = lengths[order]
+    width = int(sizes[0]) if len(order) else 0
+    if width:
+        data = numpy.frombuffer(
+            ''.join(keys[i].ljust(width, '\0') for i in order),
+            numpy.uint8).reshape(len(order), width)
+        # keys of more than i bytes, for every i
+        fed = numpy.searchsorted(-sizes, -numpy.arange(width), 'left')
+        table = numpy.array(CRC16_TABLE, numpy.uint32)
+        crc = numpy.zeros(len(order), numpy.uint32)
+        for i in xrange(width):
+            c = crc[:fed[i]]
+            crc[:fed[i]] = ((c << 8) & 0xff00) ^ table[(c >> 8) ^
+                                                       data[:fed[i], i]]
+        slots[order] = crc & SLOT_MASK
+    return array('H', slots.tobytes())
+
+
+def key_slots(keys, vectorize=None):
+    '''The slots of all the `keys`, as an array in the same order. Keys
+    may be str, unicode, bytearray or memoryview. NumPy is used when it is
+    installed and there are enough keys, unless `vectorize` says so.
+    '''
+    keys = [hash_tag(_as_bytes(k)) for k in keys]
+    if vectorize is None:
+        vectorize = numpy is not None and len(keys) >= NUMPY_MIN_KEYS
+    if vectorize and keys:
+        return _key_slots_numpy(keys)
+    return _key_slots_words(keys)
+
+
+class SlotOwners(object):
+    '''The master serving every slot when the snapshot was taken'''
+
+    def __init__(self, masters):
+        self.masters = list(masters)
+        self.owners = array('h', [-1]) * CLUSTER_HASH_SLOTS
+        for i, master in enumerate(self.masters):
+            for slot in master.slots:
+                self.owners[slot] = i
+
+    @classmethod
+    def from_cluster(cls, cluster):
+        return cls(cluster.masters)
+
+    def missing(self):
+        '''The slots not served by any master'''
+        return [s for s, i in enumerate(self.owners) if i < 0]
+
+    def owner(self, slot):
+        index = self.owners[slot]
+        return self.masters[index] if index >= 0 else None
+
+    def key_owner(self, key):
+        return self.owner(key_slot(key))
+
+    def group(self, keys):
+        '''{master: [keys]}, the keys of unserved slots under None'''
+        groups = defaultdict(list)
+        for key, slot in zip(keys, key_slots(keys)):
+            groups[self.owner(slot)].append(key)
+        return dict(groups)
@@ -0,0 +1,140 @@
+import json
+import math
+import os
+import re
+from collections import defaultdict
+
+
+# commands whose first argument is a sub command rather than a key
+CONTAINER_COMMANDS = {
+    'CLUSTER', 'CONFIG', 'CLIENT', 'COMMAND', 'SCRIPT', 'SLOWLOG', 'MEMORY',
+    'OBJECT', 'DEBUG', 'LATENCY', 'MODULE', 'XINFO', 'XGROUP', 'FUNCTION',
+    'ACL', 'PUBSUB',
+}
+KEYLESS_COMMANDS = {
+    'PING', 'INFO', 'DBSIZE', 'FLUSHALL', 'FLUSHDB', 'KEYS', 'SCAN', 'TIME',
+    'LASTSAVE', 'SAVE', 'BGSAVE', 'BGREWRITEAOF', 'RANDOMKEY', 'MULTI',
+    'EXEC', 'DISCARD', 'SELECT', 'ROLE', 'READONLY', 'READWRITE', 'AUTH',
+    'ECHO', 'PUBLISH', 'SUBSCRIBE', 'PSUBSCRIBE', 'WAIT', 'SWAPDB',
+}
+EVAL_COMMANDS = {'EVAL', 'EVALSHA', 'EVAL_RO', 'EVALSHA_RO', 'FCALL'}
+
+KEY_SEPARATOR = re.compile(r'([:._/|\-{}])')
+DIGIT = re.compile(r'\d')
+
+
+def key_pattern(key):
+    """Replace the variable parts of a key with `*`
+
+    user:10086:profile => user:*:profile
+    """
+    parts = KEY_SEPARATOR.split(key)
+    return ''.join('*' if DIGIT.search(p) else p for p in parts)
+
+
+def fingerprint(command):
+    """Reduce a slowlog command to `<COMMAND> <key pattern>`
+    """
+    if isinstance(command, (list, tuple)):
+        args = list(command)
+    else:
+        args = command.split()
+    args = [a if isinstance(a, str) else a.decode('utf-8', 'replace')
+            for a in args]
+    if not args:
+        return ''
+
+    name = args[0].upper()
+    if name in CONTAINER_COMMANDS and len(args) > 1:
+        return '{} {}'.format(name, args[1].upper())
+    if name in KEYLESS_COMMANDS or len(args) < 2:
+        return name
+    if name in EVAL_COMMANDS:
+        if len(args) < 4 or args[2] == '0':
+            return name
+        return '{} {}'.format(name, key_pattern(args[3]))
+    return '{} {}'.format(name, key_pattern(args[1]))
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list
+    """
+    if not values:
+        return 0
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+class SlowLogCursor(object):
+    '''Remember the last seen slowlog id of every node, so that repeated
+    runs only fetch the new entries.
+    '''
+    def __init__(self, path=None):
+        self.path = path
+        self.last_ids = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.last_ids = json.load(f)
+
+    def get(self, addr):
+        return self.last_ids.get(addr)
+
+    def update(self, addr, logs):
+        if logs:
+            self.last_ids[addr] = max(log['id'] for log in logs)
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.last_ids, f)
+        os.rename(tmp, self.path)
+
+
+class SlowLogStat(object):
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.durations = []
+        self.nodes = set()
+
+    def add(self, node, duration):
+        self.durations.append(duration)
+        self.nodes.add(node)
+
+    @property
+    def count(self):
+        return len(self.durations)
+
+    @property
+    def total(self):
+        return sum(self.durations)
+
+    @property
+    def p99(self):
+        return percentile(sorted(self.durations), 99)
+
+
+class SlowLogAggregator(object):
+    '''Group slowlog entries of the whole cluster by command fingerprint'''
+
+    SORT_KEYS = ('total', 'count', 'p99')
+
+    def __init__(self):
+        self.stats = {}
+        self.nodes = defaultdict(int)
+
+    def add(self, node, logs):
+        addr = node.gen_addr()
+        for log in logs:
+            fp = fingerprint(log['command'])
+            if fp not in self.stats:
+                self.stats[fp] = SlowLogStat(fp)
+            self.stats[fp].add(addr, log['duration'])
+            self.nodes[addr] += 1
+
+    def top(self, n=20, sort_by='total'):
+        assert sort_by in self.SORT_KEYS
+        stats = sorted(self.stats.values(),
+                       key=lambda s: getattr(s, sort_by), reverse=True)
+        return stats[:n]
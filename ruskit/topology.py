@@ -0,0 +1,86 @@
+'''Failure domains of hosts, used to place slaves with a min cost flow.
+
+A topology file has one host per line, followed by its rack and zone:
+
+    # host        rack    zone
+    10.0.0.1      r1      az1
+    10.0.0.2      r2      az1
+    redis-3.lan   r3      az2
+
+Hosts missing from the file are treated as being the only host of their
+rack and of an unknown zone.
+'''
+import socket
+
+from .utils import RuskitException
+
+
+# cost of placing a slave relative to its master, per policy
+POLICIES = {
+    # different rack in the same zone: survives a rack failure and keeps
+    # full syncs on cheap intra-zone links
+    'rack': {'same_rack': 100, 'same_zone': 1, 'other_zone': 10},
+    # different zone: survives a zone failure at the cost of cross-zone
+    # replication traffic
+    'zone': {'same_rack': 100, 'same_zone': 10, 'other_zone': 1},
+}
+DEFAULT_POLICY = 'rack'
+
+
+class InvalidTopology(RuskitException):
+    pass
+
+
+class Topology(object):
+    def __init__(self, labels, policy=DEFAULT_POLICY):
+        '''`labels` maps host to (rack, zone)'''
+        if policy not in POLICIES:
+            raise InvalidTopology('unknown policy: {}'.format(policy))
+        self.labels = labels
+        self.policy = policy
+        self.costs = POLICIES[policy]
+
+    @classmethod
+    def load(cls, path, policy=DEFAULT_POLICY):
+        labels = {}
+        with open(path) as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                parts = line.split()
+                if len(parts) != 3:
+                    raise InvalidTopology(
+                        '{}:{}: expect `host rack zone`'.format(path, lineno))
+                host, rack, zone = parts
+                labels[socket.gethostbyname(host)] = (rack, zone)
+        return cls(labels, policy)
+
+    def domain(self, host):
+        return self.labels.get(host, ('host:' + host, None))
+
+    def cost(self, slave_host, master_host):
+        slave_rack, slave_zone = self.domain(slave_host)
+        master_rack, master_zone = self.domain(master_host)
+        if slave_zone is None or slave_zone != master_zone:
+            return self.costs['other_zone']
+        if slave_rack == master_rack:
+            return self.costs['same_rack']
+        return self.costs['same_zone']
+
+    def apply(self, g, hosts, offset):
+        '''Set the cost of every edge from slave host i to master host j,
+        which is vertex `offset + j` in the graph.
+        '''
+        for i, slave_host in enumerate(hosts):
+            for j, master_host in enumerate(hosts):
+                if i != j:
+                    g.set_cost(i, offset + j,
+                               self.cost(slave_host, master_host))
+
+
+def solve(g, source, target, topology=None):
+    '''Plain max flow, or the cheapest max flow if a topology is given'''
+    if topology is None:
+        return g.maxflow(source, target)
+    return g.min_cost_flow(source, target)
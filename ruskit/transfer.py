@@ -0,0 +1,172 @@
+'''Copy of the keys of a cluster into another one.
+
+Every master of the source cluster is read concurrently, through one of
+its synced replicas when there is one, a slot after the other: the keys
+of a slot are listed with `CLUSTER GETKEYSINSLOT`, then read with
+pipelined `DUMP` and `PTTL` and written with pipelined `RESTORE ...
+REPLACE` to the master owning the slot in the destination cluster, the
+payloads passed through as they are. The writes go through a
+`ClusterClient`, which follows the slots moved meanwhile. As a slot is
+only listed once all the keys of the slot before it are written, the
+checkpoint is the set of the slots copied, which a resumed copy skips.
+
+The number of masters of the two clusters do not have to be the same, a
+slot is always written to a single destination master.
+'''
+import fnmatch
+import json
+import logging
+import os
+import threading
+import time
+
+from .client import ClusterClient
+from .utils import echo, concurrent_map, RateLimiter, RuskitException, \
+    DEFAULT_WORKERS
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+BATCH_SIZE = 100
+CHECKPOINT_INTERVAL = 10
+DEFAULT_CHECKPOINT = 'ruskit-copy.json'
+
+
+class CopyFailed(RuskitException):
+    pass
+
+
+class ClusterCopier(object):
+    def __init__(self, src, dst, pattern=None, checkpoint=DEFAULT_CHECKPOINT,
+                 from_replicas=True, batch_size=BATCH_SIZE, rate=None,
+                 workers=DEFAULT_WORKERS,
+                 checkpoint_interval=CHECKPOINT_INTERVAL):
+        self.src = src
+        self.dst = dst
+        self.pattern = pattern
+        self.checkpoint_path = checkpoint
+        self.from_replicas = from_replicas
+        self.batch_size = batch_size
+        self.limiter = RateLimiter(rate)
+        self.workers = workers
+        self.checkpoint_interval = checkpoint_interval
+        self.lock = threading.Lock()
+        # slots copied
+        self.done = set()
+        self.copied = 0
+        self.failed = 0
+        self.last_error = None
+        self.last_checkpoint = time.time()
+        self.client = None
+
+    def connect(self):
+        self.client = ClusterClient(self.dst, workers=self.workers)
+        missing = self.client.owners.missing()
+        if missing:
+            raise CopyFailed('{} slots are not served by any master of the '
+                             'destination'.format(len(missing)))
+
+    def resume(self):
+        if not os.path.exists(self.checkpoint_path):
+            return False
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint['pattern'] != self.pattern:
+            raise CopyFailed('{} is for the pattern {!r}, not {!r}'.format(
+                self.checkpoint_path, checkpoint['pattern'], self.pattern))
+        self.done = set(checkpoint['slots'])
+        return True
+
+    def checkpoint(self, force=False):
+        with self.lock:
+            if not force and time.time() - self.last_checkpoint < \
+                    self.checkpoint_interval:
+                return
+            tmp = self.checkpoint_path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'pattern': self.pattern,
+                           'slots': sorted(self.done)}, f)
+            os.rename(tmp, self.checkpoint_path)
+            self.last_checkpoint = time.time()
+
+    def _record(self, replies):
+        with self.lock:
+            for reply in replies:
+                if isinstance(reply, Exception):
+                    self.failed += 1
+                    self.last_error = reply
+                else:
+                    self.copied += 1
+
+    def copy_batch(self, node, keys):
+        pipe = node.pipeline(transaction=False)
+        # the raw PTTL, redis.Redis turns both 0 and -2 into None
+        pipe.response_callbacks = dict(pipe.response_callbacks, PTTL=int)
+        # the keys of a replica are only readable after READONLY
+        pipe.execute_command('READONLY')
+        for key in keys:
+            pipe.execute_command('DUMP', key)
+            pipe.execute_command('PTTL', key)
+        replies = pipe.execute(raise_on_error=False)[1:]
+
+        pipe = self.client.pipeline()
+        size = 0
+        errors = []
+        for i, key in enumerate(keys):
+            payload, ttl = replies[2 * i], replies[2 * i + 1]
+            if isinstance(payload, Exception) or isinstance(ttl, Exception):
+                errors.append(payload if isinstance(payload, Exception)
+                              else ttl)
+                continue
+            # deleted since it was listed, or expired after the DUMP
+            if payload is None or ttl == -2:
+                continue
+            # -1 without any expire, RESTORE takes 0 for it, and a key
+            # expiring within the millisecond keeps an expire
+            ttl = 0 if ttl == -1 else max(ttl, 1)
+            pipe.execute_command('RESTORE', key, ttl, payload, 'REPLACE')
+            size += len(payload)
+        self.limiter.acquire(size)
+        self._record(errors + pipe.execute(raise_on_error=False))
+
+    def copy_slot(self, node, slot):
+        count = node.countkeysinslot(slot)
+        if not count:
+            return
+        keys = node.getkeysinslot(slot, count)
+        if self.pattern is not None:
+            keys = [k for k in keys if fnmatch.fnmatchcase(k, self.pattern)]
+        for i in xrange(0, len(keys), self.batch_size):
+            self.copy_batch(node, keys[i:i + self.batch_size])
+
+    def copy_master(self, master):
+        node = master
+        if self.from_replicas:
+            node = self.src.synced_replica(master) or master
+        for slot in sorted(master.slots):
+            if slot in self.done:
+                continue
+            self.copy_slot(node, slot)
+            with self.lock:
+                self.done.add(slot)
+            self.checkpoint()
+
+    def run(self):
+        '''Copy the keys of all the slots not copied yet'''
+        self.connect()
+        if self.resume():
+            echo('Resuming the copy, {} slots copied already'.format(
+                len(self.done)))
+        failed = []
+        for master, _, err in concurrent_map(
+                self.copy_master, self.src.masters, self.workers):
+            if err is not None:
+                logger.error('failed to copy from %s: %s', master, err)
+                failed.append(master)
+            else:
+                echo('Copied the slots of', master.gen_addr())
+        self.checkpoint(force=True)
+        if failed:
+            raise CopyFailed('failed to copy from {}'.format(', '.join(
+                m.gen_addr() for m in failed)))
+        os.remove(self.checkpoint_path)
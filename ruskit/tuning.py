@@ -0,0 +1,216 @@
+'''Temporary replication settings of the masters serving full syncs.
+
+While many slaves are added, the defaults of the masters often make the
+full syncs fail: the output buffer of a slave is closed as soon as the
+writes received during the RDB transfer exceed `client-output-buffer-limit
+slave`, and the slave starts another full sync from scratch. Writing the
+RDB to the disk first also doubles the I/O of the master host.
+
+`ReplicationTuning` raises these limits, enables diskless syncs and grows
+the backlog of the masters for the duration of `Cluster.add_slaves`. The
+original values are written to a snapshot file before anything is changed
+and restored from it afterwards, so a snapshot left by a crashed run is
+restored by the next run or by the `untune` command.
+'''
+from collections import defaultdict
+import json
+import logging
+import os
+
+import redis
+
+from ruskit import cli
+from .cluster import ClusterNode
+from .replication import parse_size
+from .utils import concurrent_map, DEFAULT_WORKERS, RuskitException
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+DEFAULT_SNAPSHOT = 'ruskit-tuning.json'
+TUNED_PARAMS = ('client-output-buffer-limit', 'repl-diskless-sync',
+                'repl-diskless-sync-delay', 'repl-backlog-size')
+# the backlog should cover the writes made during the sync, which grow
+# with the time to transfer the dataset, and so with its size
+BACKLOG_RATIO = 8
+MIN_BACKLOG = 64 << 20
+MAX_BACKLOG = 1 << 30
+MIN_BUFFER_LIMIT = 512 << 20
+# seconds a master waits for more slaves before a diskless sync starts,
+# only worth it when several new slaves share the same master
+DISKLESS_SYNC_DELAY = 5
+SLAVE_CLASSES = ('slave', 'replica')
+
+
+class TuningFailed(RuskitException):
+    def __init__(self, errors):
+        self.errors = errors
+
+    def __str__(self):
+        return 'failed to restore the settings of {}'.format(
+            ', '.join(sorted(self.errors)))
+
+
+def slave_buffer_limit(value):
+    '''Hard limit of the slave class in a `client-output-buffer-limit`
+    value like `normal 0 0 0 slave 268435456 67108864 60 pubsub ...`
+    '''
+    fields = value.split()
+    for i in xrange(0, len(fields) - 3, 4):
+        if fields[i] in SLAVE_CLASSES:
+            return parse_size(fields[i + 1])
+    return None
+
+
+class ReplicationTuning(object):
+    def __init__(self, snapshot=DEFAULT_SNAPSHOT, backlog_size=None,
+                 buffer_limit=None, diskless_delay=DISKLESS_SYNC_DELAY,
+                 workers=DEFAULT_WORKERS):
+        self.snapshot = snapshot
+        self.backlog_size = backlog_size
+        self.buffer_limit = buffer_limit
+        self.diskless_delay = diskless_delay
+        self.workers = workers
+        self.nodes = {}
+
+    @classmethod
+    def from_args(cls, args):
+        if not args.tune_replication:
+            return None
+        return cls(
+            args.tuning_snapshot,
+            backlog_size=args.repl_backlog_size and
+            parse_size(args.repl_backlog_size),
+            buffer_limit=args.slave_buffer_limit and
+            parse_size(args.slave_buffer_limit))
+
+    def settings(self, original, used_memory, slaves):
+        '''Tuned values of a master from its original ones, none of the
+        limits is ever lowered.
+        '''
+        tuned = {}
+        limit = slave_buffer_limit(
+            original.get('client-output-buffer-limit', ''))
+        wanted = self.buffer_limit or max(MIN_BUFFER_LIMIT, used_memory / 4)
+        # 0 means no limit at all
+        if limit is not None and limit != 0 and limit < wanted:
+            tuned['client-output-buffer-limit'] = 'slave {} 0 0'.format(
+                wanted)
+
+        if 'repl-diskless-sync' in original:
+            tuned['repl-diskless-sync'] = 'yes'
+            tuned['repl-diskless-sync-delay'] = str(
+                self.diskless_delay if slaves > 1 else 0)
+
+        backlog = self.backlog_size or min(
+            MAX_BACKLOG, max(MIN_BACKLOG, used_memory / BACKLOG_RATIO))
+        if int(original.get('repl-backlog-size', backlog)) < backlog:
+            tuned['repl-backlog-size'] = str(backlog)
+        return {k: v for k, v in tuned.iteritems()
+                if k in original and original[k] != v}
+
+    def _get_originals(self, node):
+        original = {}
+        for param in TUNED_PARAMS:
+            original.update(node.config_get(param))
+        return original
+
+    def _node(self, addr):
+        if addr not in self.nodes:
+            self.nodes[addr] = ClusterNode.from_uri(addr)
+        return self.nodes[addr]
+
+    def _save(self, snapshot):
+        tmp = self.snapshot + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(snapshot, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self.snapshot)
+
+    def _load(self):
+        if not os.path.exists(self.snapshot):
+            return {}
+        with open(self.snapshot) as f:
+            return json.load(f)
+
+    def apply(self, jobs):
+        '''Tune the masters of the `SyncJob`s, their size must have been
+        estimated. A snapshot left by a previous run is restored first.
+        '''
+        if os.path.exists(self.snapshot):
+            logger.warning('restoring the settings left in %s by a '
+                           'previous run', self.snapshot)
+            self.restore()
+
+        masters = {}
+        slaves = defaultdict(int)
+        for job in jobs:
+            masters[job.master.gen_addr()] = job
+            slaves[job.master.gen_addr()] += 1
+            self.nodes[job.master.gen_addr()] = job.master
+
+        snapshot = {}
+        tuned = {}
+        for addr, original, err in concurrent_map(
+                lambda a: self._get_originals(self.nodes[a]), masters,
+                self.workers):
+            if err is not None:
+                logger.warning('not tuning %s: %s', addr, err)
+                continue
+            settings = self.settings(original, masters[addr].size,
+                                     slaves[addr])
+            if settings:
+                snapshot[addr] = {k: original[k] for k in settings}
+                tuned[addr] = settings
+        # the originals are on the disk before anything is changed
+        self._save(snapshot)
+
+        def _set(addr):
+            node = self.nodes[addr]
+            for param, value in sorted(tuned[addr].iteritems()):
+                try:
+                    node.config_set(param, value)
+                except redis.ResponseError as e:
+                    # e.g. an older redis without this parameter
+                    logger.warning('failed to set %s of %s: %s', param,
+                                   addr, e)
+
+        for addr, _, err in concurrent_map(_set, tuned, self.workers):
+            if err is not None:
+                logger.warning('failed to tune %s: %s', addr, err)
+        logger.info('tuned the replication of %d masters', len(tuned))
+
+    def restore(self):
+        '''Set the values of the snapshot back, the nodes that fail are
+        kept in it to be restored later.
+        '''
+        snapshot = self._load()
+
+        def _restore(addr):
+            node = self._node(addr)
+            for param, value in sorted(snapshot[addr].iteritems()):
+                node.config_set(param, value)
+
+        errors = {}
+        for addr, _, err in concurrent_map(_restore, snapshot, self.workers):
+            if err is not None:
+                logger.error('failed to restore %s: %s', addr, err)
+                errors[addr] = snapshot[addr]
+        if errors:
+            self._save(errors)
+            raise TuningFailed(errors)
+        if os.path.exists(self.snapshot):
+            os.remove(self.snapshot)
+        return sorted(snapshot)
+
+
+def tuning_arguments(func):
+    func = cli.argument("--slave-buffer-limit", dest="slave_buffer_limit",
+                        help="hard output buffer limit of the slaves")(func)
+    func = cli.argument("--repl-backlog-size", dest="repl_backlog_size")(func)
+    func = cli.argument("--tuning-snapshot", dest="tuning_snapshot",
+                        default=DEFAULT_SNAPSHOT)(func)
+    return cli.argument("--tune-replication", dest="tune_replication",
+                        default=False, action="store_true",
+                        help="tune the masters during the syncs")(func)
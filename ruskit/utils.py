@@ -3,12 +3,21 @@ from __future__ import print_function
 import itertools
 import os
 import sys
+import threading
+import time
 from functools import wraps
 
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
 from ruskit import cli
 
 
 NO_RETRY = -1
+DEFAULT_WORKERS = 32
+POLL_INTERVAL = 0.1
 
 
 COLOR_MAP = {
@@ -40,9 +49,11 @@ def echo(*values, **kwargs):
     sys.stdout.flush()
 
 
-def divide(n, m):
-    """Divide integer n to m chunks
+def divide(n, m, weights=None):
+    """Divide integer n to m chunks, proportional to `weights` if given
     """
+    if weights is not None:
+        return _divide_weighted(n, weights)
     avg = int(n / m)
     remain = n - m * avg
     data = list(itertools.repeat(avg, m))
@@ -54,6 +65,25 @@ def divide(n, m):
     return data
 
 
+def _divide_weighted(n, weights):
+    """Largest remainder: the floor of every exact share, then the chunks
+    with the biggest remainders get one more
+    """
+    total = float(sum(weights))
+    exact = [n * w / total for w in weights]
+    data = [int(e) for e in exact]
+    order = sorted(range(len(weights)), key=lambda i: data[i] - exact[i])
+    for i in order[:n - sum(data)]:
+        data[i] += 1
+    return data
+
+
+def flatten(lists):
+    """Concatenate lists in linear time, unlike `sum(lists, [])`
+    """
+    return list(itertools.chain.from_iterable(lists))
+
+
 def spread(nodes, n):
     """Distrubute master instances in different nodes
 
@@ -76,6 +106,72 @@ def spread(nodes, n):
     return target
 
 
+def concurrent_map(func, items, workers=DEFAULT_WORKERS):
+    """Call func on every item using a bounded pool of threads
+
+    Yield (item, result, error) tuples in completion order, so callers
+    can report results as soon as they arrive. error is None on success.
+    """
+    items = list(items)
+    if not items:
+        return
+
+    tasks = queue.Queue()
+    results = queue.Queue()
+    for item in items:
+        tasks.put(item)
+
+    def _worker():
+        while True:
+            try:
+                item = tasks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results.put((item, func(item), None))
+            except Exception as e:
+                results.put((item, None, e))
+
+    for _ in range(min(workers, len(items))):
+        t = threading.Thread(target=_worker)
+        t.daemon = True
+        t.start()
+
+    for _ in range(len(items)):
+        while True:
+            # a blocking get without timeout can not be interrupted in py2
+            try:
+                yield results.get(timeout=POLL_INTERVAL)
+                break
+            except queue.Empty:
+                continue
+
+
+class RateLimiter(object):
+    """Keep the amounts given to acquire under `rate` per second, without
+    any limit if `rate` is None. An idle period lets through at most one
+    second of rate at once.
+    """
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.start = None
+        self.used = 0
+
+    def acquire(self, amount):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.time()
+            if self.start is None or \
+                    self.start + float(self.used) / self.rate < now - 1:
+                self.start, self.used = now - 1, 0
+            self.used += amount
+            wait = self.start + float(self.used) / self.rate - now
+        if wait > 0:
+            time.sleep(wait)
+
+
 class RuskitException(Exception):
     pass
 
@@ -84,25 +180,39 @@ class InvalidNewNode(RuskitException):
     pass
 
 
-def check_new_nodes(new_nodes, old_nodes=None):
+def version_tuple(version):
+    return tuple(int(v) for v in version.split('.') if v.isdigit())
+
+
+def _check_new_node(instance):
+    info = instance.info()
+    if not info.get("cluster_enabled"):
+        raise InvalidNewNode("cluster not enabled")
+    if instance.cluster_info()["cluster_known_nodes"] != 1:
+        raise InvalidNewNode(
+            "node {}:{} belong to other cluster".format(
+                instance.host, instance.port))
+    if info.get("db0"):
+        raise InvalidNewNode("data exists in db0 of {}".format(instance))
+    return info['redis_version']
+
+
+def check_new_nodes(new_nodes, old_nodes=None, workers=DEFAULT_WORKERS):
+    """Check new nodes concurrently and return their redis version
+    """
     if old_nodes is None:
         old_nodes = []
 
     versions = set(n.info()['redis_version'] for n in old_nodes)
-    for instance in new_nodes:
-        info = instance.info()
-        if not info.get("cluster_enabled"):
-            raise InvalidNewNode("cluster not enabled")
-        if instance.cluster_info()["cluster_known_nodes"] != 1:
-            raise InvalidNewNode(
-                "node {}:{} belong to other cluster".format(
-                    instance.host, instance.port))
-        if info.get("db0"):
-            raise InvalidNewNode("data exists in db0 of {}".format(instance))
-        versions.add(info['redis_version'])
+    for _, version, err in concurrent_map(_check_new_node, new_nodes,
+                                          workers):
+        if err is not None:
+            raise err
+        versions.add(version)
     if len(versions) != 1:
         raise InvalidNewNode(
             "multiple versions found: {}".format(list(versions)))
+    return versions.pop()
 
 
 def timeout_argument(func):
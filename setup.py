@@ -23,7 +23,10 @@ setup(
         "redis>=2.10.5",
     ],
     extras_require={
-        'addslaves': ['python-igraph'],
+        # kept so that `pip install ruskit[addslaves]` still works
+        'addslaves': [],
+        # the CRC64 of the payloads of import-rdb in C
+        'rdb': ['crcmod'],
     },
     classifiers=[
         "Development Status :: 3 - Alpha",
@@ -0,0 +1,121 @@
+import time
+
+from ruskit.balancer import AutoBalancer, parse_quiet_hours, \
+    in_quiet_hours, skew
+from test_base import FakeNode, FakeCluster
+
+
+class LoadNode(FakeNode):
+    '''A byte per key'''
+
+    def __init__(self, name, keys):
+        super(LoadNode, self).__init__(name, sorted(keys))
+        # slot -> keys
+        self.keys = keys
+
+    @property
+    def memory(self):
+        return sum(self.keys.values())
+
+    def info(self):
+        return {'used_memory': self.memory, 'db0': {'keys': 1},
+                'instantaneous_ops_per_sec': 0}
+
+    def reply(self, command, slot):
+        assert command == 'CLUSTER COUNTKEYSINSLOT'
+        return self.keys[slot]
+
+
+def gen_node(name, start, slots, keys):
+    return LoadNode(name, dict((s, keys) for s in range(start, start + slots)))
+
+
+class LoadCluster(FakeCluster):
+    def __init__(self, masters):
+        super(LoadCluster, self).__init__(masters)
+        self.moves = []
+
+    def consistent(self):
+        return True
+
+    def check_action_stopped(self):
+        return False
+
+    def migrate_slot(self, src, dst, slot, verbose=True, masters=None):
+        assert masters == self.masters
+        self.moves.append((src.name, dst.name, slot))
+        dst.keys[slot] = src.keys.pop(slot)
+        src.slots.remove(slot)
+        dst.slots.append(slot)
+
+
+def local(hour, minute):
+    return time.mktime((2026, 1, 1, hour, minute, 0, 0, 0, -1))
+
+
+def test_quiet_hours():
+    quiet = [parse_quiet_hours('22:00-06:30'), parse_quiet_hours('12:00-13:00')]
+    assert quiet[0] == (1320, 390)
+    assert in_quiet_hours(quiet, local(23, 0))
+    assert in_quiet_hours(quiet, local(3, 0))
+    assert in_quiet_hours(quiet, local(12, 30))
+    assert not in_quiet_hours(quiet, local(6, 30))
+    assert not in_quiet_hours(quiet, local(18, 0))
+
+
+def test_skew():
+    assert skew({'a': 100, 'b': 100}) == 0
+    assert skew({'a': 150, 'b': 50}) == 0.5
+    assert skew({'a': 0}) == 0
+
+
+def test_hysteresis_and_moves():
+    a, b = gen_node('a', 0, 100, 15), gen_node('b', 100, 100, 5)
+    cluster = LoadCluster([a, b])
+    balancer = AutoBalancer(cluster, window=100, step_slots=10,
+                            max_bytes_per_hour=10 ** 6)
+    now = local(18, 0)
+    # skewed, but not for long enough
+    assert balancer.step(now) is None
+    assert balancer.step(now + 50) is None
+    assert balancer.step(now + 100) == (a, b, range(10))
+    assert len(cluster.moves) == 10
+
+    # still above `low`, goes on without waiting for the window again
+    while balancer.step(now + 200) is not None:
+        pass
+    assert skew({'a': a.memory, 'b': b.memory}) < balancer.low
+    assert not balancer.balancing
+
+
+def test_heaviest_slots_first():
+    a, b = gen_node('a', 0, 100, 10), gen_node('b', 100, 100, 1)
+    a.keys[50] = 400
+    cluster = LoadCluster([a, b])
+    balancer = AutoBalancer(cluster, window=0, step_slots=10,
+                            max_bytes_per_hour=10 ** 6)
+    # 1390 and 100 bytes, 645 over the mean
+    src, dst, slots, moved = balancer.plan(balancer.measure(), local(18, 0))
+    assert (src, dst) == (a, b)
+    assert slots == range(9) + [50]
+    assert moved == 490
+
+    # a slot heavier than the load over the mean is not moved
+    a.keys[50] = 2000
+    src, dst, slots, moved = balancer.plan(balancer.measure(), local(18, 0))
+    assert 50 not in slots
+
+
+def test_quiet_hours_and_budget():
+    a, b = gen_node('a', 0, 100, 15), gen_node('b', 100, 100, 5)
+    cluster = LoadCluster([a, b])
+    balancer = AutoBalancer(cluster, window=0, step_slots=10,
+                            quiet_hours=[(1320, 390)],
+                            max_bytes_per_hour=300)
+    assert balancer.step(local(23, 0)) is None
+    # 15 bytes per slot, the budget allows 20 slots in an hour
+    now = local(18, 0)
+    assert len(balancer.step(now)[2]) == 10
+    assert len(balancer.step(now + 60)[2]) == 10
+    assert balancer.step(now + 120) is None
+    assert len(balancer.step(now + 3600)[2]) == 10
@@ -2,6 +2,7 @@ import unittest
 
 from mock import MagicMock, patch, call
 
+from ruskit.client import ClusterClient
 from ruskit.cluster import ClusterNode, Cluster
 
 
@@ -85,6 +86,9 @@ class MockNewNode(MockRedisClient):
                 'cluster_enabled': True,
                 'cluster_known_nodes': 0,
                 'redis_version': '3.0.3',
+                'role': 'slave',
+                'master_link_status': 'up',
+                'master_sync_in_progress': 0,
             }
         if args[0] == 'CLUSTER INFO':
             return 'cluster_known_nodes:1'
@@ -93,6 +97,113 @@ class MockNewNode(MockRedisClient):
         return MagicMock()
 
 
+class FakePipeline(object):
+    '''Queues the commands sent to a `FakeNode`, they are answered by the
+    node once executed.
+    '''
+    def __init__(self, node):
+        self.node = node
+        self.commands = []
+        # the replies are not parsed
+        self.response_callbacks = {}
+
+    def execute_command(self, *args, **options):
+        self.commands.append(args)
+
+    def execute(self, raise_on_error=True):
+        self.node.pipelines += 1
+        if self.node.error is not None:
+            raise self.node.error
+        return self.node.replies(self.commands)
+
+
+class FakeNode(object):
+    '''A node of the fake clusters of the planners and of the pipelined
+    tools. Every command of a pipeline is answered by `reply`, which the
+    tests override. Setting `error` makes its pipelines and its
+    `CLUSTER NODES` raise it.
+    '''
+    def __init__(self, name, slots=(), host='h', port=7000, master=None,
+                 data=None):
+        self.name = name
+        self.slots = list(slots)
+        self.host = host
+        self.port = port
+        self.node_info = {'replicate': master or '-'}
+        self.data = {} if data is None else data
+        self.error = None
+        self.pipelines = 0
+        self.replicated = []
+        # set by the FakeCluster of the node
+        self.cluster = None
+
+    def gen_addr(self):
+        return self.name
+
+    def is_master(self):
+        return self.node_info['replicate'] == '-'
+
+    def is_slave(self, master_id=None):
+        return not self.is_master()
+
+    def replicate(self, name):
+        self.replicated.append(name)
+
+    def flush_cache(self):
+        pass
+
+    def nodes(self):
+        if self.error is not None:
+            raise self.error
+        self.cluster.refreshes += 1
+        return self.cluster.infos()
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def replies(self, commands):
+        return [self.reply(*args) for args in commands]
+
+    def reply(self, *args):
+        return 'OK'
+
+
+class FakeCluster(object):
+    def __init__(self, masters, replicas=None):
+        self.masters = masters
+        self.nodes = masters
+        # master name -> synced replica
+        self.replicas = replicas or {}
+        # CLUSTER NODES answered
+        self.refreshes = 0
+        for node in masters:
+            node.cluster = self
+
+    def synced_replica(self, master):
+        return self.replicas.get(master.name)
+
+    def flush_all_cache(self):
+        pass
+
+    def infos(self):
+        return [{'name': n.name, 'addr': n.gen_addr(),
+                 'flags': ['master' if n.is_master() else 'slave'],
+                 'link_status': 'connected', 'slots': n.slots}
+                for n in self.nodes]
+
+    def connect(self, addr):
+        for node in self.nodes:
+            if node.gen_addr() == addr:
+                return node
+        raise AssertionError('{} is not a node of the cluster'.format(addr))
+
+
+def patch_connect(cluster):
+    '''The `ClusterClient`s connect to the nodes of the fake `cluster`'''
+    return patch.object(ClusterClient, 'connect',
+                        lambda client, addr: cluster.connect(addr))
+
+
 def patch_not_used(func):
     @patch('socket.gethostbyname', lambda h: h)
     def _wrapper(*args, **kwargs):
@@ -0,0 +1,61 @@
+import pytest
+from mock import patch
+
+from ruskit.capacity import load_weights, declared_weights, \
+    maxmemory_weights, InvalidWeights
+
+
+class CapacityNode(object):
+    def __init__(self, host, port, maxmemory=0, total=0):
+        self.host = host
+        self.port = port
+        self.name = '{}:{}'.format(host, port)
+        self.maxmemory = maxmemory
+        self.total = total
+
+    def gen_addr(self):
+        return self.name
+
+    def config_get(self, param):
+        return {param: str(self.maxmemory)}
+
+    def info(self, section):
+        return {'total_system_memory': self.total}
+
+
+def test_declared_weights(tmpdir):
+    path = tmpdir.join('weights')
+    path.write('# host weights\n10.0.0.1 128\n10.0.0.2 32\n'
+               '10.0.0.2:7001 64  # bigger\n')
+    declared = load_weights(str(path))
+    masters = [CapacityNode('10.0.0.1', 7000), CapacityNode('10.0.0.1', 7001),
+               CapacityNode('10.0.0.2', 7000), CapacityNode('10.0.0.2', 7001)]
+    assert declared_weights(masters, declared) == {
+        '10.0.0.1:7000': 64, '10.0.0.1:7001': 64,
+        '10.0.0.2:7000': 16, '10.0.0.2:7001': 64}
+
+    with pytest.raises(InvalidWeights):
+        declared_weights([CapacityNode('10.0.0.3', 7000)], declared)
+
+    path.write('10.0.0.1\n')
+    with pytest.raises(InvalidWeights):
+        load_weights(str(path))
+
+
+def test_weights_of_host_names(tmpdir):
+    path = tmpdir.join('weights')
+    path.write('redis-1.lan 128\nredis-2.lan:7000 32\n')
+    addrs = {'redis-1.lan': '10.0.0.1', 'redis-2.lan': '10.0.0.2'}
+    with patch('socket.gethostbyname', side_effect=addrs.get):
+        declared = load_weights(str(path))
+    assert declared == {'10.0.0.1': 128, '10.0.0.2:7000': 32}
+
+
+def test_maxmemory_weights():
+    masters = [CapacityNode('a', 1, maxmemory=4096),
+               CapacityNode('b', 1, total=8192),
+               CapacityNode('b', 2, total=8192)]
+    assert maxmemory_weights(masters) == {'a:1': 4096, 'b:1': 4096,
+                                          'b:2': 4096}
+    with pytest.raises(InvalidWeights):
+        maxmemory_weights([CapacityNode('c', 1)])
@@ -0,0 +1,157 @@
+import pytest
+import redis
+
+from ruskit.client import ClusterClient
+from ruskit.slots import key_slot
+from test_base import FakeNode, FakeCluster, patch_connect
+
+
+class KeyNode(FakeNode):
+    def __init__(self, name, slots):
+        super(KeyNode, self).__init__(name, slots)
+        # slot -> name of the node importing it
+        self.migrating = {}
+        self.importing = set()
+
+    def replies(self, commands):
+        replies, asking = [], False
+        for args in commands:
+            if args[0] == 'ASKING':
+                asking = True
+                replies.append('OK')
+                continue
+            replies.append(self.key_reply(args, asking))
+            asking = False
+        return replies
+
+    def key_reply(self, args, asking):
+        command, key = args[0], args[1]
+        slot = key_slot(key)
+        if slot in self.migrating and key not in self.data:
+            return redis.ResponseError('ASK {} {}'.format(
+                slot, self.migrating[slot]))
+        if slot not in self.slots and not (asking and slot in self.importing):
+            return redis.ResponseError('MOVED {} {}'.format(
+                slot, self.cluster.owner(slot).name))
+        if command == 'SET':
+            self.data[key] = args[2]
+            return True
+        return self.data.get(key)
+
+
+class KeyCluster(FakeCluster):
+    def __init__(self):
+        super(KeyCluster, self).__init__([
+            KeyNode('a:1', range(0, 8192)),
+            KeyNode('b:1', range(8192, 16384))])
+
+    def add(self, node):
+        '''A master unknown when the client was created'''
+        node.cluster = self
+        self.nodes = self.masters = self.masters + [node]
+
+    def owner(self, slot):
+        for n in self.nodes:
+            if slot in n.slots:
+                return n
+
+
+@pytest.fixture
+def cluster():
+    cluster = KeyCluster()
+    with patch_connect(cluster):
+        yield cluster
+
+
+def test_pipeline_routes_by_slot(cluster):
+    client = ClusterClient(cluster)
+    pipe = client.pipeline()
+    for i in xrange(20):
+        pipe.execute_command('SET', 'key:{}'.format(i), i)
+    assert pipe.execute() == [True] * 20
+    a, b = cluster.nodes
+    # one pipeline per master
+    assert a.pipelines == b.pipelines == 1
+    assert all(key_slot(k) in a.slots for k in a.data)
+    assert len(a.data) + len(b.data) == 20
+    assert client.execute_command('GET', 'key:3') == 3
+    with pytest.raises(ValueError):
+        pipe.execute_command('PING')
+
+
+def test_moved_refreshes_the_slot_map(cluster):
+    client = ClusterClient(cluster)
+    a, b = cluster.nodes
+    slot = key_slot('foo')
+    assert slot in b.slots
+    # the slot moved to a, the snapshot of the client is stale
+    b.slots = [s for s in b.slots if s != slot]
+    a.slots = a.slots + [slot]
+    assert client.execute_command('SET', 'foo', 'bar') is True
+    assert a.data == {'foo': 'bar'}
+    assert cluster.refreshes == 2
+
+
+def test_ask_during_migration(cluster):
+    client = ClusterClient(cluster)
+    a, b = cluster.nodes
+    slot = key_slot('foo')
+    b.data['{foo}old'] = 'kept'
+    b.migrating[slot] = 'a:1'
+    a.importing.add(slot)
+    pipe = client.pipeline()
+    pipe.execute_command('GET', '{foo}old')
+    pipe.execute_command('SET', 'foo', 'new')
+    assert pipe.execute() == ['kept', True]
+    assert a.data == {'foo': 'new'}
+    # ASK does not change the slot map
+    assert cluster.refreshes == 1
+
+
+def test_errors_after_max_redirects(cluster):
+    client = ClusterClient(cluster, max_redirects=2)
+    a, b = cluster.nodes
+    b.error = redis.ConnectionError('connection refused')
+    pipe = client.pipeline()
+    # foo is served by b, bar by a
+    pipe.execute_command('SET', 'foo', 1)
+    pipe.execute_command('SET', 'bar', 1)
+    replies = pipe.execute(raise_on_error=False)
+    assert isinstance(replies[0], redis.ConnectionError)
+    assert replies[1] is True
+    assert (a.pipelines, b.pipelines) == (1, 3)
+    # the slot map is read from a, the dead b is not asked for it
+    assert cluster.refreshes == 3
+    with pytest.raises(redis.ConnectionError):
+        client.execute_command('GET', 'foo')
+
+
+def test_slot_moved_to_a_new_master(cluster):
+    client = ClusterClient(cluster)
+    a, b = cluster.nodes
+    c = KeyNode('c:1', [])
+    cluster.add(c)
+    slot = key_slot('foo')
+    b.slots = [s for s in b.slots if s != slot]
+    c.slots = [slot]
+    assert client.execute_command('SET', 'foo', 'bar') is True
+    assert client.owners.owner(slot) is c
+    # the next keys of the slot go straight to c
+    assert client.execute_command('SET', '{foo}2', 'bar') is True
+    assert (b.pipelines, c.pipelines) == (1, 2)
+    assert sorted(c.data) == ['foo', '{foo}2']
+
+
+def test_slot_map_of_any_node_answering(cluster):
+    a, b = cluster.nodes
+    a.error = redis.ConnectionError('connection refused')
+    client = ClusterClient(cluster)
+    assert client.owners.owner(0) is a
+    assert cluster.refreshes == 1
+
+    b.error = a.error
+    with pytest.raises(redis.ConnectionError):
+        ClusterClient(cluster)
+    # the old map is kept
+    assert not client.refresh()
+    assert client.owners.owner(0) is a
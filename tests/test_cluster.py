@@ -124,6 +124,66 @@ def test_distribute():
         assert master_map[s.unassigned_master].host != s.host
 
 
+def test_slot_balance_weighted():
+    from ruskit.cluster import slot_balance
+
+    small, big, new = MockNode('small', [], 'master'), \
+        MockNode('big', [], 'master'), MockNode('new', [], 'master')
+    seq = [{"node": small, "count": 8192, "need": []},
+           {"node": big, "count": 8192, "need": []},
+           {"node": new, "count": 0, "need": []}]
+    weights = {'small': 1, 'big': 4, 'new': 3}
+    seq = slot_balance(seq, 16384, weights)
+    counts = {x["node"].name: x["count"] for x in seq}
+    assert counts == {'small': 2048, 'big': 8192, 'new': 6144}
+    needs = {x["node"].name: x["need"] for x in seq}
+    # only the slots over the share of small move, big keeps all of them
+    assert needs['new'] == [(small, 6144)]
+    assert needs['big'] == []
+
+
+def test_fill_shares():
+    from ruskit.cluster import fill_shares
+    assert fill_shares([10, 0, 5], [10, 20, 10], 10) == [0, 10, 0]
+    assert fill_shares([10, 0, 5], [10, 20, 10], 20) == [0, 18, 2]
+
+
+class ReplicaNode(object):
+    def __init__(self, name, host, master=None, offset=0, link='up'):
+        self.name = name
+        self.host = host
+        self.port = 7000
+        self.master = master
+        self.replication = {'master_link_status': link,
+                            'master_sync_in_progress': 0,
+                            'slave_repl_offset': offset}
+
+    def is_master(self):
+        return self.master is None
+
+    def is_slave(self, master_id=None):
+        return self.master is not None and \
+            master_id in (None, self.master)
+
+    def info(self, section):
+        return self.replication
+
+    def flush_cache(self):
+        pass
+
+
+def test_best_replica():
+    m1, m2 = ReplicaNode('m1', 'h1'), ReplicaNode('m2', 'h2')
+    behind = ReplicaNode('s1', 'h3', 'm1', offset=10)
+    ahead = ReplicaNode('s2', 'h3', 'm1', offset=20)
+    down = ReplicaNode('s3', 'h4', 'm1', offset=30, link='down')
+    crowded = ReplicaNode('s4', 'h2', 'm1', offset=40)
+    cluster = Cluster([m1, m2, behind, ahead, down, crowded])
+    # h2 already has its share of the 2 masters over 4 hosts
+    assert cluster.best_replica(m1) is ahead
+    assert cluster.best_replica(m2) is None
+
+
 class TestCluster(TestCaseBase):
 
     def clear_slots(node):
@@ -143,6 +203,14 @@ class TestCluster(TestCaseBase):
         self.assert_exec_cmd(b, 'CLUSTER FORGET', a.name)
         self.assert_exec_cmd(c, 'CLUSTER FORGET', a.name)
 
+    @patch.object(Cluster, 'migrate_node', side_effect=clear_slots)
+    def test_drain_without_replica(self, migrate_node):
+        cluster = self.cluster
+        a = cluster.nodes[0]
+        cluster.delete_node(a, drain=True)
+        migrate_node.assert_called_with(a)
+        self.assert_no_exec(a, 'CLUSTER FAILOVER')
+
     @patch.object(Cluster, 'migrate_slot')
     def test_fix_node_migrating(self, migrate_slot):
         cluster = self.cluster
@@ -0,0 +1,125 @@
+import collections
+
+import pytest
+from mock import patch
+
+from ruskit.cmds.create import Manager, PlacementError
+from ruskit.cluster import ClusterNotHealthy
+from ruskit.utils import spread
+from test_base import TestCaseBase, MockNewNode, patch_not_used
+
+
+class TestCreate(TestCaseBase):
+
+    @patch_not_used
+    def gen_manager(self, version='3.0.3'):
+        manager = Manager(0, self.uris[3:])
+        for i in manager.instances:
+            i.node.r = MockNewNode(i.node)
+        manager.redis_version = version
+        manager.init_slots()
+        return manager
+
+    def test_set_slots(self):
+        manager = self.gen_manager()
+        manager.set_slots()
+        first = manager.masters[0]
+        self.assert_exec_cmd(first, 'CLUSTER ADDSLOTS', *range(0, 5462))
+
+    def test_set_slots_range(self):
+        manager = self.gen_manager('7.0.11')
+        manager.set_slots()
+        for master, (start, end) in zip(manager.masters, [
+                (0, 5461), (5462, 10922), (10923, 16383)]):
+            self.assert_exec_cmd(master, 'CLUSTER ADDSLOTSRANGE', start, end)
+
+    def test_join_cluster(self):
+        manager = self.gen_manager()
+        manager.assign_config_epoch()
+        manager.join_cluster()
+        first = manager.instances[0]
+        for epoch, i in enumerate(manager.instances, 1):
+            self.assert_exec_cmd(i, 'CLUSTER SET-CONFIG-EPOCH', epoch)
+        for i in manager.instances[1:]:
+            self.assert_exec_cmd(i, 'CLUSTER MEET', first.host, first.port)
+
+    def test_wait_until(self):
+        manager = self.gen_manager()
+        polled = []
+
+        def _check(node):
+            polled.append(node)
+            return node is not manager.instances[0] or len(polled) > 3
+
+        with patch('time.sleep'):
+            manager._wait_until(_check, manager.instances, progress=False)
+        # converged nodes are not polled again
+        self.assertEqual(len(polled), 4)
+
+        with self.assertRaises(ClusterNotHealthy):
+            manager._wait_until(lambda n: False, manager.instances,
+                                timeout=0, progress=False)
+
+
+class MockInstance(object):
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.name = '{}:{}'.format(host, port)
+
+
+def gen_placement(slave_count, layout, topology=None):
+    manager = Manager.__new__(Manager)
+    manager.slave_count = slave_count
+    manager.topology = topology
+    nodes = collections.defaultdict(list)
+    for host, count in layout.items():
+        for port in range(count):
+            nodes[host].append(MockInstance(host, port))
+    master_count = sum(layout.values()) // (slave_count + 1)
+    masters = spread(nodes, master_count)
+    slaves = sum(nodes.values(), [])
+    return masters, slaves, manager.distribute_slaves(masters, slaves)
+
+
+def test_distribute_slaves_anti_affinity():
+    layout = {'host{}'.format(i): 10 for i in range(100)}
+    masters, slaves, plan = gen_placement(2, layout)
+    assert len(plan) == len(slaves) == 667
+    counts = collections.Counter(m.name for m, _ in plan)
+    assert len(counts) == len(masters)
+    assert set(counts.values()) == {2, 3}
+    for m, s in plan:
+        assert m.host != s.host
+
+
+def test_distribute_slaves_lopsided():
+    masters, slaves, plan = gen_placement(
+        1, {'host0': 4, 'host1': 4, 'host2': 1})
+    assert len(plan) == 5
+    for m, s in plan:
+        assert m.host != s.host
+
+
+def test_distribute_slaves_impossible():
+    with pytest.raises(PlacementError) as e:
+        gen_placement(1, {'host0': 10, 'host1': 1, 'host2': 1})
+    assert e.value.missing
+
+
+def test_distribute_slaves_leftovers():
+    masters, slaves, plan = gen_placement(2, {'host0': 6, 'host1': 5})
+    assert len(plan) == len(slaves) == 8
+    for m, s in plan:
+        assert m.host != s.host
+
+
+def test_distribute_slaves_unplaced():
+    manager = Manager.__new__(Manager)
+    manager.slave_count = 1
+    manager.topology = None
+    masters = [MockInstance('host0', port) for port in range(3)]
+    slaves = [MockInstance('host0', 3), MockInstance('host1', 0)]
+    with pytest.raises(PlacementError) as e:
+        manager.distribute_slaves(masters, slaves)
+    assert e.value.unplaced == [('host0', 1)]
@@ -0,0 +1,82 @@
+import random
+
+from ruskit.cmds.analyze import format_mix
+from ruskit.estimate import estimate_node, slot_table, total, ttl_bucket, \
+    wilson
+from test_base import FakeNode
+
+
+class SampleNode(FakeNode):
+    def __init__(self, data, slots):
+        # key -> (size, type, ttl)
+        super(SampleNode, self).__init__('sample', slots, data=data)
+        self.random = random.Random(42)
+
+    def reply(self, command, *args):
+        if command == 'RANDOMKEY':
+            return self.random.choice(sorted(self.data)) if self.data \
+                else None
+        if command == 'CLUSTER COUNTKEYSINSLOT':
+            return 10
+        size, type_, ttl = self.data[args[0]]
+        return {'MEMORY USAGE': size, 'TYPE': type_, 'TTL': ttl}[command]
+
+    def dbsize(self):
+        return len(self.data)
+
+
+def test_ttl_bucket():
+    assert ttl_bucket(None) == 'none'
+    assert ttl_bucket(-1) == 'none'
+    assert ttl_bucket(30) == '<1m'
+    assert ttl_bucket(600) == '<1h'
+    assert ttl_bucket(7200) == '<1d'
+    assert ttl_bucket(10 ** 6) == '>=1d'
+
+
+def test_estimate_node():
+    data = {}
+    for i in xrange(1000):
+        if i % 4:
+            data['s:{}'.format(i)] = (100, 'string', None)
+        else:
+            data['h:{}'.format(i)] = (500, 'hash', 30)
+    node = SampleNode(data, [0, 1, 2])
+    e = estimate_node(node, samples=400)
+    assert len(e.samples) == 400
+    # 200000 bytes in total
+    assert abs(e.memory - 200000) < e.interval()
+    assert 0 < e.interval() < 30000
+    assert abs(e.mix(e.types)['hash'] - 0.25) < 0.1
+    assert sorted(e.mix(e.ttls)) == ['<1m', 'none']
+    low, high = e.mix_intervals(e.types)['hash']
+    assert low < e.mix(e.types)['hash'] < high
+    assert 0.03 < high - low < 0.1
+
+    memory, interval = total([e, e])
+    assert memory == 2 * e.memory
+    assert e.interval() < interval < 2 * e.interval()
+
+    table = slot_table([e])
+    assert table.sizes() == dict((s, int(round(10 * e.mean)))
+                                 for s in (0, 1, 2))
+    assert table.keys[0] == 10
+    assert table.types['hash'][0] + table.types['string'][0] == 10
+
+
+def test_estimate_empty_node():
+    e = estimate_node(SampleNode({}, []))
+    assert e.memory == 0 and e.interval() == 0
+    assert slot_table([e]).sizes() == {}
+
+
+def test_wilson():
+    low, high = wilson(50, 100)
+    assert round(low, 4) == 0.4038 and round(high, 4) == 0.5962
+    # never below 0 for a type missing from the sample
+    low, high = wilson(0, 10)
+    assert low == 0 and round(high, 4) == 0.2775
+    assert wilson(0, 0) == (0, 1)
+    assert format_mix({'string': 0.75, 'hash': 0.25}, ['string', 'hash'],
+                      {'string': (0.71, 0.79), 'hash': (0.21, 0.29)}) == \
+        'string:75% [71%-79%] hash:25% [21%-29%]'
@@ -0,0 +1,68 @@
+import redis
+from mock import patch
+
+from ruskit import cli
+from ruskit.cmds.manage import destroy
+from ruskit.fanout import FanoutExecutor, summarize
+from test_base import TestCaseBase, patch_not_used
+
+
+class TestFanout(TestCaseBase):
+
+    def setUp(self):
+        super(TestFanout, self).setUp()
+        slave = self.new_nodes[0]
+        slave._cached_node_info = {'flags': ['slave']}
+        self.cluster.nodes.append(slave)
+
+    def test_role_filter(self):
+        executor = FanoutExecutor(self.cluster, 'masters')
+        self.assertEqual(len(executor.nodes), 3)
+        executor.role = 'slaves'
+        self.assertEqual(executor.nodes, [self.new_nodes[0]])
+        executor.role = 'all'
+        self.assertEqual(len(executor.nodes), 4)
+
+    def test_execute(self):
+        executor = FanoutExecutor(self.cluster, 'masters', workers=2)
+        results = list(executor.execute('FLUSHALL', 'ASYNC'))
+        self.assertEqual(len(results), 3)
+        for n in self.cluster.masters:
+            self.assert_exec_cmd(n, 'FLUSHALL', 'ASYNC')
+        self.assert_no_exec(self.new_nodes[0], 'FLUSHALL', 'ASYNC')
+
+    def test_summarize(self):
+        a, b, c = self.cluster.masters
+
+        def _func(node):
+            if node is c:
+                raise redis.ResponseError('ERR unknown command')
+            return 42
+
+        results = list(FanoutExecutor(self.cluster, 'masters').run(_func))
+        self.assertEqual(len([r for r in results if not r.ok]), 1)
+        groups = summarize(results)
+        self.assertEqual(groups[0][0], '42')
+        self.assertEqual(set(groups[0][1]), {a, b})
+        self.assertEqual(groups[1][0], '(error) ERR unknown command')
+        self.assertEqual(groups[1][1], [c])
+
+    @patch_not_used
+    def test_destroy_stops_on_flush_error(self):
+        a = self.cluster.masters[0]
+        a.r.execute_command.side_effect = redis.ConnectionError('timeout')
+
+        ctx = cli.Context()
+        args = type('Args', (), {'cluster': 'host0:6000', 'async_flush': True,
+                                 'concurrency': 4, 'node_timeout': None,
+                                 'timeout': 1})
+        # the node retries a failed command every second
+        with patch('ruskit.cluster.time.sleep'), \
+                patch('ruskit.cmds.manage.Cluster.from_node',
+                      return_value=self.cluster):
+            with patch.object(ctx, 'abort') as abort:
+                destroy.func(ctx, args)
+        abort.assert_called_once_with(
+            '1 masters failed to flush, cluster not reset.')
+        for n in self.cluster.nodes:
+            self.assert_no_exec(n, 'CLUSTER RESET', 'HARD')
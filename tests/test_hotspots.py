@@ -0,0 +1,71 @@
+import redis
+
+from ruskit.hotspots import HeatMap, sample_lfu, parse_monitor_line, \
+    plan_hot_moves, master_heat
+from ruskit.slots import key_slot
+from test_base import FakeNode
+
+
+class FreqNode(FakeNode):
+    def __init__(self, freqs, page=2):
+        super(FreqNode, self).__init__('freq')
+        self.freqs = freqs
+        self.page = page
+
+    def scan(self, cursor, count=None):
+        keys = sorted(self.freqs) + ['gone']
+        cursor = int(cursor)
+        end = cursor + self.page
+        return (0 if end >= len(keys) else end), keys[cursor:end]
+
+    def reply(self, *args):
+        return self.freqs.get(args[-1], redis.ResponseError('no such key'))
+
+
+def test_sample_lfu():
+    node = FreqNode({'a': 10, 'b': 3, '{a}x': 5})
+    heat_map = sample_lfu(node)
+    assert heat_map.top_keys(2) == [('a', 10), ('{a}x', 5)]
+    assert heat_map.slots[key_slot('a')] == 15
+    assert sum(heat_map.slots) == 18
+    assert sample_lfu(node, max_keys=2).keys.keys() == ['a', 'b']
+
+
+def test_parse_monitor_line():
+    assert parse_monitor_line(
+        '1339518083.107412 [0 127.0.0.1:60866] "GET" "k\\"ey"') == 'k"ey'
+    assert parse_monitor_line(
+        '1339518083.107412 [0 127.0.0.1:60866] "PING"') is None
+
+
+def test_heat_map_save_and_load(tmpdir):
+    heat_map = HeatMap()
+    heat_map.add('\xff\x00key', 7)
+    heat_map.add('other', 2)
+    path = str(tmpdir.join('heat.json'))
+    heat_map.save(path)
+    loaded = HeatMap.load(path)
+    assert loaded.top_keys(2) == [('\xff\x00key', 7), ('other', 2)]
+    assert list(loaded.slots) == list(heat_map.slots)
+    assert len(heat_map.render()) == 128
+
+
+def test_plan_hot_moves():
+    heat_map = HeatMap()
+    for slot, heat in [(0, 50), (1, 30), (2, 20), (3, 1), (4, 1), (5, 1)]:
+        heat_map.slots[slot] = heat
+    a, b, c = FakeNode('a', [0, 1, 2]), FakeNode('b', [3, 4]), \
+        FakeNode('c', [5])
+    moves = plan_hot_moves([a, b, c], heat_map)
+
+    owners = {a: {0, 1, 2}, b: {3, 4}, c: {5}}
+    for m in moves:
+        owners[m.src] -= set(m.slots)
+        owners[m.dst] |= set(m.slots)
+    # the three hot slots end up on three different masters
+    assert sorted(len(owned & {0, 1, 2}) for owned in owners.values()) == \
+        [1, 1, 1]
+    heat = master_heat([FakeNode(n.name, owners[n]) for n in (a, b, c)],
+                       heat_map)
+    assert max(heat.values()) == 50
+    assert plan_hot_moves([a, b, c], heat_map, max_moves=1)[0].slots == [0]
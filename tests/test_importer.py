@@ -0,0 +1,100 @@
+import os
+import struct
+import time
+
+import pytest
+
+from ruskit.importer import RdbImporter, ImportFailed
+from ruskit.rdb import RdbReader, crc64, dump_payload, TYPE_STRING, \
+    TYPE_LIST, CRC64_TABLE, _crc64
+from ruskit.slots import key_slot
+from test_base import FakeNode, FakeCluster
+from test_rdb import rdb_file, entry, string, length, LIST_VALUE
+
+
+class RestoreNode(FakeNode):
+    def __init__(self, name, slots, broken=False):
+        super(RestoreNode, self).__init__(name, slots)
+        if broken:
+            self.error = IOError('connection refused')
+
+    def reply(self, command, key, ttl, payload, replace):
+        self.data[key] = (ttl, payload)
+        return 'OK'
+
+
+def two_masters(broken=False):
+    return FakeCluster([RestoreNode('a', range(0, 8192), broken),
+                       RestoreNode('b', range(8192, 16384), broken)])
+
+
+def keys_file(tmpdir, count=50):
+    now = int(time.time() * 1000)
+    entries = [entry(TYPE_STRING, string('key:{}'.format(i)),
+                     string('v' * i)) for i in xrange(count)]
+    entries.append(entry(TYPE_LIST, string('list'), LIST_VALUE,
+                         expire=now + 3600 * 1000))
+    entries.append(entry(TYPE_STRING, string('expired'), string('v'),
+                         expire=now - 1000))
+    # a key of db 1
+    entries.append('\xfe' + length(1) +
+                   entry(TYPE_STRING, string('other'), string('v')))
+    return rdb_file(tmpdir, entries)
+
+
+def test_dump_payload():
+    assert crc64('123456789') == 0xe9c6d914c4b8d9ca
+    payload = dump_payload(TYPE_STRING, string('hello'), 9)
+    assert payload[:7] == '\x00\x05hello'
+    assert struct.unpack('<H', payload[7:9]) == (9,)
+    assert struct.unpack('<Q', payload[9:]) == (crc64(payload[:9]),)
+
+
+def test_crc64_slices():
+    def reference(data, crc=0):
+        for byte in bytearray(data):
+            crc = CRC64_TABLE[(crc ^ byte) & 0xff] ^ (crc >> 8)
+        return crc
+
+    assert _crc64('123456789') == 0xe9c6d914c4b8d9ca
+    for size in (0, 1, 7, 8, 9, 63, 1000):
+        data = os.urandom(size)
+        assert _crc64(data) == crc64(data) == reference(data)
+        assert _crc64(data[3:], _crc64(data[:3])) == reference(data)
+
+
+def test_import(tmpdir):
+    path = keys_file(tmpdir)
+    cluster = two_masters()
+    importer = RdbImporter(cluster, path, batch_size=7, queued=1)
+    writers = importer.run()
+    a, b = cluster.masters
+    assert sum(w.restored for w in writers) == 51
+    assert (importer.expired, importer.skipped) == (1, 1)
+    for node in (a, b):
+        assert node.data
+        assert all(key_slot(k) in node.slots for k in node.data)
+    restored = dict(a.data, **b.data)
+    assert restored['key:3'] == (0, dump_payload(TYPE_STRING, string('vvv'),
+                                                 9))
+    assert 0 < restored['list'][0] <= 3600 * 1000
+    assert not tmpdir.join('dump.rdb.checkpoint').exists()
+
+
+def test_resume_after_failure(tmpdir):
+    path = keys_file(tmpdir)
+    importer = RdbImporter(two_masters(broken=True), path,
+                           checkpoint_interval=0)
+    with pytest.raises(ImportFailed):
+        importer.run()
+
+    # the import had reached key:45 before it was interrupted
+    with RdbReader(path) as reader:
+        entries = list(reader.entries())
+        importer.save_checkpoint(reader.size, entries[45].end, 0)
+    cluster = two_masters()
+    importer = RdbImporter(cluster, path)
+    importer.run()
+    restored = sorted(k for m in cluster.masters for k in m.data)
+    assert restored == sorted(['key:46', 'key:47', 'key:48', 'key:49',
+                               'list'])
@@ -0,0 +1,103 @@
+import collections
+import random
+
+from ruskit.maxflow import Graph
+
+
+def check_conservation(g, mf, s, t):
+    balance = [0] * g.vcount()
+    for e in g.es:
+        f = mf.flow[e.index]
+        assert 0 <= f <= g[e.source, e.target]
+        balance[e.source] -= f
+        balance[e.target] += f
+    for v, b in enumerate(balance):
+        if v == s:
+            assert b == -mf.value
+        elif v == t:
+            assert b == mf.value
+        else:
+            assert b == 0
+
+
+def reference_maxflow(capacity, n, s, t):
+    '''A plain Edmonds-Karp on a capacity matrix'''
+    residual = [row[:] for row in capacity]
+    value = 0
+    while True:
+        parent = [-1] * n
+        parent[s] = s
+        queue = collections.deque([s])
+        while queue and parent[t] < 0:
+            u = queue.popleft()
+            for v in range(n):
+                if parent[v] < 0 and residual[u][v] > 0:
+                    parent[v] = u
+                    queue.append(v)
+        if parent[t] < 0:
+            return value
+        path, v = [], t
+        while v != s:
+            path.append((parent[v], v))
+            v = parent[v]
+        f = min(residual[u][v] for u, v in path)
+        for u, v in path:
+            residual[u][v] -= f
+            residual[v][u] += f
+        value += f
+
+
+def test_maxflow():
+    g = Graph(6)
+    for (i, j), c in {
+            (0, 1): 10, (0, 2): 10, (1, 2): 2, (1, 3): 4, (1, 4): 8,
+            (2, 4): 9, (3, 5): 10, (4, 3): 6, (4, 5): 10}.items():
+        g[i, j] = c
+    mf = g.maxflow(0, 5, g.es['weight'])
+    assert mf.value == 19
+    check_conservation(g, mf, 0, 5)
+
+
+def test_zero_capacity_edge_not_created():
+    g = Graph(3)
+    g[0, 1] = 0
+    g[1, 2] = 3
+    assert g.ecount() == 1
+    assert g.get_eid(0, 1, error=False) == -1
+    assert g.maxflow(0, 2).value == 0
+
+
+def test_augment():
+    g = Graph(4)
+    g[0, 1] = 5
+    g[1, 2] = 5
+    g[2, 3] = 2
+    mf = g.maxflow(0, 3)
+    assert mf.value == 2
+    flow = mf.flow[g.get_eid(2, 3)]
+    g[2, 3] = 4
+    mf = g.augment(0, 3)
+    assert mf.value == 4
+    assert mf.flow[g.get_eid(2, 3)] >= flow
+
+
+def test_random_bipartite():
+    random.seed(7)
+    for _ in range(20):
+        ct = random.randint(3, 15)
+        s, t = 2 * ct, 2 * ct + 1
+        n = 2 * ct + 2
+        g = Graph(n)
+        capacity = [[0] * n for _ in range(n)]
+        for i in range(ct):
+            capacity[s][i] = random.randint(0, 5)
+            capacity[ct + i][t] = random.randint(0, 5)
+            for j in range(ct):
+                if i != j:
+                    capacity[i][ct + j] = random.randint(0, 3)
+        for i in range(n):
+            for j in range(n):
+                g[i, j] = capacity[i][j]
+        mf = g.maxflow(s, t)
+        check_conservation(g, mf, s, t)
+        assert mf.value == reference_maxflow(capacity, n, s, t)
@@ -0,0 +1,114 @@
+import threading
+import time
+
+import pytest
+
+from ruskit.cluster import Cluster
+from ruskit.migration import plan_evacuation, plan_expansion, \
+    MigrationScheduler, SlotMove, EvacuationError, MigrationFailed
+from ruskit.utils import divide
+from test_base import FakeNode
+
+
+def test_plan_evacuation():
+    a = FakeNode('a', range(0, 40))
+    b = FakeNode('b', range(40, 60))
+    c = FakeNode('c', range(60, 70))
+    d = FakeNode('d', range(70, 100))
+    moves = plan_evacuation([a, b, c, d], {'a', 'd'})
+
+    assert all(m.src in (a, d) and m.dst in (b, c) for m in moves)
+    received = {'b': 20, 'c': 10}
+    moved = set()
+    for m in moves:
+        received[m.dst.name] += len(m.slots)
+        moved.update(m.slots)
+    assert received == {'b': 50, 'c': 50}
+    assert moved == set(range(0, 40) + range(70, 100))
+
+    with pytest.raises(EvacuationError):
+        plan_evacuation([a], {'a'})
+
+
+def test_plan_expansion():
+    masters = []
+    start = 0
+    for i, count in enumerate(divide(16384, 30)):
+        masters.append(FakeNode('m{:02}'.format(i),
+                                range(start, start + count)))
+        start += count
+    new = [FakeNode('n{}'.format(i), []) for i in range(10)]
+    moves = plan_expansion(masters, new)
+
+    assert all(m.src in masters and m.dst in new for m in moves)
+    owned = {m.name: len(m.slots) for m in masters + new}
+    for m in moves:
+        owned[m.src.name] -= len(m.slots)
+        owned[m.dst.name] += len(m.slots)
+    assert sorted(set(owned.values())) == [409, 410]
+    # exactly the slots the new masters need
+    assert sum(len(m.slots) for m in moves) == \
+        sum(owned[n.name] for n in new)
+    moved = [s for m in moves for s in m.slots]
+    assert len(moved) == len(set(moved))
+
+
+class MigratingCluster(object):
+    def __init__(self, fail_slot=None, masters=()):
+        self.fail_slot = fail_slot
+        self.masters = list(masters)
+        self.migrated = []
+        self.running = {}
+        self.peak = 0
+        self.flushed = 0
+        self.lock = threading.Lock()
+
+    def flush_all_cache(self):
+        # the workers must be done
+        assert not any(self.running.values())
+        self.flushed += 1
+
+    def migrate_slot(self, src, dst, slot, verbose=True, masters=None):
+        assert masters == self.masters
+        if slot == self.fail_slot:
+            raise ValueError('broken')
+        with self.lock:
+            for n in (src.name, dst.name):
+                self.running[n] = self.running.get(n, 0) + 1
+                self.peak = max(self.peak, self.running[n])
+        time.sleep(0.01)
+        with self.lock:
+            for n in (src.name, dst.name):
+                self.running[n] -= 1
+            self.migrated.append(slot)
+
+
+def test_migration_scheduler():
+    a, b, c, d = [FakeNode(n, []) for n in 'abcd']
+    moves = [SlotMove(a, b, [1, 2]), SlotMove(c, d, [3]),
+             SlotMove(a, d, [4]), SlotMove(c, b, [5])]
+    cluster = MigratingCluster(masters=[a, b, c, d])
+    MigrationScheduler(cluster, per_node=1).run(moves)
+    assert sorted(cluster.migrated) == [1, 2, 3, 4, 5]
+    assert cluster.peak == 1
+    assert cluster.flushed == 1
+
+    cluster = MigratingCluster(fail_slot=3)
+    with pytest.raises(MigrationFailed) as e:
+        MigrationScheduler(cluster).run(moves)
+    assert [m for m, _ in e.value.failed] == [moves[1]]
+    assert sorted(cluster.migrated) == [1, 2, 4, 5]
+    assert cluster.flushed == 1
+
+
+def test_reassign_replicas():
+    m1, m2 = FakeNode('m1', [], 'h1'), FakeNode('m2', [], 'h2')
+    gone = FakeNode('m3', [], 'h3')
+    s1 = FakeNode('s1', [], 'h2', master='m1')
+    o1 = FakeNode('o1', [], 'h1', master='m3')
+    o2 = FakeNode('o2', [], 'h3', master='m3')
+    cluster = Cluster([m1, m2, gone, s1, o1, o2])
+    cluster.reassign_replicas([o1, o2], exclude={'m3'})
+    # o1 avoids its own host, o2 goes to the master with fewer slaves
+    assert o1.replicated == ['m2']
+    assert o2.replicated == ['m1']
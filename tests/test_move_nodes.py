@@ -1,8 +1,13 @@
 import copy
+import threading
+import time
 
-from mock import patch
+import pytest
+import redis
+from mock import patch, Mock
 
-from ruskit.failover import FastAddMachineManager
+from ruskit.failover import FastAddMachineManager, ShardFailover, \
+    FailoverFailed, FAILOVER_MODES
 from ruskit.distribute import RearrangeSlaveManager, NodeWrapper
 from test_base import TestCaseBase
 
@@ -141,3 +146,150 @@ class TestMoveNode(TestCaseBase):
         self.assertTrue(len(nodes_num) <= 2)
         if (len(nodes_num) == 2):
             self.assertTrue(abs(nodes_num[0] - nodes_num[1]) <= 1)
+
+
+class FailoverNode(object):
+    '''A slave becoming master `delay` seconds after CLUSTER FAILOVER,
+    the first `ignored` failovers are lost.
+    '''
+    running = {}
+    peak = {}
+    lock = threading.Lock()
+
+    def __init__(self, host, port, ignored=0, delay=0.05):
+        self.host = host
+        self.port = port
+        self.ignored = ignored
+        self.delay = delay
+        self.promoted_at = None
+        self.failovers = 0
+
+    def failover(self, force=False, takeover=False):
+        self.failovers += 1
+        with self.lock:
+            self.running[self.host] = self.running.get(self.host, 0) + 1
+            self.peak[self.host] = max(self.peak.get(self.host, 0),
+                                       self.running[self.host])
+        if self.failovers > self.ignored:
+            self.promoted_at = time.time() + self.delay
+
+    def role(self):
+        if self.promoted_at is None or time.time() < self.promoted_at:
+            return 'slave'
+        with self.lock:
+            if self.failovers == self.ignored + 1 and \
+                    self.running.get(self.host):
+                self.running[self.host] -= 1
+        return 'master'
+
+    def flush_cache(self):
+        pass
+
+    def __repr__(self):
+        return '{}:{}'.format(self.host, self.port)
+
+
+def test_promote_new_masters():
+    FailoverNode.running.clear()
+    FailoverNode.peak.clear()
+    nodes = [FailoverNode('h{}'.format(i % 2), 7000 + i) for i in range(6)]
+    nodes[0].ignored = 1
+    plan = [{'slave': NodeWrapper(n, 'f', 0),
+             'master': NodeWrapper(None, 'm', 1)} for n in nodes]
+    manager = FastAddMachineManager.__new__(FastAddMachineManager)
+
+    assert manager.promote_new_masters(plan, per_host=2, timeout=0.2) == []
+    assert [n.failovers for n in nodes] == [2, 1, 1, 1, 1, 1]
+    assert all(n.role() == 'master' for n in nodes)
+    assert max(FailoverNode.peak.values()) <= 2
+
+
+def test_promote_new_masters_gives_up():
+    node = FailoverNode('h0', 7000, ignored=10)
+    plan = [{'slave': NodeWrapper(node, 'f', 0),
+             'master': NodeWrapper(None, 'm', 1)}]
+    manager = FastAddMachineManager.__new__(FastAddMachineManager)
+    assert manager.promote_new_masters(plan, retries=2, timeout=0.1) == \
+        [node]
+    assert node.failovers == 2
+
+
+def test_move_masters_reports_still_slaves():
+    node = Mock(**{'gen_addr.return_value': 'h0:7000'})
+    manager = FastAddMachineManager.__new__(FastAddMachineManager)
+    manager.cluster = Mock()
+    manager.new_nodes = []
+    manager.gen_plan = Mock(return_value={'plan': []})
+    manager.add_tmp_slaves = Mock()
+    manager.promote_new_masters = Mock(return_value=[node])
+    with pytest.raises(FailoverFailed) as e:
+        manager.move_masters_to_new_hosts()
+    assert str(e.value) == '1 nodes are still slaves: h0:7000'
+    manager.cluster.wait.assert_called_once_with()
+
+
+class OffsetNode(object):
+    def __init__(self, host, offset, accepted=FAILOVER_MODES,
+                 pause_write=True):
+        self.host = host
+        self.port = 7000
+        self.offset = offset
+        self.accepted = accepted
+        self.pause_write = pause_write
+        self.commands = []
+        self.modes = []
+        self.master = False
+
+    def info(self, section):
+        return {'master_repl_offset': self.offset,
+                'slave_repl_offset': self.offset}
+
+    def execute_command(self, *args):
+        if args[0] == 'CLIENT PAUSE' and not self.pause_write:
+            raise redis.ResponseError('ERR timeout is not an integer or '
+                                      'out of range')
+        self.commands.append(args)
+
+    def failover(self, force=False, takeover=False):
+        mode = 'force' if force else 'takeover' if takeover else 'default'
+        self.modes.append(mode)
+        self.master = mode in self.accepted
+
+    def role(self):
+        return 'master' if self.master else 'slave'
+
+    def __repr__(self):
+        return '{}:{}'.format(self.host, self.port)
+
+
+def test_graceful_failover():
+    master, slave = OffsetNode('h0', 100), OffsetNode('h1', 100)
+    failover = ShardFailover(master, slave, timeout=0.1, pause=500)
+    assert failover.run()
+    assert slave.modes == ['default']
+    assert master.commands == [('CLIENT PAUSE', 500, 'WRITE'),
+                               ('CLIENT UNPAUSE',)]
+    assert failover.lag == 0
+    assert 0 <= failover.window < 1
+    assert 'default failover' in failover.report()
+
+
+def test_graceful_failover_without_pause_write():
+    master = OffsetNode('h0', 100, pause_write=False)
+    slave = OffsetNode('h1', 100)
+    failover = ShardFailover(master, slave, timeout=0.1, pause=500)
+    assert failover.run()
+    # an older server is not paused at all
+    assert master.commands == []
+    assert slave.modes == ['default']
+
+
+def test_graceful_failover_falls_back():
+    master = OffsetNode('h0', 100)
+    slave = OffsetNode('h1', 40, accepted=('takeover',))
+    failover = ShardFailover(master, slave, timeout=0.05, catchup_timeout=0.1)
+    assert failover.run()
+    assert slave.modes == ['default', 'force', 'takeover']
+    assert failover.mode == 'takeover'
+    assert failover.lag == 60
+    assert master.commands == []
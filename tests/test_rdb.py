@@ -0,0 +1,141 @@
+import struct
+
+import pytest
+
+from ruskit.rdb import RdbReader, RdbError, analyze_rdb, lzf_decompress, \
+    approx_memory, key_prefix, TYPE_STRING, TYPE_LIST, TYPE_ZSET, \
+    TYPE_ZSET_2, TYPE_HASH_LISTPACK, TYPE_STREAM_LISTPACKS
+from ruskit.slotmap import SlotTable
+from ruskit.slots import key_slot
+
+
+def length(n):
+    if n < 64:
+        return chr(n)
+    if n < 16384:
+        return chr(0x40 | n >> 8) + chr(n & 0xff)
+    return '\x80' + struct.pack('>I', n)
+
+
+def string(s):
+    return length(len(s)) + s
+
+
+def int_string(i):
+    return '\xc0' + struct.pack('<b', i)
+
+
+def lzf_string(s):
+    # literal runs only, up to 32 bytes each
+    compressed = ''.join(chr(len(s[i:i + 32]) - 1) + s[i:i + 32]
+                         for i in xrange(0, len(s), 32))
+    return '\xc3' + length(len(compressed)) + length(len(s)) + compressed
+
+
+def entry(type_, key, value, expire=None):
+    '''`key` is encoded already, `value` is the serialized value'''
+    head = '' if expire is None else '\xfc' + struct.pack('<Q', expire)
+    return head + chr(type_) + key + value
+
+
+def rdb_file(tmpdir, entries, name='dump.rdb', version=9):
+    data = 'REDIS{:04}'.format(version) + \
+        '\xfa' + string('redis-ver') + string('5.0.0') + \
+        '\xfe' + length(0) + '\xfb' + length(len(entries)) + length(0) + \
+        ''.join(entries) + '\xff' + '\x00' * 8
+    path = tmpdir.join(name)
+    path.write(data, mode='wb')
+    return str(path)
+
+
+LIST_VALUE = length(3) + string('a') + string('bb') + int_string(7)
+ZSET_VALUE = length(2) + string('m1') + string('1.5') + string('m2') + '\xfe'
+ZSET2_VALUE = length(1) + string('m') + struct.pack('<d', 2.5)
+STREAM_VALUE = length(1) + string('\x00' * 16) + string('listpack') + \
+    length(3) + length(100) + length(0) + \
+    length(1) + string('group') + length(100) + length(0) + \
+    length(1) + '\x00' * 16 + '\x00' * 8 + length(1) + \
+    length(1) + string('consumer') + '\x00' * 8 + length(1) + '\x00' * 16
+
+
+def sample_entries():
+    return [
+        entry(TYPE_STRING, string('user:1'), string('hello'),
+              expire=1700000000000),
+        entry(TYPE_LIST, int_string(42), LIST_VALUE),
+        entry(TYPE_ZSET, lzf_string('rank:' + 'x' * 40), ZSET_VALUE),
+        entry(TYPE_ZSET_2, string('rank:2'), ZSET2_VALUE),
+        entry(TYPE_HASH_LISTPACK, string('user:2'), string('l' * 300)),
+        entry(TYPE_STREAM_LISTPACKS, string('events'), STREAM_VALUE),
+    ]
+
+
+def test_lzf_back_reference():
+    assert lzf_decompress('\x02abc\x80\x02', 9) == 'abcabcabc'
+    with pytest.raises(RdbError):
+        lzf_decompress('\x02abc', 4)
+
+
+def test_read_entries(tmpdir):
+    path = rdb_file(tmpdir, sample_entries())
+    with RdbReader(path) as reader:
+        assert reader.version == 9
+        entries = list(reader.entries())
+        assert [e.key for e in entries] == [
+            'user:1', '42', 'rank:' + 'x' * 40, 'rank:2', 'user:2', 'events']
+        assert [e.elements for e in entries] == [0, 3, 2, 1, 0, 1]
+        assert entries[0].expire == 1700000000000
+        assert entries[1].expire is None
+        assert reader.value(entries[0]) == string('hello')
+        assert reader.value(entries[1]) == LIST_VALUE
+        assert reader.value(entries[5]) == STREAM_VALUE
+
+        # resumed from the offset of an entry, its expire included
+        assert list(reader.entries(entries[0].offset)) == entries
+        assert list(reader.entries(entries[4].offset)) == entries[4:]
+
+
+def test_bad_files(tmpdir):
+    path = tmpdir.join('bad.rdb')
+    path.write('not an rdb', mode='wb')
+    with pytest.raises(RdbError):
+        RdbReader(str(path))
+
+    path = rdb_file(tmpdir, sample_entries())
+    data = open(path, 'rb').read()
+    tmpdir.join('cut.rdb').write(data[:len(data) // 2], mode='wb')
+    with RdbReader(str(tmpdir.join('cut.rdb'))) as reader:
+        with pytest.raises(RdbError):
+            list(reader.entries())
+
+
+def test_analyze(tmpdir):
+    paths = [rdb_file(tmpdir, sample_entries()[:3], 'a.rdb'),
+             rdb_file(tmpdir, sample_entries()[3:], 'b.rdb')]
+    report = analyze_rdb(paths, big_keys=2)
+    table = report.table
+    assert sum(table.keys) == 6
+    assert table.keys[key_slot('user:1')] == 1
+    assert table.types['stream'][key_slot('events')] == 1
+
+    prefixes = dict(report.top_prefixes())
+    assert prefixes['user'][0] == 2
+    assert prefixes['rank'][0] == 2
+    assert prefixes[''][0] == 2
+    assert [k for _, k, _ in report.top_keys()] == ['user:2', 'events']
+
+    path = str(tmpdir.join('slots.tsv'))
+    table.save(path)
+    loaded, _ = SlotTable.load(path)
+    assert loaded.sizes() == table.sizes()
+
+
+def test_approx_memory(tmpdir):
+    path = rdb_file(tmpdir, sample_entries())
+    with RdbReader(path) as reader:
+        string_entry, list_entry = list(reader.entries())[:2]
+    assert approx_memory(string_entry) > approx_memory(
+        string_entry._replace(expire=None))
+    assert approx_memory(list_entry) > len(LIST_VALUE) + 3 * 8
+    assert key_prefix('a:b:c') == 'a'
+    assert key_prefix('abc') == ''
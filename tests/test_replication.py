@@ -0,0 +1,200 @@
+from ruskit.replication import SyncJob, SyncLimits, SyncScheduler, \
+    parse_size, serving_syncs, format_eta
+from test_base import FakeNode
+
+
+class SyncNode(FakeNode):
+    def __init__(self, host, port, used_memory=0, replication=None):
+        super(SyncNode, self).__init__('{}:{}'.format(host, port), (),
+                                       host, port)
+        self.used_memory = used_memory
+        self.replication = replication or {'role': 'master'}
+
+    def info(self, section):
+        if section == 'memory':
+            return {'used_memory': self.used_memory}
+        return self.replication
+
+    def __repr__(self):
+        return self.name
+
+
+def gen_jobs(*specs):
+    '''specs of (master host, slave host, size)'''
+    jobs = []
+    for i, (source, target, size) in enumerate(specs):
+        job = SyncJob(SyncNode(target, 7000 + i), SyncNode(source, 6000 + i))
+        job.size = job.left = size
+        jobs.append(job)
+    return jobs
+
+
+def test_parse_size():
+    assert parse_size('512') == 512
+    assert parse_size('2k') == 2048
+    assert parse_size('1.5G') == 3 << 29
+    assert parse_size('8mb') == 8 << 20
+
+
+def test_serving_syncs():
+    info = {
+        'role': 'master',
+        'connected_slaves': 3,
+        'slave0': {'ip': 'a', 'port': 1, 'state': 'online'},
+        'slave1': {'ip': 'b', 'port': 1, 'state': 'send_bulk'},
+        'slave2': {'ip': 'c', 'port': 1, 'state': 'wait_bgsave'},
+    }
+    assert serving_syncs(info) == 2
+    assert serving_syncs(info, {('b', 1)}) == 1
+
+
+def test_admit_biggest_first_per_source_host():
+    jobs = gen_jobs(('m1', 's1', 10), ('m1', 's2', 30), ('m2', 's3', 20))
+    scheduler = SyncScheduler(jobs, SyncLimits(per_source_host=1))
+    admitted = scheduler.admit()
+    assert [j.size for j in admitted] == [30, 20]
+    assert scheduler.admit() == []
+
+    scheduler.finish(admitted[0])
+    assert [j.size for j in scheduler.admit()] == [10]
+
+
+def test_admit_per_target_host():
+    jobs = gen_jobs(('m1', 's1', 30), ('m2', 's1', 20), ('m3', 's2', 10))
+    scheduler = SyncScheduler(jobs, SyncLimits(per_target_host=1))
+    assert [j.size for j in scheduler.admit()] == [30, 10]
+
+
+def test_admit_bytes_in_flight():
+    jobs = gen_jobs(('m1', 's1', 100), ('m2', 's2', 60), ('m3', 's3', 30),
+                    ('m4', 's4', 10))
+    scheduler = SyncScheduler(jobs, SyncLimits(max_bytes=50))
+    # too big for the budget, but nothing else is running
+    assert [j.size for j in scheduler.admit()] == [100]
+    # the next biggest does not fit, smaller ones must not overtake it
+    assert scheduler.admit() == []
+
+    scheduler.running[0].left = 0
+    assert [j.size for j in scheduler.admit()] == []
+    scheduler.finish(scheduler.running[0])
+    assert [j.size for j in scheduler.admit()] == [60]
+
+
+def test_admit_one_at_a_time():
+    jobs = gen_jobs(('m1', 's1', 1), ('m2', 's2', 2))
+    scheduler = SyncScheduler(jobs, SyncLimits.from_mode(fast_mode=False))
+    assert len(scheduler.admit()) == 1
+    assert scheduler.admit() == []
+
+
+def test_estimate_and_poll():
+    jobs = gen_jobs(('m1', 's1', 0), ('m2', 's2', 0))
+    jobs[0].master.used_memory = 100
+    jobs[1].master.used_memory = 300
+    jobs[1].master.replication = {
+        'role': 'master',
+        'slave0': {'ip': 'x', 'port': 1, 'state': 'send_bulk'},
+    }
+    scheduler = SyncScheduler(jobs, SyncLimits(per_source_host=1))
+    scheduler.estimate()
+    assert [j.size for j in scheduler.pending] == [300, 100]
+    # m2 is already serving a full sync
+    assert [j.size for j in scheduler.admit()] == [100]
+
+    job = jobs[0]
+    job.slave.replication = {'role': 'slave', 'master_link_status': 'down',
+                             'master_sync_in_progress': 1,
+                             'master_sync_left_bytes': 40}
+    scheduler.poll()
+    assert job.left == 40
+    assert scheduler.bytes_in_flight == 40
+
+    job.slave.replication = {'role': 'slave', 'master_link_status': 'up',
+                             'master_sync_in_progress': 0}
+    scheduler.poll()
+    assert scheduler.running == []
+    assert scheduler.finished == [job]
+
+
+def syncing(left, last_io=0):
+    return {'role': 'slave', 'master_link_status': 'down',
+            'master_sync_in_progress': 1, 'master_sync_left_bytes': left,
+            'master_sync_last_io_seconds_ago': last_io}
+
+
+def test_progress_and_eta():
+    jobs = gen_jobs(('m1', 's1', 1000), ('m2', 's2', 500), ('m3', 's3', 300))
+    scheduler = SyncScheduler(jobs, SyncLimits(max_syncs=2))
+    first, second = scheduler.admit()
+
+    first.slave.replication = syncing(1000)
+    second.slave.replication = syncing(500)
+    scheduler.poll(now=0)
+    first.slave.replication = syncing(800)
+    second.slave.replication = syncing(400)
+    scheduler.poll(now=2)
+
+    assert first.rate == 100
+    assert first.eta == 8
+    assert second.eta == 8
+    assert scheduler.rate == 150
+    # 800 + 400 in flight and 300 pending at 150 bytes per second
+    assert scheduler.eta == 10
+    lines = scheduler.report()
+    assert lines[0] == '0/3 syncs done, 2 running, 0 failed, 1.2K left ' \
+        'at 150B/s, ETA 00:00:10'
+    assert len(lines) == 3
+    assert format_eta(3725) == '01:02:05'
+
+
+def test_stalled_sync_is_restarted_then_failed():
+    jobs = gen_jobs(('m1', 's1', 100))
+    scheduler = SyncScheduler(jobs, SyncLimits(), stall_timeout=60,
+                              max_retries=1)
+    job, = scheduler.admit()
+
+    job.slave.replication = syncing(50, last_io=5)
+    scheduler.poll(now=0)
+    assert job.slave.replicated == []
+
+    job.slave.replication = syncing(50, last_io=60)
+    scheduler.poll(now=60)
+    assert job.slave.replicated == [job.master.name]
+    assert job.retries == 1
+
+    # the link stays down without any sync in progress
+    job.slave.replication = {'role': 'slave', 'master_link_status': 'down',
+                             'master_sync_in_progress': 0}
+    scheduler.poll(now=70)
+    assert scheduler.running == [job]
+    scheduler.poll(now=130)
+    assert scheduler.running == []
+    assert scheduler.failed == [job]
+    assert scheduler.done
+
+
+def test_loading_slave_is_not_stalled():
+    jobs = gen_jobs(('m1', 's1', 100))
+    scheduler = SyncScheduler(jobs, SyncLimits(), stall_timeout=60)
+    job, = scheduler.admit()
+    job.slave.replication = {'role': 'slave', 'master_link_status': 'down',
+                             'master_sync_in_progress': 0, 'loading': 1}
+    scheduler.poll(now=0)
+    scheduler.poll(now=600)
+    assert scheduler.running == [job]
+    assert job.retries == 0
+
+
+def test_promoted_target_is_restarted_then_failed():
+    jobs = gen_jobs(('m1', 's1', 100))
+    scheduler = SyncScheduler(jobs, SyncLimits(), max_retries=1)
+    job, = scheduler.admit()
+
+    # the target failed over or was reset meanwhile
+    job.slave.replication = {'role': 'master'}
+    scheduler.poll(now=0)
+    assert job.slave.replicated == [job.master.name]
+    assert scheduler.running == [job]
+    scheduler.poll(now=1)
+    assert scheduler.running == []
+    assert scheduler.failed == [job]
@@ -0,0 +1,107 @@
+import os
+import random
+
+from ruskit.migration import plan_expansion
+from ruskit.slotmap import SlotTable, SlotScanner, load_slot_sizes
+from ruskit.slots import key_slot
+from test_base import FakeNode, FakeCluster
+
+
+class ScanNode(FakeNode):
+    def __init__(self, name, data, fail_after=None):
+        super(ScanNode, self).__init__(name, data=data)
+        self.keys = sorted(data)
+        self.fail_after = fail_after
+        self.scans = []
+
+    def scan(self, cursor, count=10):
+        self.scans.append(cursor)
+        if self.fail_after is not None and len(self.scans) > self.fail_after:
+            raise IOError('connection lost')
+        cursor = int(cursor)
+        keys = self.keys[cursor:cursor + count]
+        next_cursor = cursor + count
+        return (next_cursor if next_cursor < len(self.keys) else 0), keys
+
+    def reply(self, command, *args):
+        if command == 'READONLY':
+            return 'OK'
+        if command == 'MEMORY USAGE':
+            return self.data.get(args[0])
+        return 'string' if args[0] in self.data else 'none'
+
+
+def test_save_and_load(tmpdir):
+    path = str(tmpdir.join('slots.tsv'))
+    table = SlotTable()
+    table.add(12182, 100, 'string')
+    table.add(12182, 50, 'hash')
+    table.add(7, 10, 'zset')
+    table.save(path, {'a': 42, 'b': None})
+    loaded, cursors = SlotTable.load(path)
+    assert cursors == {'a': 42, 'b': None}
+    assert list(loaded.rows()) == list(table.rows())
+    assert loaded.types['hash'][12182] == 1
+    assert load_slot_sizes(path) == {7: 10, 12182: 150}
+
+
+def test_scan_and_resume(tmpdir):
+    output = str(tmpdir.join('slots.tsv'))
+    data = dict(('key:{}'.format(i), i) for i in xrange(1, 26))
+    # the key expired between the SCAN and the MEMORY USAGE
+    data['gone'] = None
+    node = ScanNode('a', data, fail_after=2)
+    scanner = SlotScanner(FakeCluster([node]), output, count=10,
+                          checkpoint_interval=0)
+    assert scanner.run() is None
+    assert os.path.exists(scanner.partial)
+    assert not os.path.exists(output)
+
+    node.fail_after = None
+    node.scans = []
+    table = SlotScanner(FakeCluster([node]), output, count=10).run()
+    # resumed from the cursor after the second batch
+    assert node.scans == [20]
+    assert not os.path.exists(scanner.partial)
+    assert sum(table.keys) == 25
+    assert sum(table.bytes) == sum(range(1, 26))
+    assert table.bytes[key_slot('key:7')] >= 7
+    assert load_slot_sizes(output) == table.sizes()
+
+
+def test_expansion_moves_lightest_slots():
+    a = FakeNode('a', range(0, 8))
+    b = FakeNode('b', [])
+    sizes = dict((s, 100) for s in range(8))
+    sizes.update({1: 1, 5: 2, 6: 3, 7: 4})
+    moves = plan_expansion([a], [b], sizes, lightest=True)
+    assert [(m.src, m.dst, m.slots) for m in moves] == [(a, b, [1, 5, 6, 7])]
+    moves = plan_expansion([a], [b])
+    assert moves[0].slots == [4, 5, 6, 7]
+
+
+def test_expansion_moves_byte_shares():
+    a = FakeNode('a', range(0, 8))
+    b = FakeNode('b', [])
+    sizes = dict((s, 100) for s in range(8))
+    sizes.update({1: 1, 5: 2, 6: 3, 7: 4})
+    # 410 bytes, 205 for each
+    moves = plan_expansion([a], [b], sizes)
+    assert [(m.src, m.dst, m.slots) for m in moves] == [(a, b, [0, 2, 6, 7])]
+
+    random.seed(3)
+    masters = [FakeNode('m{}'.format(i), range(i * 4096, (i + 1) * 4096))
+               for i in range(4)]
+    new = [FakeNode('n{}'.format(i), []) for i in range(2)]
+    # the keys are on the first half of every master
+    sizes = dict((s, random.randint(0, 2000) if s % 4096 < 2048 else 0)
+                 for s in range(16384))
+    moves = plan_expansion(masters, new, sizes)
+    received = dict((n.name, [0, 0]) for n in new)
+    for m in moves:
+        received[m.dst.name][0] += len(m.slots)
+        received[m.dst.name][1] += sum(sizes[s] for s in m.slots)
+    share = sum(sizes.values()) / 6.0
+    for count, size in received.values():
+        assert count in (2730, 2731)
+        assert abs(size - share) < 0.01 * share
@@ -0,0 +1,47 @@
+import pytest
+
+from ruskit.slots import crc16, key_slot, key_slots, hash_tag, SlotOwners
+from test_base import FakeNode
+
+
+def test_crc16():
+    assert crc16('123456789') == 0x31c3
+    assert crc16('') == 0
+
+
+def test_key_slot():
+    assert key_slot('foo') == 12182
+    assert key_slot('bar') == 5061
+    assert key_slot(u'foo') == 12182
+    assert key_slot('{user1000}.following') == \
+        key_slot('{user1000}.followers') == key_slot('user1000')
+    assert hash_tag('foo{}{bar}') == 'foo{}{bar}'
+    assert hash_tag('foo{{bar}}zap') == '{bar'
+    assert hash_tag('foo{bar}{zap}') == 'bar'
+
+
+def test_key_slots():
+    keys = ['user:{}:profile'.format(i) for i in xrange(1000)] + \
+        ['{user1000}.following', '{}empty', 'a', '', u'caf\xe9']
+    expected = [key_slot(k) for k in keys]
+    assert list(key_slots(keys, vectorize=False)) == expected
+    assert list(key_slots([bytearray('a'), memoryview('{user1000}x')])) == \
+        [key_slot('a'), key_slot('user1000')]
+
+
+def test_key_slots_numpy():
+    pytest.importorskip('numpy')
+    keys = ['user:{}'.format(i) for i in xrange(1000)] + \
+        ['', 'x' * 100, 'y' * 64, 'z' * 65, '{}'.format(10 ** 30)]
+    assert list(key_slots(keys, vectorize=True)) == \
+        [key_slot(k) for k in keys]
+
+
+def test_slot_owners():
+    a, b = FakeNode('a', range(0, 8000)), FakeNode('b', range(8000, 16000))
+    owners = SlotOwners([a, b])
+    assert owners.missing() == range(16000, 16384)
+    assert owners.owner(0) is a and owners.owner(16383) is None
+    assert owners.key_owner('foo') is b
+    groups = owners.group(['foo', 'bar', '{foo}x'])
+    assert groups == {b: ['foo', '{foo}x'], a: ['bar']}
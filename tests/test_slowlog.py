@@ -0,0 +1,77 @@
+from ruskit.slowlog import fingerprint, percentile, SlowLogAggregator, \
+    SlowLogCursor
+from test_base import TestCaseBase
+
+
+def gen_logs(ids, command='GET user:1', duration=10):
+    return [{'id': i, 'start_time': 0, 'duration': duration,
+             'command': command} for i in sorted(ids, reverse=True)]
+
+
+def test_fingerprint():
+    assert fingerprint('GET user:10086:profile') == 'GET user:*:profile'
+    assert fingerprint('HGETALL {order}.2016-08-01') == \
+        'HGETALL {order}.*-*-*'
+    assert fingerprint('cluster nodes') == 'CLUSTER NODES'
+    assert fingerprint('PING') == 'PING'
+    assert fingerprint('EVALSHA abc 1 lock:42 x') == 'EVALSHA lock:*'
+    assert fingerprint('EVALSHA abc 0') == 'EVALSHA'
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([5], 99) == 5
+    assert percentile([], 99) == 0
+
+
+class TestSlowLog(TestCaseBase):
+
+    def test_get_slow_logs_with_cursor(self):
+        a, b, c = self.cluster.nodes
+        a.r.mock_redis.slowlog_get.return_value = gen_logs(range(5))
+        b.r.mock_redis.slowlog_get.return_value = gen_logs(range(3))
+        c.r.mock_redis.slowlog_get.return_value = []
+
+        cursor = SlowLogCursor()
+        cursor.last_ids[a.gen_addr()] = 2
+        cursor.last_ids[b.gen_addr()] = 5  # slowlog was reset
+        result = self.cluster.get_slow_logs(cursor)
+
+        self.assertEqual([l['id'] for l in result[a]], [4, 3])
+        self.assertEqual([l['id'] for l in result[b]], [2, 1, 0])
+        self.assertEqual(result[c], [])
+        self.assertEqual(cursor.get(a.gen_addr()), 4)
+        self.assertEqual(cursor.get(b.gen_addr()), 2)
+        self.assertEqual(cursor.get(c.gen_addr()), None)
+
+    def test_get_slow_logs_fetch_more(self):
+        a, b, c = self.cluster.nodes
+        b.r.mock_redis.slowlog_get.return_value = []
+        c.r.mock_redis.slowlog_get.return_value = []
+        logs = gen_logs(range(300))
+        a.r.mock_redis.slowlog_get.side_effect = lambda n: logs[:n]
+
+        cursor = SlowLogCursor()
+        cursor.last_ids[a.gen_addr()] = 100
+        result = self.cluster.get_slow_logs(cursor, masters_only=True)
+        self.assertEqual(len(result[a]), 199)
+
+    def test_aggregate(self):
+        a, b, _ = self.cluster.nodes
+        aggregator = SlowLogAggregator()
+        aggregator.add(a, gen_logs(range(3), 'GET user:1', 10))
+        aggregator.add(b, gen_logs(range(2), 'GET user:2', 100))
+        aggregator.add(b, gen_logs(range(5), 'SET order:1 x', 20))
+
+        top = aggregator.top(1)
+        self.assertEqual(len(top), 1)
+        self.assertEqual(top[0].fingerprint, 'GET user:*')
+        self.assertEqual(top[0].count, 5)
+        self.assertEqual(top[0].total, 230)
+        self.assertEqual(top[0].p99, 100)
+        self.assertEqual(len(top[0].nodes), 2)
+
+        top = aggregator.top(2, sort_by='count')
+        self.assertEqual(top[0].fingerprint, 'SET order:*')
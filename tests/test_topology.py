@@ -0,0 +1,131 @@
+import pytest
+
+from ruskit.distribute import MaxFlowSolver, NodeWrapper
+from ruskit.maxflow import Graph
+from ruskit.topology import Topology, InvalidTopology
+
+TOPOLOGY = '''
+# host     rack  zone
+10.0.0.1   r1    az1
+10.0.0.2   r1    az1
+10.0.0.3   r2    az1
+10.0.0.4   r3    az2
+'''
+
+
+@pytest.fixture
+def topology_file(tmpdir):
+    path = tmpdir.join('topology')
+    path.write(TOPOLOGY)
+    return str(path)
+
+
+def test_load(topology_file):
+    topology = Topology.load(topology_file)
+    assert topology.domain('10.0.0.3') == ('r2', 'az1')
+    assert topology.domain('10.0.0.9') == ('host:10.0.0.9', None)
+
+
+def test_load_invalid(tmpdir):
+    path = tmpdir.join('topology')
+    path.write('10.0.0.1 r1\n')
+    with pytest.raises(InvalidTopology):
+        Topology.load(str(path))
+
+
+def test_cost(topology_file):
+    rack = Topology.load(topology_file, 'rack')
+    assert rack.cost('10.0.0.1', '10.0.0.2') == 100
+    assert rack.cost('10.0.0.1', '10.0.0.3') == 1
+    assert rack.cost('10.0.0.1', '10.0.0.4') == 10
+    assert rack.cost('10.0.0.1', '10.0.0.9') == 10
+    zone = Topology.load(topology_file, 'zone')
+    assert zone.cost('10.0.0.1', '10.0.0.4') < \
+        zone.cost('10.0.0.1', '10.0.0.3') < zone.cost('10.0.0.1', '10.0.0.2')
+
+
+def test_min_cost_flow():
+    g = Graph(4)
+    g[0, 1] = 2
+    g[0, 2] = 2
+    g[1, 3] = 2
+    g[2, 3] = 2
+    g[1, 2] = 1
+    g.set_cost(0, 1, 1)
+    g.set_cost(0, 2, 5)
+    g.set_cost(1, 3, 1)
+    g.set_cost(2, 3, 1)
+    g.set_cost(1, 2, 1)
+    mf = g.min_cost_flow(0, 3)
+    assert mf.value == 4
+    assert mf.cost == 2 * 2 + 2 * 6
+    assert mf.flow[g.get_eid(1, 2)] == 0
+
+    # raising capacities creates the residual cycle 0->1->2->0 of cost
+    # -3, the flow is solved again from scratch
+    g[0, 1] = 3
+    g[1, 3] = 3
+    mf = g.min_cost_flow(0, 3)
+    assert mf.value == 5
+    assert mf.cost == 3 * 2 + 2 * 6
+
+
+def test_negative_cycle():
+    g = Graph(3)
+    g[0, 1] = 1
+    g[1, 2] = 1
+    g[2, 1] = 1
+    g.set_cost(1, 2, -1)
+    g.set_cost(2, 1, -1)
+    with pytest.raises(ValueError):
+        g.min_cost_flow(0, 2)
+
+
+def gen_distribution(hosts, masters_per_host, frees_per_host):
+    masters = [[NodeWrapper(None, 'm{}-{}'.format(i, k), i)
+                for k in range(n)] for i, n in enumerate(masters_per_host)]
+    frees = [[NodeWrapper(None, 'f{}-{}'.format(i, k), i)
+              for k in range(n)] for i, n in enumerate(frees_per_host)]
+    return {
+        'hosts': hosts,
+        'masters': masters,
+        'slaves': [[] for _ in hosts],
+        'frees': frees,
+        'max_slaves_limit': 1,
+    }
+
+
+def test_solver_with_topology(topology_file):
+    hosts = ['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.4']
+    dis = gen_distribution(hosts, [1, 0, 1, 0], [0, 1, 0, 1])
+
+    solver = MaxFlowSolver(topology=Topology.load(topology_file, 'rack'),
+                           **dis)
+    result, _ = solver.distribute_slaves()
+    pairs = sorted((hosts[f.host_index], hosts[m.host_index])
+                   for f, m in result)
+    # same zone, other rack
+    assert pairs == [('10.0.0.2', '10.0.0.3'), ('10.0.0.4', '10.0.0.1')]
+
+    dis = gen_distribution(hosts, [1, 0, 1, 0], [0, 1, 0, 1])
+    solver = MaxFlowSolver(topology=Topology.load(topology_file, 'zone'),
+                           **dis)
+    result, _ = solver.distribute_slaves()
+    pairs = sorted((hosts[f.host_index], hosts[m.host_index])
+                   for f, m in result)
+    # only 10.0.0.4 is in another zone, the other slave avoids the rack
+    # of its master
+    assert pairs == [('10.0.0.2', '10.0.0.3'), ('10.0.0.4', '10.0.0.1')]
+
+
+def test_create_with_topology():
+    from test_create import gen_placement
+
+    labels = {'host{}'.format(i): ('r{}'.format(i // 2), 'az1')
+              for i in range(6)}
+    layout = {'host{}'.format(i): 3 for i in range(6)}
+    masters, slaves, plan = gen_placement(2, layout,
+                                          Topology(labels, 'rack'))
+    assert len(plan) == len(slaves)
+    for m, s in plan:
+        assert labels[m.host][0] != labels[s.host][0]
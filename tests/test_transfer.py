@@ -0,0 +1,111 @@
+import json
+
+import pytest
+
+from ruskit.slots import key_slot
+from ruskit.transfer import ClusterCopier, CopyFailed
+from test_base import FakeNode, FakeCluster, patch_connect
+from test_importer import RestoreNode
+
+
+class DumpNode(FakeNode):
+    def __init__(self, name, slots, data, broken=False):
+        # key -> (payload, pttl)
+        super(DumpNode, self).__init__(name, slots, data=dict(
+            (k, v) for k, v in data.iteritems() if key_slot(k) in slots))
+        if broken:
+            self.error = IOError('connection refused')
+        self.listed = []
+
+    def countkeysinslot(self, slot):
+        if self.error is not None:
+            raise self.error
+        return sum(1 for k in self.data if key_slot(k) == slot)
+
+    def getkeysinslot(self, slot, count):
+        self.listed.append(slot)
+        return [k for k in sorted(self.data) if key_slot(k) == slot][:count]
+
+    def reply(self, command, *args):
+        if command == 'READONLY':
+            return 'OK'
+        payload, pttl = self.data.get(args[0], (None, -2))
+        return payload if command == 'DUMP' else pttl
+
+
+def sample_data():
+    '''{key: (payload, raw PTTL)}'''
+    data = dict(('user:{}'.format(i), ('dump-{}'.format(i), -1))
+                for i in xrange(100))
+    data['user:7'] = ('dump-7', 5000)
+    # expiring within the millisecond
+    data['user:9'] = ('dump-9', 0)
+    data.update(('session:{}'.format(i), ('s', -1)) for i in xrange(20))
+    return data
+
+
+def test_copy_to_more_masters(tmpdir):
+    data = sample_data()
+    a = DumpNode('a', range(0, 8192), data)
+    b = DumpNode('b', range(8192, 16384), data)
+    replica = DumpNode('a-replica', a.slots, data)
+    src = FakeCluster([a, b], {'a': replica})
+    dst = FakeCluster([RestoreNode('x', range(0, 5000)),
+                       RestoreNode('y', range(5000, 11000)),
+                       RestoreNode('z', range(11000, 16384))])
+    checkpoint = str(tmpdir.join('copy.json'))
+    copier = ClusterCopier(src, dst, pattern='user:*', checkpoint=checkpoint,
+                           batch_size=3)
+    with patch_connect(dst):
+        copier.run()
+
+    assert copier.copied == 100 and copier.failed == 0
+    # the replica is read instead of its master
+    assert replica.listed and not a.listed
+    copied = {}
+    for node in dst.masters:
+        assert all(key_slot(k) in node.slots for k in node.data)
+        copied.update(node.data)
+    assert sorted(copied) == sorted(k for k in data if k.startswith('user:'))
+    assert copied['user:7'] == (5000, 'dump-7')
+    assert copied['user:8'] == (0, 'dump-8')
+    assert copied['user:9'] == (1, 'dump-9')
+    assert not tmpdir.join('copy.json').exists()
+
+
+def test_skip_expired_after_dump(tmpdir):
+    data = {'gone': ('dump', -2), 'kept': ('dump', -1)}
+    a = DumpNode('a', range(16384), data)
+    dst = FakeCluster([RestoreNode('x', range(16384))])
+    copier = ClusterCopier(FakeCluster([a]), dst,
+                           checkpoint=str(tmpdir.join('copy.json')))
+    with patch_connect(dst):
+        copier.run()
+    assert dst.masters[0].data == {'kept': (0, 'dump')}
+
+
+def test_resume(tmpdir):
+    data = sample_data()
+    broken = DumpNode('b', range(8192, 16384), data, broken=True)
+    a = DumpNode('a', range(0, 8192), data)
+    dst = FakeCluster([RestoreNode('x', range(0, 16384))])
+    checkpoint = str(tmpdir.join('copy.json'))
+    copier = ClusterCopier(FakeCluster([a, broken]), dst,
+                           checkpoint=checkpoint)
+    with patch_connect(dst), pytest.raises(CopyFailed):
+        copier.run()
+    with open(checkpoint) as f:
+        assert json.load(f)['slots'] == range(0, 8192)
+
+    with patch_connect(dst), pytest.raises(CopyFailed):
+        ClusterCopier(FakeCluster([a]), dst, pattern='user:*',
+                      checkpoint=checkpoint).run()
+
+    a.listed = []
+    b = DumpNode('b', range(8192, 16384), data)
+    copier = ClusterCopier(FakeCluster([a, b]), dst, checkpoint=checkpoint)
+    with patch_connect(dst):
+        copier.run()
+    assert not a.listed
+    assert copier.copied == sum(1 for k in data if key_slot(k) >= 8192)
+    assert sorted(dst.masters[0].data) == sorted(data)
@@ -0,0 +1,111 @@
+import json
+
+import pytest
+import redis
+
+from ruskit.replication import SyncJob
+from ruskit.tuning import ReplicationTuning, TuningFailed, \
+    slave_buffer_limit, MIN_BACKLOG
+
+BUFFER_LIMIT = 'normal 0 0 0 slave 268435456 67108864 60 pubsub 0 0 0'
+
+
+class ConfigNode(object):
+    def __init__(self, port, fail_set=False):
+        self.host = 'h'
+        self.port = port
+        self.fail_set = fail_set
+        self.config = {
+            'client-output-buffer-limit': BUFFER_LIMIT,
+            'repl-diskless-sync': 'no',
+            'repl-diskless-sync-delay': '5',
+            'repl-backlog-size': '1048576',
+        }
+
+    def gen_addr(self):
+        return '{}:{}'.format(self.host, self.port)
+
+    def config_get(self, param):
+        return {param: self.config[param]}
+
+    def config_set(self, param, value):
+        if self.fail_set:
+            raise redis.ConnectionError('gone')
+        self.config[param] = value
+
+
+def gen_jobs(*masters):
+    jobs = []
+    for master in masters:
+        job = SyncJob(None, master)
+        job.size = 1 << 30
+        jobs.append(job)
+    return jobs
+
+
+def test_slave_buffer_limit():
+    assert slave_buffer_limit(BUFFER_LIMIT) == 268435456
+    assert slave_buffer_limit('normal 0 0 0 replica 1gb 0 0') == 1 << 30
+    assert slave_buffer_limit('normal 0 0 0') is None
+
+
+def test_settings_never_lower():
+    tuning = ReplicationTuning()
+    original = dict(ConfigNode(1).config)
+    original['repl-backlog-size'] = str(1 << 30)
+    original['client-output-buffer-limit'] = 'slave 0 0 0'
+    assert tuning.settings(original, 0, 1) == {
+        'repl-diskless-sync': 'yes', 'repl-diskless-sync-delay': '0'}
+
+    original = ConfigNode(1).config
+    assert tuning.settings(original, 0, 2) == {
+        'client-output-buffer-limit': 'slave 536870912 0 0',
+        'repl-diskless-sync': 'yes',
+        'repl-backlog-size': str(MIN_BACKLOG)}
+
+
+def test_apply_and_restore(tmpdir):
+    path = str(tmpdir.join('tuning.json'))
+    m1, m2 = ConfigNode(1), ConfigNode(2)
+    tuning = ReplicationTuning(path)
+    tuning.apply(gen_jobs(m1, m1, m2))
+
+    assert m1.config['repl-diskless-sync'] == 'yes'
+    assert m1.config['repl-diskless-sync-delay'] == '5'
+    assert m2.config['repl-diskless-sync-delay'] == '0'
+    assert m1.config['repl-backlog-size'] == str(128 << 20)
+    with open(path) as f:
+        snapshot = json.load(f)
+    assert snapshot['h:1']['client-output-buffer-limit'] == BUFFER_LIMIT
+
+    assert tuning.restore() == ['h:1', 'h:2']
+    assert m1.config == ConfigNode(1).config
+    assert m2.config == ConfigNode(2).config
+    assert not tmpdir.join('tuning.json').check()
+
+
+def test_leftover_snapshot_is_restored_first(tmpdir):
+    path = str(tmpdir.join('tuning.json'))
+    m1 = ConfigNode(1)
+    ReplicationTuning(path).apply(gen_jobs(m1))
+
+    # a crashed run left the snapshot, the next one must not save the
+    # tuned values as the originals
+    tuning = ReplicationTuning(path)
+    tuning.nodes['h:1'] = m1
+    tuning.apply(gen_jobs(m1))
+    tuning.restore()
+    assert m1.config == ConfigNode(1).config
+
+
+def test_failed_restore_is_kept(tmpdir):
+    path = str(tmpdir.join('tuning.json'))
+    m1, m2 = ConfigNode(1), ConfigNode(2)
+    tuning = ReplicationTuning(path)
+    tuning.apply(gen_jobs(m1, m2))
+    m2.fail_set = True
+    with pytest.raises(TuningFailed):
+        tuning.restore()
+    with open(path) as f:
+        assert json.load(f).keys() == ['h:2']
+    assert m1.config == ConfigNode(1).config
@@ -1,6 +1,8 @@
 import collections
 
-from ruskit.utils import spread
+from mock import patch
+
+from ruskit.utils import spread, divide, RateLimiter
 
 
 def test_spread():
@@ -11,3 +13,30 @@ def test_spread():
 
     res = spread(data, 4)
     assert res == [1, 3, 5, 2]
+
+
+def test_divide_weighted():
+    assert divide(10, 3) == [4, 3, 3]
+    assert divide(16384, 3, [1, 1, 2]) == [4096, 4096, 8192]
+    chunks = divide(10, 3, [1, 1, 1])
+    assert sorted(chunks) == [3, 3, 4]
+    assert divide(7, 2, [3, 1]) == [5, 2]
+
+
+@patch('ruskit.utils.time')
+def test_rate_limiter(mock_time):
+    mock_time.time.return_value = 100.0
+    limiter = RateLimiter(1000)
+    # a second of rate goes through at once
+    limiter.acquire(1000)
+    assert not mock_time.sleep.called
+    limiter.acquire(500)
+    mock_time.sleep.assert_called_once_with(0.5)
+
+    # idle, the schedule is restarted
+    mock_time.reset_mock()
+    mock_time.time.return_value = 200.0
+    limiter.acquire(1000)
+    assert not mock_time.sleep.called
+
+    RateLimiter().acquire(10 ** 9)